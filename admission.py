@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+import weakref
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+# ================= ضبط قبول الملفات لكل مستخدم =================
+# - دلو رموز (token bucket) لكل مستخدم: UPLOAD_BURST ملفات متتالية ثم ملف كل UPLOAD_REFILL_SECONDS
+# - حد للمعالجات الجارية لكل مستخدم (USER_MAX_INFLIGHT)
+# - single-flight: توليد نفس الملف بنفس الإعدادات مرة واحدة مهما تكرر الطلب
+# - قفل لكل محادثة حتى تكون انتقالات المراحل آمنة من الضغط المزدوج
+# - مهمة معالجة واحدة لكل محادثة قابلة للإلغاء (/cancel، انتهاء الجلسة، ملف جديد):
+#   الإلغاء يصل لطلبات HTTP الجارية ومهام OCR المنتظرة في الطابور، وfinally يحرر الملفات
+
+UPLOAD_BURST = int(os.getenv("UPLOAD_BURST", 3))
+UPLOAD_REFILL_SECONDS = float(os.getenv("UPLOAD_REFILL_SECONDS", 20))
+USER_MAX_INFLIGHT = int(os.getenv("USER_MAX_INFLIGHT", 1))
+CANCEL_WAIT_SECONDS = 5.0  # أقصى انتظار لانتهاء مهمة ملغاة قبل قبول ملف جديد
+
+
+class TokenBucket:
+    def __init__(self, capacity: int = UPLOAD_BURST, refill_seconds: float = UPLOAD_REFILL_SECONDS):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) / self.refill_seconds)
+        self.stamp = now
+
+    def take(self, now: float = None) -> float:
+        """0 عند القبول، وإلا عدد الثواني حتى يتوفر رمز"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.refill_seconds
+
+    def full(self, now: float = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= self.capacity
+
+
+class Admission:
+    def __init__(self, max_inflight: int = USER_MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.inflight: Counter = Counter()
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self._locks = weakref.WeakValueDictionary()
+        self.tasks: Dict[int, asyncio.Task] = {}  # chat_id -> مهمة المعالجة الجارية
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def allow_upload(self, user_id: int) -> float:
+        """0 إن قُبل الملف، وإلا الثواني المتبقية قبل السماح بملف جديد"""
+        if len(self.buckets) > 10000:
+            # الدلاء الممتلئة لا تحمل معلومة: تُحذف
+            self.buckets = {u: b for u, b in self.buckets.items() if not b.full()}
+        bucket = self.buckets.setdefault(user_id, TokenBucket())
+        return bucket.take()
+
+    def busy(self, user_id: int) -> bool:
+        return self.inflight[user_id] >= self.max_inflight
+
+    @asynccontextmanager
+    async def job(self, user_id: int):
+        self.inflight[user_id] += 1
+        try:
+            yield
+        finally:
+            self.inflight[user_id] -= 1
+            if self.inflight[user_id] <= 0:
+                del self.inflight[user_id]
+
+    def track(self, chat_id: int, task: asyncio.Task, cleanup: Optional[Callable[[], None]] = None) -> asyncio.Task:
+        """cleanup بعد انتهاء المهمة بأي شكل، حتى إن أُلغيت قبل أول خطوة فلم يصل تنفيذها لأي finally"""
+        self.tasks[chat_id] = task
+
+        def _done(t):
+            if self.tasks.get(chat_id) is t:
+                del self.tasks[chat_id]
+            if cleanup is not None:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"⚠️ cleanup failed for chat {chat_id}: {e}")
+        task.add_done_callback(_done)
+        return task
+
+    def cancel(self, chat_id: int) -> Optional[asyncio.Task]:
+        """إلغاء معالجة المحادثة إن وجدت (ليس من داخلها)؛ يُرجع المهمة لمن يريد انتظارها"""
+        task = self.tasks.get(chat_id)
+        if task is None or task.done() or task is asyncio.current_task():
+            return None
+        del self.tasks[chat_id]
+        task.cancel()
+        self.cancelled += 1
+        return task
+
+    async def drain(self, task: Optional[asyncio.Task], timeout: float = CANCEL_WAIT_SECONDS) -> None:
+        """انتظار انتهاء مهمة ملغاة (تنفيذ finally وتحرير مكانها في inflight)"""
+        if task is not None:
+            await asyncio.wait({task}, timeout=timeout)
+
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        # WeakValueDictionary: القفل يُحذف تلقائياً حين لا تستخدمه أي مهمة
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[chat_id] = lock
+        return lock
+
+    async def single_flight(self, key: Hashable, factory: Callable[[], Awaitable]):
+        """أول طلب ينفذ factory، والطلبات المطابقة أثناء تنفيذه تنتظر نفس النتيجة"""
+        while key in self._flights:
+            fut = self._flights[key]
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # أُلغي صاحب الطلب الأول (لا المنتظر): المنتظر يتولى التوليد بنفسه
+                if not fut.cancelled():
+                    raise
+        fut = asyncio.get_running_loop().create_future()
+        self._flights[key] = fut
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # المنتظرون يتلقون الاستثناء؛ بدونهم لا نريد تحذير "never retrieved"
+            fut.exception()
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._flights.pop(key, None)
+
+
+ADMISSION = Admission()
@@ -0,0 +1,142 @@
+"""توليد بنوك الأسئلة لمجلد محاضرات كامل دون المرور بتيليجرام.
+
+python batch.py lectures/ --lang ar --qlang ar --size 30 --out banks.jsonl
+
+- استخراج النص في مجمّع عمليات (--workers) وتوليد الأسئلة بعدد طلبات متزامنة محدود (--llm)
+- ملف manifest يحفظ حالة كل ملف؛ إعادة التشغيل تتخطى ما اكتمل (إلا مع --force)
+- كل ملف سطر JSON في --out، والأسئلة تُحفظ في بنك الأسئلة فيجدها البوت عند رفع نفس الملف
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict
+
+import question_bank
+
+SUFFIXES = (".pdf", ".txt", ".docx", ".pptx", ".jpg", ".jpeg", ".png", ".tif", ".tiff")
+MIXES = {"mix": 0.7, "mcq": 1.0, "tf": 0.0}
+
+
+def _extract(path: str, lang: str) -> str:
+    """يعمل داخل عملية منفصلة: استخراج + تنظيف النص"""
+    from ingest import extract_text_any
+    from preprocess import clean_text
+
+    suffix = os.path.splitext(path)[1].lower()
+    return clean_text(asyncio.run(extract_text_any(path, suffix, lang)))
+
+
+def _load_manifest(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(path: str, manifest: Dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _walk(root: str):
+    for dirpath, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.lower().endswith(SUFFIXES):
+                yield os.path.join(dirpath, name)
+
+
+async def run(args) -> int:
+    from qa_builder import build_quiz_from_text
+    from providers import ROUTER
+    from llm import salvage_report
+
+    if not ROUTER.providers:
+        print("❌ لا يوجد مزوّد للنموذج (GROQ_API_KEY أو LLM_PROVIDERS)")
+        return 1
+
+    manifest_path = args.manifest or os.path.join(args.directory, ".batch_manifest.json")
+    manifest = _load_manifest(manifest_path)
+    settings = {"qlang": args.qlang, "size": args.size, "mix": args.mix}
+
+    todo = []
+    for path in _walk(args.directory):
+        rel = os.path.relpath(path, args.directory)
+        dhash = question_bank.doc_hash_file(path)
+        done = manifest.get(rel)
+        if not args.force and done and done.get("doc_hash") == dhash and done.get("settings") == settings \
+                and done.get("status") in ("done", "empty"):
+            continue
+        todo.append((rel, path, dhash))
+
+    print(f"📚 {len(todo)} ملف للمعالجة ({len(manifest)} في manifest)")
+    if not todo:
+        return 0
+
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(args.llm)
+    stats = {"done": 0, "empty": 0, "failed": 0, "questions": 0}
+    t0 = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, open(args.out, "a", encoding="utf-8") as out:
+
+        async def one(rel: str, path: str, dhash: str):
+            entry = {"doc_hash": dhash, "settings": settings, "updated": datetime.now().isoformat()}
+            try:
+                text = await loop.run_in_executor(pool, _extract, path, args.lang)
+                if not text or len(text) < 400:
+                    entry.update(status="empty", questions=0)
+                else:
+                    async with sem:
+                        questions = await build_quiz_from_text(text, lang=args.qlang, total=args.size,
+                                                               mcq_ratio=MIXES[args.mix])
+                    if questions:
+                        question_bank.store(dhash, args.qlang, questions)
+                        out.write(json.dumps({"file": rel, "doc_hash": dhash, "lang": args.qlang,
+                                              "questions": questions}, ensure_ascii=False) + "\n")
+                        out.flush()
+                    entry.update(status="done" if questions else "failed", questions=len(questions))
+            except Exception as e:
+                entry.update(status="failed", error=str(e)[:200])
+            # التقدم يُحفظ بعد كل ملف: التوقف في المنتصف لا يعيد ما اكتمل
+            manifest[rel] = entry
+            _save_manifest(manifest_path, manifest)
+            stats[entry["status"]] += 1
+            stats["questions"] += entry.get("questions", 0)
+            print(f"  [{entry['status']:6s}] {rel} ({entry.get('questions', 0)} سؤال)")
+
+        try:
+            await asyncio.gather(*(one(*item) for item in todo))
+        finally:
+            await ROUTER.aclose()
+
+    print(f"✅ done={stats['done']} empty={stats['empty']} failed={stats['failed']} "
+          f"questions={stats['questions']} in {time.monotonic() - t0:.0f}s")
+    print(f"🧩 LLM output: {salvage_report()}")
+    return 0 if not stats["failed"] else 2
+
+
+def main():
+    p = argparse.ArgumentParser(description="توليد بنوك أسئلة لمجلد محاضرات")
+    p.add_argument("directory")
+    p.add_argument("--lang", default="ar", choices=["ar", "en"], help="لغة محتوى الملفات")
+    p.add_argument("--qlang", default="ar", choices=["ar", "en"], help="لغة الأسئلة")
+    p.add_argument("--size", type=int, default=int(os.getenv("QUIZ_DEFAULT_SIZE", 20)), help="أسئلة لكل ملف")
+    p.add_argument("--mix", default="mix", choices=list(MIXES))
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="عمليات الاستخراج")
+    p.add_argument("--llm", type=int, default=int(os.getenv("BATCH_LLM_CONCURRENCY", 4)), help="طلبات النموذج المتزامنة")
+    p.add_argument("--out", default="banks.jsonl")
+    p.add_argument("--manifest", default=None)
+    p.add_argument("--force", action="store_true", help="إعادة معالجة كل الملفات")
+    sys.exit(asyncio.run(run(p.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""ذاكرة أسئلة المقاطع (chunk_cache): طلبات النموذج لملفات متداخلة.
+
+python benchmarks/bench_chunk_cache.py [--lectures 4] [--slides 40] [--size 20] [--anchor 3000] [--seed 0]
+
+السيناريو: كل محاضرة وحدها، ثم الملف المجمّع لكل المحاضرات، ثم نسخة جديدة من
+المحاضرة 2 بثلاث شرائح مضافة في منتصفها. النموذج بديل محلي يعدّ الطلبات فقط.
+المقارنة: بلا ذاكرة، ذاكرة مع تقسيم بالطول فقط (LLM_CHUNK_ANCHOR=0)،
+ذاكرة مع حدود بحسب المحتوى (--anchor، الافتراضي LLM_CHUNK_CHARS / 2).
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import llm
+import providers
+from chunk_cache import ChunkCache
+
+WORDS = ("network protocol layer packet routing encryption key cipher block stream authentication "
+         "integrity confidentiality firewall policy access control subnet gateway latency header "
+         "checksum window congestion handshake session certificate").split()
+
+
+SEED = 0
+
+
+def slide(lecture: int, n: int, tag: str = "") -> str:
+    rnd = random.Random(f"{SEED}-{lecture}-{n}-{tag}")
+    title = f"Lecture {lecture} {tag}slide {n}: " + " ".join(rnd.sample(WORDS, 3)).title()
+    bullets = ["- " + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(7, 12))) for _ in range(4)]
+    return "\n".join([title, *bullets])
+
+
+def deck(lecture: int, slides: int, inserted: int = 0) -> list:
+    out = [slide(lecture, n) for n in range(slides)]
+    mid = slides // 2
+    return out[:mid] + [slide(lecture, n, "new ") for n in range(inserted)] + out[mid:]
+
+
+_dumps = json.dumps  # معامل json في post يحجب الوحدة
+
+
+class StubLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def post(self, url, headers=None, json=None):
+        self.calls += 1
+        n = max(1, (json["max_tokens"] - llm.REASONING_TOKENS) // llm.TOKENS_PER_QUESTION)
+        items = [{"type": "mcq", "question": f"q{self.calls}-{i}", "options": ["a", "b", "c", "d"], "correct": 0}
+                 for i in range(n)]
+        return Resp({"choices": [{"message": {"content": _dumps(items)}, "finish_reason": "stop"}]})
+
+    async def aclose(self):
+        pass
+
+
+class Resp:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+async def scenario(args, cache, anchor):
+    llm.CHUNK_CACHE, llm.CHUNK_ANCHOR = cache, anchor
+    stub = StubLLM()
+    providers.ROUTER._client = stub
+    lectures = {i: deck(i, args.slides) for i in range(1, args.lectures + 1)}
+    docs = [(f"lecture {i}", "\n".join(s)) for i, s in lectures.items()]
+    docs.append(("combined", "\n".join("\n".join(s) for s in lectures.values())))
+    docs.append(("lecture 2 +3 slides", "\n".join(deck(2, args.slides, inserted=3))))
+
+    rows = []
+    for name, text in docs:
+        before, stats = stub.calls, dict(cache.stats)
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            await llm.ask_llm_big(text, "en", target_total=args.size, mcq_ratio=1.0)
+        chunks = cache.stats["chunks"] - stats.get("chunks", 0)
+        reused = cache.stats["reused_chars"] - stats.get("reused_chars", 0)
+        chars = cache.stats["chars"] - stats.get("chars", 0)
+        rows.append((name, stub.calls - before, chunks, 100 * reused / max(1, chars)))
+    return rows
+
+
+async def main(args):
+    global SEED
+    SEED = args.seed
+    providers.ROUTER.providers = [providers.Provider("stub", "stub://llm", "stub", None)]
+    with tempfile.TemporaryDirectory() as d:
+        modes = [("no cache (before)", ChunkCache(os.path.join(d, "off.db"), 0), 0),
+                 ("cache, length split", ChunkCache(os.path.join(d, "len.db"), 64), 0),
+                 ("cache, content split", ChunkCache(os.path.join(d, "cdc.db"), 64), args.anchor)]
+        for label, cache, anchor in modes:
+            rows = await scenario(args, cache, anchor)
+            print(f"\n== {label} ==")
+            for name, calls, chunks, pct in rows:
+                reuse = f"chunks={chunks:3d}  {pct:5.1f}% of text reused" if cache.enabled else ""
+                print(f"  {name:22s} llm calls={calls:3d}  {reuse}")
+            print(f"  total llm calls={sum(r[1] for r in rows)}")
+            cache.close()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--lectures", type=int, default=4)
+    p.add_argument("--slides", type=int, default=40)
+    p.add_argument("--size", type=int, default=20)
+    p.add_argument("--seed", type=int, default=0, help="نص الشرائح العشوائي")
+    p.add_argument("--anchor", type=int, default=llm.CHUNK_CHARS // 2, help="LLM_CHUNK_ANCHOR لوضع حدود المحتوى")
+    asyncio.run(main(p.parse_args()))
@@ -0,0 +1,145 @@
+"""مشتتات MCQ القاعدية (quizbot.make_mcq): الطريقة القديمة مقابل DistractorIndex على نصوص 80k حرف.
+
+python benchmarks/bench_distractors.py [--chars 80000] [--docs 5]
+
+النص اصطناعي بجمل "X is Y" / "X هو Y" عربية وإنجليزية من عدة مواضيع. لكل سؤال:
+- نفس الكتابة: المشتت بنفس لغة الإجابة
+- طول قريب: طول المشتت بين نصف وضعف طول الإجابة
+- نفس الموضوع: المشتت يشارك الإجابة كلمة واحدة على الأقل
+الزمن لتوليد سؤال لكل مرشح (k = كل المرشحين) كما يحدث مع الملفات الطويلة.
+quizbot.py لا يُستورد (ملف قديم لا يُحلَّل)؛ المنطقان منسوخان هنا كما هما.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from distractors import DistractorIndex, script, _norm, _tokens
+
+MAX_TEXT_CHAR = 80_000
+PATTERN = re.compile(r"([A-Z\u0600-\u06FF][^.!?]{2,40})\s+(is|are|تعرف|هو|هي|يعرف|تسمى|يسمى)\s+([^.!?]{2,80})")
+EXTRA = ["layered security", "data confidentiality", "network perimeter", "transport protocol",
+         "التشفير", "مصادقة المستخدم", "جدار ناري"]
+
+TOPICS = {
+    "net": (["router", "packet", "switch", "frame", "subnet", "gateway", "protocol", "header", "port", "latency"],
+            ["الموجه", "الحزمة", "المحول", "الإطار", "الشبكة", "البوابة", "البروتوكول", "الترويسة", "المنفذ", "التأخير"]),
+    "sec": (["cipher", "key", "hash", "signature", "certificate", "token", "firewall", "attack", "policy", "audit"],
+            ["التشفير", "المفتاح", "التجزئة", "التوقيع", "الشهادة", "الرمز", "الجدار", "الهجوم", "السياسة", "التدقيق"]),
+    "db": (["table", "index", "query", "transaction", "schema", "row", "column", "join", "cursor", "replica"],
+           ["الجدول", "الفهرس", "الاستعلام", "المعاملة", "المخطط", "الصف", "العمود", "الربط", "المؤشر", "النسخة"]),
+    "bio": (["cell", "membrane", "protein", "enzyme", "gene", "nucleus", "tissue", "organ", "receptor", "hormone"],
+            ["الخلية", "الغشاء", "البروتين", "الإنزيم", "الجين", "النواة", "النسيج", "العضو", "المستقبل", "الهرمون"]),
+}
+LINK_EN = ["of the", "that controls the", "used by the", "which stores the", "between the", "for each"]
+LINK_AR = ["في", "الذي يتحكم في", "المستخدم في", "الذي يخزن", "بين", "لكل"]
+
+
+def sentence(rnd):
+    en, ar = TOPICS[rnd.choice(list(TOPICS))]
+    words, links, verb = (en, LINK_EN, "is") if rnd.random() < 0.5 else (ar, LINK_AR, "هو")
+    subject = " ".join(rnd.sample(words, rnd.randint(2, 3)))
+    if verb == "is":
+        subject = "The " + subject
+    n = rnd.choice([1, 1, 2, 3, 4, 6, 8])
+    parts = [rnd.choice(words)]
+    while len(" ".join(parts).split()) < n:
+        parts += [rnd.choice(links), rnd.choice(words)]
+    return f"{subject} {verb} {' '.join(' '.join(parts).split()[:max(n, 1)])}."
+
+
+def document(rnd, chars):
+    out, size = [], 0
+    while size < chars:
+        s = sentence(rnd)
+        out.append(s)
+        size += len(s) + 1
+    return " ".join(out)[:MAX_TEXT_CHAR]
+
+
+def split_sentences(text):
+    parts = re.split(r"(?<=[.!؟?;:])\s+", text)
+    return [p.strip() for p in parts if 40 <= len(p.strip()) <= 220]
+
+
+def candidates(sentences):
+    out = []
+    for s in sentences:
+        m = PATTERN.search(s)
+        if m:
+            x, y = m.group(1).strip(), m.group(3).strip()
+            if 2 <= len(x.split()) <= 8 and 1 <= len(y.split()) <= 12:
+                out.append((x, y))
+    return out
+
+
+def legacy(cands, rnd):
+    pool = [y for _, y in cands]
+    res = []
+    for x, y in cands:
+        d = [p for p in pool if p != y]
+        rnd.shuffle(d)
+        d = d[:3]
+        while len(d) < 3:
+            d.append(rnd.choice(EXTRA))
+        res.append((y, d))
+    return res
+
+
+def indexed(cands, sentences, rnd):
+    index = DistractorIndex([y for _, y in cands], rng=rnd)
+    res = []
+    for x, y in cands:
+        d = index.pick(y, 3)
+        if len(d) < 3:
+            d += DistractorIndex.fragments(sentences, y, 3 - len(d), rng=rnd)
+        res.append((y, d))
+    return res
+
+
+def quality(results):
+    same_script = close_len = topic = n = 0
+    for y, ds in results:
+        ty, ly = set(_tokens(_norm(y))), max(1, len(y.split()))
+        for d in ds:
+            n += 1
+            same_script += script(d) == script(y)
+            close_len += 0.5 <= len(d.split()) / ly <= 2
+            topic += bool(ty & set(_tokens(_norm(d))))
+    return 100 * same_script / n, 100 * close_len / n, 100 * topic / n
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--chars", type=int, default=MAX_TEXT_CHAR)
+    p.add_argument("--docs", type=int, default=5)
+    args = p.parse_args()
+
+    rows = {"legacy": [0.0, []], "indexed": [0.0, []]}
+    n_cands = 0
+    for seed in range(args.docs):
+        rnd = random.Random(seed)
+        sentences = split_sentences(document(rnd, args.chars))
+        cands = candidates(sentences)
+        n_cands += len(cands)
+        t0 = time.perf_counter()
+        rows["legacy"][1] += legacy(cands, random.Random(seed))
+        rows["legacy"][0] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        rows["indexed"][1] += indexed(cands, sentences, random.Random(seed))
+        rows["indexed"][0] += time.perf_counter() - t0
+
+    print(f"{args.docs} docs x {args.chars:,} chars, {n_cands / args.docs:.0f} MCQ candidates/doc (k = all)")
+    print(f"{'':8s} {'ms/doc':>8s} {'us/MCQ':>8s} {'same script':>12s} {'length 0.5-2x':>14s} {'shares a word':>14s}")
+    for name, (secs, res) in rows.items():
+        s, l, t = quality(res)
+        print(f"{name:8s} {1e3 * secs / args.docs:8.1f} {1e6 * secs / max(1, n_cands):8.1f} "
+              f"{s:11.1f}% {l:13.1f}% {t:13.1f}%")
+
+
+if __name__ == "__main__":
+    main()
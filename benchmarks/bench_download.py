@@ -0,0 +1,92 @@
+"""ذاكرة تحميل ملف من تيليجرام: المسار القديم (bytearray كامل + نسخ) مقابل downloads.DOWNLOADS.
+
+python benchmarks/bench_download.py [--mb 16]
+
+الخادم محاكى بـ httpx.MockTransport يبث الملف على دفعات 64KB؛ الذاكرة تقاس بـ tracemalloc (الذروة).
+ملف أكبر من الحد بلا Content-Length: كم بايت نُزّل قبل الإيقاف.
+"""
+import os
+import sys
+import asyncio
+import argparse
+import hashlib
+import tracemalloc
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import downloads
+from downloads import DOWNLOADS, TooLarge
+
+BLOCK = os.urandom(64 * 1024)
+
+
+class TgFile:
+    def __init__(self, size, known=True):
+        self.file_size = size if known else None
+        self.file_path = f"https://api.telegram.org/file/botTOKEN/documents/{size}"
+
+
+def transport(served: list):
+    async def handler(request):
+        size = int(request.url.path.rsplit("/", 1)[-1])
+
+        async def body():
+            sent = 0
+            while sent < size:
+                chunk = BLOCK[:min(len(BLOCK), size - sent)]
+                sent += len(chunk)
+                served[0] = sent
+                yield chunk
+        return httpx.Response(200, content=body())
+    return httpx.MockTransport(handler)
+
+
+async def legacy(client, tgfile):
+    # كما كان في bot.py: download_as_bytearray ثم copy() ثم bytes() للجلسة وdoc_hash
+    r = await client.get(tgfile.file_path)
+    file_bytes = bytearray(r.content)
+    copies = (file_bytes.copy(), bytes(file_bytes))  # نسخة البوت الثاني + نسخة الجلسة
+    return hashlib.sha256(copies[1]).hexdigest()
+
+
+async def measure(coro_fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = await coro_fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 2 ** 20
+
+
+async def main(args):
+    served = [0]
+    size = int(args.mb * 2 ** 20)
+    downloads.UPLOAD_SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".bench_spool")
+    client = httpx.AsyncClient(transport=transport(served))
+    DOWNLOADS._client = client
+    limit = 16 * 2 ** 20
+
+    h_old, peak_old = await measure(lambda: legacy(client, TgFile(size)))
+    dl, peak_new = await measure(lambda: DOWNLOADS.fetch(TgFile(size, known=False), ".pdf", max(limit, size)))
+    downloads.discard(dl.path)
+    print(f"{args.mb:.0f}MB upload   legacy peak={peak_old:7.1f}MB   streamed peak={peak_new:5.2f}MB   "
+          f"same sha256={h_old == dl.sha256}")
+
+    for known in (True, False):
+        served[0] = 0
+        try:
+            await DOWNLOADS.fetch(TgFile(40 * 2 ** 20, known=known), ".pdf", limit)
+        except TooLarge:
+            pass
+        how = "file_size known " if known else "no size metadata"
+        print(f"40MB > 16MB limit, {how}: downloaded {served[0] / 2 ** 20:5.2f}MB before abort")
+    await client.aclose()
+    os.rmdir(downloads.UPLOAD_SPOOL_DIR)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--mb", type=float, default=16)
+    asyncio.run(main(p.parse_args()))
@@ -0,0 +1,96 @@
+"""زمن الاستجابة (p50/p95/p99) مع وبدون الطلبات الاحتياطية (hedging) في ProviderRouter.
+
+يشغّل خادمين محليين متوافقين مع OpenAI:
+  fast — سريع غالباً (50-100ms) لكن 4% من الطلبات تتأخر 2 ثانية
+  slow — ثابت تقريباً (~300ms)
+
+python benchmarks/bench_hedging.py [عدد الطلبات]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+
+os.environ.setdefault("LLM_HEDGE_MIN", "0.05")
+os.environ.setdefault("LLM_HEDGE_DEFAULT", "0.5")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from providers import Provider, ProviderRouter
+
+REPLY = json.dumps({"choices": [{"message": {"content": "[]"}, "finish_reason": "stop"}]}).encode()
+
+
+async def start_standin(latency):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(latency())
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(REPLY), REPLY))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def fast_latency():
+    return 2.0 if random.random() < 0.04 else random.uniform(0.05, 0.1)
+
+
+def slow_latency():
+    return random.uniform(0.25, 0.35)
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(n, hedge, fast_port, slow_port):
+    providers = [
+        Provider("fast", f"http://127.0.0.1:{fast_port}/v1/chat/completions", "m", None),
+        Provider("slow", f"http://127.0.0.1:{slow_port}/v1/chat/completions", "m", None),
+    ]
+    router = ProviderRouter(providers, hedge=hedge)
+    sem = asyncio.Semaphore(8)
+    lat = []
+
+    async def one():
+        async with sem:
+            t0 = time.monotonic()
+            await router.chat({"messages": []})
+            lat.append(time.monotonic() - t0)
+
+    await asyncio.gather(*(one() for _ in range(n)))
+    await router.aclose()
+    return lat, router.stats()
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    fast, fast_port = await start_standin(fast_latency)
+    slow, slow_port = await start_standin(slow_latency)
+    for hedge in (False, True):
+        random.seed(7)
+        lat, stats = await run(n, hedge, fast_port, slow_port)
+        print(f"hedge={str(hedge):<5} p50={pct(lat, .5) * 1000:6.0f}ms p95={pct(lat, .95) * 1000:6.0f}ms "
+              f"p99={pct(lat, .99) * 1000:6.0f}ms  "
+              + " ".join(f"{s['name']}:req={s['requests']},won={s['hedges_won']}" for s in stats))
+    fast.close()
+    slow.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""حجم الصور المرسلة إلى OCR قبل وبعد ingest.prepare_image.
+
+python benchmarks/bench_image_prep.py [صور ...]
+
+بدون صور يُولَّد مجموع اصطناعي يشبه صور الهاتف: صفحة نص على طاولة ملونة،
+4032x3024 بجودة JPEG 95 مع ضجيج خفيف.
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from ingest import prepare_image
+
+WORDS = ("network protocol layer packet routing encryption key cipher block stream "
+         "authentication integrity confidentiality firewall policy access control").split()
+
+
+def phone_photo(path: str, seed: int, size=(4032, 3024)):
+    rnd = random.Random(seed)
+    im = Image.new("RGB", size, (rnd.randint(90, 140), rnd.randint(70, 110), rnd.randint(40, 80)))
+    draw = ImageDraw.Draw(im)
+    # الورقة تغطي جزءاً من الصورة فقط
+    w, h = size
+    page = (int(w * 0.18), int(h * 0.06), int(w * 0.82), int(h * 0.95))
+    draw.rectangle(page, fill=(236, 234, 228))
+    try:
+        font = ImageFont.load_default(size=44)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    y = page[1] + 90
+    while y < page[3] - 90:
+        line = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 5)))
+        draw.text((page[0] + 90, y), line, fill=(25, 25, 30), font=font)
+        y += 64
+    noise = Image.effect_noise(size, 18).convert("RGB")
+    im = Image.blend(im, noise, 0.08).filter(ImageFilter.GaussianBlur(0.6))
+    im.save(path, "JPEG", quality=95)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    if len(sys.argv) > 1:
+        corpus = sys.argv[1:]
+    else:
+        corpus = []
+        for seed in range(6):
+            p = os.path.join(tmp, f"photo_{seed}.jpg")
+            phone_photo(p, seed)
+            corpus.append(p)
+
+    before = after = 0
+    elapsed = 0.0
+    for path in corpus:
+        t0 = time.perf_counter()
+        out = prepare_image(path)
+        elapsed += time.perf_counter() - t0
+        b, a = os.path.getsize(path), os.path.getsize(out)
+        before += b
+        after += a
+        with Image.open(out) as im:
+            dims = f"{im.size[0]}x{im.size[1]} {im.mode}"
+        print(f"{os.path.basename(path)}: {b / 1024:.0f}KB -> {a / 1024:.0f}KB ({dims})")
+        if out != path:
+            os.remove(out)
+
+    print(f"images={len(corpus)}")
+    print(f"upload bytes before={before} after={after} ({100 * (before - after) / max(1, before):.1f}% smaller)")
+    print(f"preprocess time total={elapsed * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
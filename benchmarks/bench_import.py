@@ -0,0 +1,76 @@
+"""حارس زمن بدء التشغيل: يقيس `import bot` عبر `python -X importtime`.
+
+python benchmarks/bench_import.py [--budget-ms 450] [--runs 5]
+
+يفشل (رمز خروج 1) إذا تجاوز الوسيط الميزانية، أو إذا استُورد أي من المكتبات
+الثقيلة التي يجب أن تبقى مؤجلة حتى أول استخدام.
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# تُحمّل عند أول ملف / عند تشغيل webhook فقط
+DEFERRED = ("flask", "pdfminer", "docx", "pptx", "PIL", "pytesseract")
+
+
+def measure(module: str):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr.strip().splitlines()[-1])
+    total_us, top, loaded = 0, [], set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue  # سطر العناوين
+        name = parts[2].strip()
+        loaded.add(name.split(".")[0])
+        top.append((cumulative, name))
+        if name == module:
+            total_us = cumulative
+    top.sort(reverse=True)
+    return total_us / 1000, top[:8], loaded
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--module", default="bot")
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 450)))
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    runs, top, loaded = [], [], set()
+    for _ in range(args.runs):
+        ms, top, loaded = measure(args.module)
+        runs.append(ms)
+    median = statistics.median(runs)
+
+    print(f"import {args.module}: median={median:.0f}ms min={min(runs):.0f}ms max={max(runs):.0f}ms "
+          f"(budget {args.budget_ms:.0f}ms)")
+    for cumulative, name in top:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    failed = False
+    eager = sorted(m for m in DEFERRED if m in loaded)
+    if eager:
+        print(f"FAIL: deferred modules imported eagerly: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
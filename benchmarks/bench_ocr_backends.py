@@ -0,0 +1,68 @@
+"""زمن OCR وإنتاجيته: OCR.space مقابل Tesseract المحلي.
+
+python benchmarks/bench_ocr_backends.py [صور ...]
+
+لكل محرك متاح: زمن كل صورة على حدة (p50/p95)، ثم الإنتاجية عند إرسال كل الصور
+معاً (OCR.space يتوازى عبر الشبكة، Tesseract عبر OCR_WORKERS عملية).
+بدون صور تُستخدم صور الهاتف الاصطناعية من bench_image_prep بعد تجهيزها.
+المحرك غير المتاح (لا مفتاح / لا tesseract) يُتخطى.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import ocr
+from ingest import prepare_image
+
+
+def corpus(paths):
+    if paths:
+        return paths
+    from bench_image_prep import phone_photo
+
+    tmp = tempfile.mkdtemp()
+    out = []
+    for seed in range(8):
+        p = os.path.join(tmp, f"photo_{seed}.jpg")
+        phone_photo(p, seed)
+        out.append(prepare_image(p))
+    return out
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def bench(backend, images, lang):
+    latencies = []
+    for path in images:
+        t0 = time.perf_counter()
+        await backend.image(path, lang)
+        latencies.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(backend.image(p, lang) for p in images))
+    wall = time.perf_counter() - t0
+    print(f"{backend.name}: p50={pct(latencies, 0.5) * 1000:.0f}ms p95={pct(latencies, 0.95) * 1000:.0f}ms "
+          f"throughput={len(images) / wall:.2f} img/s (concurrent, workers={ocr.OCR_WORKERS})")
+
+
+async def main():
+    images = corpus(sys.argv[1:])
+    lang = os.getenv("BENCH_LANG", "en")
+    print(f"images={len(images)} cpus={os.cpu_count()}")
+    for name, backend in ocr.BACKENDS.items():
+        if not backend.available():
+            print(f"{name}: skipped (unavailable)")
+            continue
+        await bench(backend, images, lang)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
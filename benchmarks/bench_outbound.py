@@ -0,0 +1,128 @@
+"""مقارنة الإرسال المباشر مع OutboundDispatcher أمام Bot API وهمي يطبق حدود Telegram.
+
+python benchmarks/bench_outbound.py [عدد المستخدمين] [أسئلة لكل مستخدم]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from outbound import OutboundDispatcher, PRIORITY_POLL, PRIORITY_ADMIN
+
+ADMIN_ID = 1
+
+
+class FakeRetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class FakeBotAPI:
+    """حدود Telegram: 30 رسالة في أي ثانية، ورسالة كل ثانية لكل محادثة خاصة"""
+
+    def __init__(self, latency=0.04, global_limit=30, chat_interval=1.0):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.chat_interval = chat_interval
+        self.window = deque()
+        self.chat_last = {}
+        self.accepted = 0
+        self.flood_errors = 0
+
+    async def send(self, chat_id, kind):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        now = time.monotonic()
+        while self.window and now - self.window[0] > 1.0:
+            self.window.popleft()
+        last = self.chat_last.get(chat_id)
+        if len(self.window) >= self.global_limit or (last is not None and now - last < self.chat_interval * 0.95):
+            self.flood_errors += 1
+            raise FakeRetryAfter(1)
+        self.window.append(now)
+        self.chat_last[chat_id] = now
+        self.accepted += 1
+        return kind
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _scenario(send, users, polls):
+    """كل مستخدم يجيب ويطلب السؤال التالي؛ مع كل مستخدم جديد إشعار للمدير"""
+    poll_lat, admin_lat, lost = [], [], 0
+
+    async def admin_notice(uid):
+        nonlocal lost
+        t0 = time.monotonic()
+        try:
+            await send(ADMIN_ID, PRIORITY_ADMIN, f"join {uid}")
+            admin_lat.append(time.monotonic() - t0)
+        except Exception:
+            lost += 1
+
+    async def user(uid):
+        nonlocal lost
+        await admin_notice(uid)
+        for _ in range(polls):
+            t0 = time.monotonic()
+            try:
+                await send(uid, PRIORITY_POLL, "poll")
+                poll_lat.append(time.monotonic() - t0)
+            except Exception:
+                lost += 1
+            await asyncio.sleep(random.uniform(0.2, 0.6))  # زمن تفكير الطالب
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(user(10_000 + i) for i in range(users)))
+    return time.monotonic() - t0, poll_lat, admin_lat, lost
+
+
+async def run_direct(users, polls):
+    api = FakeBotAPI()
+
+    async def send(chat_id, priority, kind):
+        return await api.send(chat_id, kind)
+
+    elapsed, poll_lat, admin_lat, lost = await _scenario(send, users, polls)
+    return api, elapsed, poll_lat, admin_lat, lost
+
+
+async def run_dispatcher(users, polls):
+    api = FakeBotAPI()
+    disp = OutboundDispatcher(global_rate=28)
+
+    async def send(chat_id, priority, kind):
+        return await disp.call(chat_id, priority, api.send, chat_id, kind)
+
+    elapsed, poll_lat, admin_lat, lost = await _scenario(send, users, polls)
+    await disp.aclose()
+    return api, elapsed, poll_lat, admin_lat, lost
+
+
+def _report(name, api, elapsed, poll_lat, admin_lat, lost):
+    print(f"{name:<11} elapsed={elapsed:6.1f}s accepted={api.accepted:5d} flood_errors={api.flood_errors:5d} "
+          f"lost={lost:4d} poll_p50={_pct(poll_lat, .5):.2f}s poll_p95={_pct(poll_lat, .95):.2f}s "
+          f"admin_p95={_pct(admin_lat, .95):.2f}s")
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    polls = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    random.seed(1)
+    print(f"users={users} polls/user={polls}")
+    _report("direct", *asyncio.run(run_direct(users, polls)))
+    random.seed(1)
+    _report("dispatcher", *asyncio.run(run_dispatcher(users, polls)))
+
+
+if __name__ == "__main__":
+    main()
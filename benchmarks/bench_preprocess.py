@@ -0,0 +1,80 @@
+"""كم رمزاً (token) يوفّر preprocess.clean_text مقارنة بالتنظيف القديم في bot.py.
+
+python benchmarks/bench_preprocess.py [ملفات نصية مستخرجة ...]
+
+بدون ملفات يُستخدم مجموع اصطناعي يشبه محاضرات الجامعة (ترويسة وتذييل ورقم صفحة
+في كل صفحة). عدد الرموز تقديري: كلمة أو علامة ترقيم = رمز.
+"""
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from preprocess import clean_text
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def legacy_clean(t: str) -> str:
+    t = t.replace("\u200f", " ").replace("\u200e", " ")
+    t = re.sub(r"[\t\xa0]+", " ", t)
+    t = re.sub(r"\s+", " ", t)
+    return t.strip()
+
+
+def tokens(t: str) -> int:
+    return len(_TOKEN_RE.findall(t))
+
+
+WORDS_EN = ("network protocol layer packet routing encryption key cipher block stream "
+            "authentication integrity confidentiality firewall policy access control").split()
+WORDS_AR = "الشبكة البروتوكول الطبقة الحزمة التوجيه التشفير المفتاح المصادقة السرية الجدار".split()
+
+
+def synthetic_deck(pages: int, seed: int) -> str:
+    rnd = random.Random(seed)
+    out = []
+    for p in range(1, pages + 1):
+        body = []
+        for _ in range(rnd.randint(4, 9)):
+            words = WORDS_AR if rnd.random() < 0.4 else WORDS_EN
+            body.append(" ".join(rnd.choice(words) for _ in range(rnd.randint(6, 18))) + ".")
+        out.append(
+            "King Saud University\u200f - College of Computer and Information Sciences\n"
+            "CSC 227: Operating Systems — Lecture 4\n\n"
+            + "\n".join(body)
+            + f"\n\nDr. Ahmed Al-Faris   |   Fall 2026\nPage {p} of {pages}"
+        )
+    return "\f".join(out)
+
+
+def main():
+    if len(sys.argv) > 1:
+        corpus = [open(p, encoding="utf-8", errors="ignore").read() for p in sys.argv[1:]]
+    else:
+        corpus = [synthetic_deck(n, seed) for seed, n in enumerate((12, 25, 40, 60, 90))]
+
+    before = after = 0
+    t_legacy = t_new = 0.0
+    for doc in corpus:
+        t0 = time.perf_counter()
+        old = legacy_clean(doc)
+        t1 = time.perf_counter()
+        new = clean_text(doc)
+        t2 = time.perf_counter()
+        t_legacy += t1 - t0
+        t_new += t2 - t1
+        before += tokens(old)
+        after += tokens(new)
+
+    saved = before - after
+    print(f"documents={len(corpus)}")
+    print(f"prompt tokens legacy={before} preprocess={after} saved={saved} ({100 * saved / max(1, before):.1f}%)")
+    print(f"time legacy={t_legacy * 1000:.1f}ms preprocess={t_new * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""نسبة الأسئلة المُنقذة من ردود النموذج المعيبة: json.loads القديم مقابل llm_json.
+
+python benchmarks/bench_salvage.py [ملفات ردود خام ...]
+
+بدون ملفات يُولَّد مجموع اصطناعي بعيوب شائعة: ```json```، نص قبل المصفوفة،
+فاصلة زائدة، كائن مغلّف {"questions": [...]}، وانقطاع عند max_tokens.
+"كامل" = عدد الأسئلة المكتملة فعلاً داخل الرد (ما يمكن إنقاذه نظرياً).
+"""
+import os
+import sys
+import json
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from llm_json import parse_questions
+
+
+def legacy(content: str) -> list:
+    try:
+        arr = json.loads(content)
+        if isinstance(arr, list):
+            return arr
+    except Exception:
+        pass
+    return []
+
+
+def question(rnd, i):
+    if rnd.random() < 0.7:
+        return {"type": "mcq", "question": f"ما وظيفة الطبقة {i} في نموذج \"OSI\"؟",
+                "options": ["Routing", "Framing", "Encryption", "Session control"], "correct": rnd.randint(0, 3)}
+    return {"type": "tf", "question": f"البروتوكول {i} يعمل في طبقة النقل.",
+            "options": ["True/صح", "False/خطأ"], "correct": rnd.randint(0, 1)}
+
+
+def damaged(rnd, n):
+    """(الرد، عدد الأسئلة المكتملة فيه، نوع العيب)"""
+    items = [question(rnd, i) for i in range(n)]
+    body = json.dumps(items, ensure_ascii=False, indent=rnd.choice([None, 2]))
+    kind = rnd.choice(["clean", "fenced", "prose", "trailing_comma", "wrapped", "truncated", "truncated_fenced"])
+    if kind == "fenced":
+        return f"```json\n{body}\n```", n, kind
+    if kind == "prose":
+        return f"Here are the questions:\n{body}\nGood luck!", n, kind
+    if kind == "trailing_comma":
+        return body[:body.rindex("}") + 1] + ",\n]", n, kind
+    if kind == "wrapped":
+        return json.dumps({"questions": items}, ensure_ascii=False), n, kind
+    if kind.startswith("truncated"):
+        cut = rnd.randint(len(body) // 4, len(body) - 2)
+        text = body[:cut]
+        complete = sum(1 for k in range(1, n + 1) if len(json.dumps(items[:k], ensure_ascii=False,
+                                                                    indent=None if "\n" not in body else 2)) - 1 <= cut)
+        return (f"```json\n{text}" if kind == "truncated_fenced" else text), complete, kind
+    return body, n, kind
+
+
+def main():
+    rnd = random.Random(7)
+    if len(sys.argv) > 1:
+        corpus = [(open(p, encoding="utf-8").read(), None, "file") for p in sys.argv[1:]]
+    else:
+        corpus = [damaged(rnd, rnd.randint(5, 25)) for _ in range(400)]
+
+    present = old = new = 0
+    by_kind = {}
+    for content, complete, kind in corpus:
+        a = len(legacy(content))
+        b = len(parse_questions(content)[0])
+        complete = b if complete is None else complete
+        present += complete
+        old += a
+        new += b
+        k = by_kind.setdefault(kind, [0, 0, 0])
+        k[0] += complete
+        k[1] += a
+        k[2] += b
+
+    print(f"responses={len(corpus)} complete questions={present}")
+    for kind, (c, a, b) in sorted(by_kind.items()):
+        print(f"  {kind:17s} complete={c:5d} legacy={a:5d} salvage={b:5d}")
+    print(f"recovered legacy={old} ({100 * old / max(1, present):.1f}%) salvage={new} ({100 * new / max(1, present):.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""عدة عمليات على نفس مخزن الحالة: صحة الانتقالات الذرية والأقفال، والإنتاجية.
+
+python benchmarks/bench_state.py [--backend sqlite|redis|both] [--workers 4]
+
+- transitions: كل عملية تحاول نقل نفس الجلسات من await_lang؛ يجب أن تنجح مرة واحدة بالضبط لكل جلسة
+- group answers: كل عملية تسجل إجابات في نفس جلسة المجموعة (قراءة-ثم-كتابة)؛
+  مع SESSIONS.lock لا تضيع أي نقطة، وبدونه تضيع (للمقارنة)
+- expiry: كل العمليات تنظف نفس الجلسات المنتهية معاً؛ يجب أن تصل كل جلسة لعملية واحدة بالضبط
+  ولا تُمس الجلسات النشطة
+redis يعمل على benchmarks/resp_standin.py يُشغَّل تلقائياً في عملية منفصلة.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import state_store
+from sessions import SessionStore, STAGE_TTLS
+
+GROUP = -1001
+STAGE_TTLS["bench_expiring"] = 1  # مرحلة وهمية بمهلة ثانية واحدة
+
+
+def make_backend(kind: str, target: str):
+    backend = state_store.SQLiteBackend(target) if kind == "sqlite" else state_store.RedisBackend(target)
+    return state_store.AsyncState(backend)
+
+
+def worker_transitions(kind, target, chats, seed, out):
+    store = SessionStore(backend=make_backend(kind, target))
+    order = list(chats)
+    random.Random(seed).shuffle(order)
+
+    async def run():
+        return sum([1 for c in order if await store.transition(c, "await_lang", "await_question_lang", content_lang="ar")])
+
+    t0 = time.perf_counter()
+    wins = asyncio.run(run())
+    out.put((wins, len(order), time.perf_counter() - t0))
+
+
+def worker_answers(kind, target, user_id, answers, locked, out):
+    store = SessionStore(backend=make_backend(kind, target))
+
+    async def one():
+        sess = await store.get(GROUP)
+        sess["scores"][user_id] = sess["scores"].get(user_id, 0) + 1
+        await store.save(GROUP, sess)
+
+    async def run():
+        # باقي البوت في نفس الحلقة: أقصى تأخر لمؤقت كل 1ms أثناء الإجابات
+        lag = [0.0]
+
+        async def ticker():
+            while True:
+                t = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lag[0] = max(lag[0], time.perf_counter() - t - 0.001)
+
+        tick = asyncio.create_task(ticker())
+        for _ in range(answers):
+            if locked:
+                async with store.lock(GROUP):
+                    await one()
+            else:
+                await one()
+        tick.cancel()
+        return lag[0]
+
+    t0 = time.perf_counter()
+    lag = asyncio.run(run())
+    out.put((answers, time.perf_counter() - t0, lag))
+
+
+def worker_expiry(kind, target, out):
+    store = SessionStore(backend=make_backend(kind, target))
+
+    async def run():
+        claimed = []
+        while batch := await store.expired():
+            claimed += [chat_id for chat_id, _ in batch]
+        return claimed
+
+    out.put(asyncio.run(run()))
+
+
+def run_workers(target_fn, args_list):
+    out = mp.Queue()
+    procs = [mp.Process(target=target_fn, args=(*a, out)) for a in args_list]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return results, time.perf_counter() - t0
+
+
+def bench(kind: str, target: str, workers: int, chats: int, answers: int):
+    store = SessionStore(backend=make_backend(kind, target))
+    run = asyncio.new_event_loop().run_until_complete
+    print(f"\n== {kind} ({workers} processes) ==")
+
+    ids = list(range(1, chats + 1))
+    for c in ids:
+        run(store.put(c, {"stage": "await_lang", "user_id": c, "file_path": f"/tmp/upload-{c}.pdf"}))
+    results, wall = run_workers(worker_transitions, [(kind, target, ids, s) for s in range(workers)])
+    wins = sum(r[0] for r in results)
+    attempts = sum(r[1] for r in results)
+    ok = wins == chats and all(run(store.get(c))["stage"] == "await_question_lang" for c in ids)
+    print(f"transitions: {attempts} attempts on {chats} sessions, {wins} won "
+          f"({'OK, exactly once each' if ok else 'WRONG'}), {attempts / wall:,.0f} attempts/s")
+
+    for locked in (True, False):
+        run(store.put(GROUP, {"stage": "quiz", "group": True, "scores": {}}))
+        results, wall = run_workers(worker_answers, [(kind, target, 1000 + w, answers, locked) for w in range(workers)])
+        total = sum(run(store.get(GROUP))["scores"].values())
+        expected = workers * answers
+        label = "with SESSIONS.lock" if locked else "without lock    "
+        print(f"group answers {label}: {total}/{expected} recorded "
+              f"({expected - total} lost), {expected / wall:,.0f} answers/s, "
+              f"max loop lag {max(r[2] for r in results) * 1e3:.1f}ms")
+
+    expiring = list(range(10_001, 10_001 + chats))
+    active = list(range(20_001, 20_001 + chats // 10))
+    for c in expiring:
+        run(store.put(c, {"stage": "bench_expiring", "user_id": c}))
+    for c in active:
+        run(store.put(c, {"stage": "quiz", "user_id": c}))
+    time.sleep(1.2)
+    results, wall = run_workers(worker_expiry, [(kind, target) for _ in range(workers)])
+    claimed = [c for r in results for c in r]
+    exact = sorted(claimed) == expiring
+    untouched = all(run(store.exists(c)) for c in active)
+    ok &= exact and untouched
+    print(f"expiry: {len(claimed)}/{chats} expired sessions claimed "
+          f"({'OK, exactly once each' if exact else 'WRONG'}), "
+          f"{len(active)} active {'untouched' if untouched else 'WRONG'}, in {wall:.2f}s")
+    return ok
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--backend", default="both", choices=["sqlite", "redis", "both"])
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--chats", type=int, default=500)
+    p.add_argument("--answers", type=int, default=300)
+    p.add_argument("--port", type=int, default=6391)
+    args = p.parse_args()
+
+    ok = True
+    if args.backend in ("sqlite", "both"):
+        with tempfile.TemporaryDirectory() as d:
+            ok &= bench("sqlite", os.path.join(d, "state.db"), args.workers, args.chats, args.answers)
+    if args.backend in ("redis", "both"):
+        standin = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resp_standin.py")
+        server = subprocess.Popen([sys.executable, standin, "--port", str(args.port)], stdout=subprocess.DEVNULL)
+        try:
+            time.sleep(0.5)
+            ok &= bench("redis", f"redis://127.0.0.1:{args.port}/0", args.workers, args.chats, args.answers)
+        finally:
+            server.terminate()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+"""مولّد حمل: آلاف المستخدمين الافتراضيين عبر معالجات البوت الحقيقية.
+
+python benchmarks/loadgen.py --users 500 --questions 5 --ramp 30
+
+كل مستخدم افتراضي: /start ← ملف TXT ← لغة المحتوى ← لغة الأسئلة ← يجيب كل الاستطلاعات.
+التحديثات تُبنى كـ Update حقيقية وتدخل طابور Application (نفس مسار run_polling)،
+وطلبات Bot API تذهب إلى FakeBotAPI (BaseRequest بزمن استجابة مُحاكى)، والنموذج
+مزوّد وهمي داخل providers.ROUTER يُرجع أسئلة JSON بعد زمن مُحاكى.
+
+التقرير: الإنتاجية، زمن كل معالج (p50/p95/p99)، انتظار الطابور، تأخر حلقة الأحداث،
+ونمو الذاكرة (RSS) عبر الزمن. حدود Telegram في outbound تبقى كما هي إلا مع --tg-rate.
+مع --broadcast N يبدأ المدير بثاً إلى N مستخدم إضافي (5% منهم حظروا البوت) أثناء الاختبارات.
+مع --cancel/--cancel-now يُبلَّغ عما بقي بعد الإلغاء (مهام، جلسات، ملفات spool).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+from collections import Counter, defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+TOKEN = "123456:LOADTEST"
+BOT_ID = 123456
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ================= Bot API وهمي =================
+def make_fake_request(api_latency: float):
+    from telegram.request import BaseRequest
+
+    class FakeBotAPI(BaseRequest):
+        """يرد على طلبات Bot API محلياً ويبلغ كل مستخدم افتراضي بما أُرسل إلى محادثته"""
+
+        def __init__(self):
+            self.calls = Counter()
+            self.inbox = defaultdict(asyncio.Queue)  # chat_id -> أحداث (kind, payload)
+            self.files = {}
+            self.blocked = set()
+            self.last_copy = 0.0
+            self._ids = itertools.count(1)
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        @property
+        def read_timeout(self):
+            return None
+
+        def _message(self, chat_id, **extra):
+            return {"message_id": next(self._ids), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}, **extra}
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            await asyncio.sleep(api_latency * random.uniform(0.5, 1.5))
+            if "/file/bot" in url:
+                self.calls["download"] += 1
+                return 200, self.files[url.rsplit("/", 1)[-1]]
+
+            endpoint = url.rsplit("/", 1)[-1]
+            self.calls[endpoint] += 1
+            params = request_data.parameters if request_data else {}
+            chat_id = params.get("chat_id")
+            result = True
+
+            if endpoint == "copyMessage":
+                self.last_copy = time.monotonic()
+            if chat_id in self.blocked and endpoint in ("sendMessage", "copyMessage"):
+                return 403, json.dumps({"ok": False, "error_code": 403,
+                                        "description": "Forbidden: bot was blocked by the user"}).encode()
+            if endpoint == "copyMessage":
+                self.calls["broadcast"] += 1
+                result = {"message_id": next(self._ids)}
+            elif endpoint == "getMe":
+                result = {"id": BOT_ID, "is_bot": True, "first_name": "LoadBot", "username": "load_bot",
+                          "can_join_groups": True, "can_read_all_group_messages": False,
+                          "supports_inline_queries": False}
+            elif endpoint == "getFile":
+                fid = params["file_id"]
+                result = {"file_id": fid, "file_unique_id": fid, "file_size": len(self.files[fid]),
+                          "file_path": f"documents/{fid}"}
+            elif endpoint == "sendPoll":
+                poll_id = f"poll{next(self._ids)}"
+                result = self._message(chat_id, poll={
+                    "id": poll_id, "question": params["question"],
+                    "options": [{"text": o, "voter_count": 0} for o in params["options"]],
+                    "total_voter_count": 0, "is_closed": False, "is_anonymous": False,
+                    "type": "quiz", "allows_multiple_answers": False,
+                    "correct_option_id": params.get("correct_option_id")})
+                self.inbox[chat_id].put_nowait(("poll", (poll_id, params.get("correct_option_id"), len(params["options"]))))
+            elif endpoint in ("sendMessage", "editMessageText", "sendDocument", "sendPhoto"):
+                result = self._message(chat_id, text=params.get("text", ""))
+                buttons = [b.get("callback_data") for row in (params.get("reply_markup") or {}).get("inline_keyboard", [])
+                           for b in row]
+                if chat_id is not None:
+                    self.inbox[chat_id].put_nowait(("message", (result["message_id"], params.get("text", ""), buttons)))
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return FakeBotAPI()
+
+
+# ================= نموذج وهمي =================
+class StubLLMResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class StubLLM:
+    """بديل httpx.AsyncClient داخل ProviderRouter: أسئلة بعدد ما يسمح به max_tokens"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.canceled = 0
+
+    async def post(self, url, headers=None, json=None):
+        import llm
+        self.calls += 1
+        try:
+            await asyncio.sleep(random.lognormvariate(0, 0.4) * self.latency)
+        except asyncio.CancelledError:
+            self.canceled += 1
+            raise
+        n = max(1, (json["max_tokens"] - llm.REASONING_TOKENS) // llm.TOKENS_PER_QUESTION)
+        salt = random.random()
+        items = [{"type": "mcq", "question": f"سؤال {i} عن الطبقة {salt:.6f}",
+                  "options": ["Routing", "Framing", "Encryption", "Session"], "correct": i % 4}
+                 for i in range(n)]
+        import json as _json
+        return StubLLMResponse({"choices": [{"message": {"content": _json.dumps(items, ensure_ascii=False)},
+                                             "finish_reason": "stop"}]})
+
+    async def aclose(self):
+        pass
+
+
+# ================= المستخدم الافتراضي =================
+class Metrics:
+    def __init__(self):
+        self.handler = defaultdict(list)   # اسم المعالج -> أزمنة
+        self.queue_wait = []
+        self.loop_lag = []
+        self.timeline = []
+        self.updates = 0
+        self.completed = 0
+        self.failed = Counter()
+        self.quiz_seconds = []
+        self.first_poll = []  # من اختيار لغة الأسئلة حتى أول استطلاع
+        self.broadcast_seconds = 0.0
+        self.canceled = 0
+        self.cancel_reply = []  # زمن الرد على /cancel أثناء المعالجة
+
+
+def lecture(uid: int) -> bytes:
+    words = ("network protocol layer packet routing encryption key cipher block stream "
+             "authentication integrity confidentiality firewall policy access control").split()
+    rnd = random.Random(uid)
+    lines = [" ".join(rnd.choice(words) for _ in range(12)) + "." for _ in range(60)]
+    return (f"Lecture for student {uid}\n" + "\n".join(lines)).encode()
+
+
+class VirtualUsers:
+    def __init__(self, app, fake, metrics, args):
+        self.app = app
+        self.fake = fake
+        self.m = metrics
+        self.args = args
+        self._update_ids = itertools.count(1)
+        self.enqueued = {}
+
+    def _user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": f"Student{uid}", "username": f"s{uid}", "language_code": "ar"}
+
+    async def _send(self, payload):
+        from telegram import Update
+        uid = next(self._update_ids)
+        update = Update.de_json({"update_id": uid, **payload}, self.app.bot)
+        self.enqueued[uid] = time.perf_counter()
+        await self.app.update_queue.put(update)
+
+    def _message(self, uid, **extra):
+        return {"message_id": random.randint(1, 10 ** 9), "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"}, "from": self._user(uid), **extra}
+
+    async def _wait(self, uid, kind, want=None):
+        inbox = self.fake.inbox[uid]
+        deadline = time.monotonic() + self.args.timeout
+        while True:
+            event_kind, payload = await asyncio.wait_for(inbox.get(), deadline - time.monotonic())
+            if event_kind != kind:
+                continue
+            if want is None or any(b and b.startswith(want) for b in payload[2]):
+                return payload
+
+    async def _wait_text(self, uid, wants):
+        inbox = self.fake.inbox[uid]
+        while True:
+            event_kind, payload = await asyncio.wait_for(inbox.get(), self.args.timeout)
+            if event_kind == "message" and any(w in (payload[1] or "") for w in wants):
+                return payload
+
+    async def _callback(self, uid, message_id, data):
+        await self._send({"callback_query": {
+            "id": str(random.randint(1, 10 ** 12)), "from": self._user(uid), "chat_instance": str(uid),
+            "data": data, "message": self._message(uid, message_id=message_id, text="…")}})
+
+    async def run(self, uid):
+        a = self.args
+        await asyncio.sleep(random.uniform(0, a.ramp))
+        think = lambda: asyncio.sleep(random.uniform(0.5, 1.5) * a.think)
+        try:
+            await self._send({"message": self._message(uid, text="/start", entities=[
+                {"type": "bot_command", "offset": 0, "length": 6}])})
+            await self._wait(uid, "message")
+            await think()
+
+            fid = f"doc{uid}"
+            self.fake.files[fid] = lecture(uid)
+            started = time.monotonic()
+            await self._send({"message": self._message(uid, document={
+                "file_id": fid, "file_unique_id": fid, "file_name": "lecture.txt",
+                "mime_type": "text/plain", "file_size": len(self.fake.files[fid])})})
+            msg_id, _, _ = await self._wait(uid, "message", "lang_")
+            await think()
+            await self._callback(uid, msg_id, "lang_en")
+            msg_id, _, _ = await self._wait(uid, "message", "qlang_")
+            await think()
+            await self._callback(uid, msg_id, "qlang_en")
+            chosen = time.monotonic()
+            r = random.random()
+            if r < a.cancel + a.cancel_now:
+                # يلغي أثناء المعالجة، أو مباشرة خلف qlang_ قبل أن تبدأ مهمتها: لا استطلاعات بعدها
+                if r < a.cancel:
+                    await asyncio.sleep(random.uniform(0.1, 0.5) * a.llm_ms / 1000)
+                sent = time.monotonic()
+                await self._send({"message": self._message(uid, text="/cancel", entities=[
+                    {"type": "bot_command", "offset": 0, "length": 7}])})
+                await self._wait_text(uid, ("canceled", "No active", "تم إلغاء", "لا يوجد اختبار"))
+                self.m.cancel_reply.append(time.monotonic() - sent)
+                self.m.canceled += 1
+                return
+
+            for i in range(a.questions):
+                poll_id, correct, n_opts = await self._wait(uid, "poll")
+                if i == 0:
+                    self.m.first_poll.append(time.monotonic() - chosen)
+                await think()
+                option = correct if random.random() < 0.7 else random.randrange(n_opts)
+                await self._send({"poll_answer": {"poll_id": poll_id, "user": self._user(uid), "option_ids": [option]}})
+            self.m.completed += 1
+            self.m.quiz_seconds.append(time.monotonic() - started)
+        except asyncio.TimeoutError:
+            self.m.failed["timeout"] += 1
+        except Exception as e:
+            self.m.failed[type(e).__name__] += 1
+
+    async def broadcast(self, admin_id):
+        """المدير ينسخ رسالة لكل المقبولين بعد دخول نصف المستخدمين"""
+        await asyncio.sleep(self.args.ramp / 2)
+        started = time.monotonic()
+        await self._send({"message": {**self._message(admin_id, text="/broadcast", entities=[
+            {"type": "bot_command", "offset": 0, "length": 10}]),
+            "reply_to_message": self._message(admin_id, text="📢 announcement")}})
+        # إشعار الاكتمال قد يتأخر خلف رسائل المدير الأخرى (ثانية لكل رسالة في نفس المحادثة)
+        await self._wait_text(admin_id, ("اكتمل البث", "Broadcast finished"))
+        self.m.broadcast_seconds = self.fake.last_copy - started
+
+
+# ================= التشغيل =================
+async def loop_lag_monitor(m: Metrics, interval: float = 0.05):
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        m.loop_lag.append(time.perf_counter() - t0 - interval)
+
+
+async def sampler(m: Metrics, bot_module, every: float):
+    from outbound import OUTBOUND
+    t0 = time.monotonic()
+    last = 0
+    while True:
+        await asyncio.sleep(every)
+        t = time.monotonic() - t0
+        backlog = len(OUTBOUND._ready) + len(OUTBOUND._waiting)
+        m.timeline.append((t, m.updates, rss_mb(), len(bot_module.SESSIONS), backlog))
+        print(f"  t={t:6.1f}s updates={m.updates:7d} ({(m.updates - last) / every:6.1f}/s) "
+              f"rss={rss_mb():7.1f}MB sessions={len(bot_module.SESSIONS):5d} outbound_backlog={backlog:5d} "
+              f"done={m.completed}")
+        last = m.updates
+
+
+def instrument(app, m: Metrics, users: VirtualUsers):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    def timed(name, callback):
+        async def wrapper(update, context):
+            t0 = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                m.handler[name].append(time.perf_counter() - t0)
+                m.updates += 1
+        return wrapper
+
+    for handlers in app.handlers.values():
+        for h in handlers:
+            h.callback = timed(h.callback.__name__, h.callback)
+
+    async def stamp(update, context):
+        t = users.enqueued.pop(update.update_id, None)
+        if t is not None:
+            m.queue_wait.append(time.perf_counter() - t)
+
+    app.add_handler(TypeHandler(Update, stamp), group=-1)
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="loadgen_")
+    os.environ["QUESTION_BANK_DB"] = os.path.join(workdir, "bank.db")
+    os.environ["EVENTS_DIR"] = os.path.join(workdir, "events")
+    os.environ["UPLOAD_SPOOL_DIR"] = os.path.join(workdir, "spool")  # الملفات المتبقية لهذا التشغيل فقط
+    if args.tg_rate:
+        os.environ["TG_GLOBAL_RATE"] = str(args.tg_rate)
+    os.chdir(workdir)  # bot_users.json نسبي
+
+    import httpx
+    import bot
+    import providers
+    import downloads
+    from telegram import Bot
+
+    uids = list(range(10_000_001, 10_000_001 + args.users))
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    users = {str(u): {"status": "allowed", "username": f"s{u}", "full_name": f"Student{u}", "join_date": now,
+                      "last_activity": now, "files_sent": 0, "quizzes_taken": 0, "total_score": 0,
+                      "quiz_size": args.questions, "quiz_mix": "mcq"} for u in uids}
+    extra = range(20_000_001, 20_000_001 + args.broadcast)
+    users.update({str(u): {**users[str(uids[0])], "username": f"r{u}"} for u in extra})
+    fake_blocked = {u for u in extra if u % 20 == 0}
+    bot.save_data({"users": users, "files": [], "statistics": {
+        "total_users": len(users), "active_today": 0, "files_processed": 0, "quizzes_taken": 0}})
+
+    fake = make_fake_request(args.api_ms / 1000)
+    fake.blocked = fake_blocked
+    llm_stub = StubLLM(args.llm_ms / 1000)
+    providers.ROUTER.providers = [providers.Provider("stub", "stub://llm", "stub", None)]
+    providers.ROUTER._client = llm_stub
+    bot._second_bot = Bot(token=TOKEN, request=fake)
+
+    # التحميل يمر عبر httpx مباشرة (downloads.py)؛ نفس ملفات FakeBotAPI بنفس الزمن المُحاكى
+    async def serve_file(request):
+        await asyncio.sleep(args.api_ms / 1000 * random.uniform(0.5, 1.5))
+        fake.calls["download"] += 1
+        return httpx.Response(200, content=fake.files[request.url.path.rsplit("/", 1)[-1]])
+
+    downloads.DOWNLOADS._client = httpx.AsyncClient(transport=httpx.MockTransport(serve_file))
+
+    app = bot.build_application(TOKEN, request=fake, concurrent_updates=args.concurrent or False)
+    m = Metrics()
+    vu = VirtualUsers(app, fake, m, args)
+    instrument(app, m, vu)
+
+    await app.initialize()
+    await bot.post_init(app)
+    await app.start()
+    monitors = [asyncio.create_task(loop_lag_monitor(m)), asyncio.create_task(sampler(m, bot, args.sample))]
+    rss0 = rss_mb()
+    t0 = time.monotonic()
+    print(f"users={args.users} questions={args.questions} ramp={args.ramp}s concurrent_updates={args.concurrent} "
+          f"tg_rate={os.getenv('TG_GLOBAL_RATE', 'default')} api={args.api_ms}ms llm={args.llm_ms}ms")
+    jobs = [vu.run(u) for u in uids]
+    if args.broadcast:
+        jobs.append(vu.broadcast(bot.ADMIN_ID))
+    await asyncio.gather(*jobs)
+    wall = time.monotonic() - t0
+    for t in monitors:
+        t.cancel()
+    await app.stop()
+    await app.shutdown()
+    await bot.on_shutdown(app)
+
+    print("\n=== summary ===")
+    print(f"wall={wall:.1f}s completed={m.completed}/{args.users} failed={dict(m.failed)}")
+    print(f"throughput: {m.updates / wall:.1f} updates/s, {60 * m.completed / wall:.1f} quizzes/min")
+    print(f"quiz duration p50={pct(m.quiz_seconds, .5):.1f}s p95={pct(m.quiz_seconds, .95):.1f}s")
+    print(f"language choice -> first poll p50={pct(m.first_poll, .5):.2f}s p95={pct(m.first_poll, .95):.2f}s")
+    print("handler latency (ms):")
+    for name, vals in sorted(m.handler.items()):
+        print(f"  {name:28s} n={len(vals):6d} p50={pct(vals, .5) * 1e3:8.1f} p95={pct(vals, .95) * 1e3:8.1f} "
+              f"p99={pct(vals, .99) * 1e3:8.1f}")
+    print(f"queue wait (ms): p50={pct(m.queue_wait, .5) * 1e3:.1f} p95={pct(m.queue_wait, .95) * 1e3:.1f} "
+          f"p99={pct(m.queue_wait, .99) * 1e3:.1f}")
+    print(f"event-loop lag (ms): p50={pct(m.loop_lag, .5) * 1e3:.1f} p99={pct(m.loop_lag, .99) * 1e3:.1f} "
+          f"max={max(m.loop_lag, default=0) * 1e3:.1f}")
+    print(f"rss: start={rss0:.1f}MB peak={max((s[2] for s in m.timeline), default=rss0):.1f}MB end={rss_mb():.1f}MB")
+    print(f"bot api calls: {dict(fake.calls)}  llm calls: {llm_stub.calls} (canceled in flight: {llm_stub.canceled})")
+    if args.cancel or args.cancel_now:
+        from admission import ADMISSION
+        spool = [f for f in os.listdir(downloads.UPLOAD_SPOOL_DIR) if f.startswith(downloads.SPOOL_PREFIX)] \
+            if os.path.isdir(downloads.UPLOAD_SPOOL_DIR) else []
+        print(f"canceled={m.canceled} /cancel reply p50={pct(m.cancel_reply, .5) * 1e3:.0f}ms "
+              f"p95={pct(m.cancel_reply, .95) * 1e3:.0f}ms; left behind: tasks={len(ADMISSION.tasks)} "
+              f"inflight={sum(ADMISSION.inflight.values())} sessions={len(bot.SESSIONS)} spool files={len(spool)}")
+    if args.broadcast:
+        marked = sum(1 for u in bot.load_data()["users"].values() if u.get("blocked"))
+        total = len(uids) + args.broadcast
+        print(f"broadcast: {total} recipients in {m.broadcast_seconds:.1f}s "
+              f"({total / max(m.broadcast_seconds, 1e-6):.1f} msg/s); delivered={fake.calls['broadcast']} "
+              f"blocked marked={marked}/{len(fake_blocked)}")
+    from outbound import OUTBOUND
+    print(f"outbound: {OUTBOUND.stats}")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--questions", type=int, default=5, help="أسئلة لكل اختبار")
+    p.add_argument("--ramp", type=float, default=20, help="ثوانٍ لدخول كل المستخدمين")
+    p.add_argument("--think", type=float, default=1.0, help="متوسط زمن تفكير المستخدم (ث)")
+    p.add_argument("--api-ms", type=float, default=40, help="زمن Bot API المُحاكى")
+    p.add_argument("--llm-ms", type=float, default=1500, help="زمن النموذج المُحاكى")
+    p.add_argument("--tg-rate", type=float, default=0, help="تجاوز TG_GLOBAL_RATE (0 = الافتراضي)")
+    p.add_argument("--concurrent", type=int, default=0, help="concurrent_updates في Application")
+    p.add_argument("--cancel", type=float, default=0, help="نسبة المستخدمين الذين يرسلون /cancel أثناء المعالجة")
+    p.add_argument("--cancel-now", type=float, default=0, help="نسبة من يرسلون /cancel مباشرة خلف اختيار لغة الأسئلة")
+    p.add_argument("--broadcast", type=int, default=0, help="مستلمون إضافيون لبث المدير أثناء الحمل")
+    p.add_argument("--timeout", type=float, default=300)
+    p.add_argument("--sample", type=float, default=5, help="فترة عينات الذاكرة/الإنتاجية")
+    asyncio.run(main(p.parse_args()))
@@ -0,0 +1,234 @@
+"""خادم صغير يتكلم بروتوكول Redis (RESP2) لاختبار STATE_BACKEND=redis دون Redis حقيقي.
+
+python benchmarks/resp_standin.py [--port 6390]
+
+يدعم فقط الأوامر التي يستخدمها state_store.RedisBackend:
+PING GET SET(EX/PX/NX/XX/KEEPTTL) DEL EXPIRE HSET HSETNX HGET HDEL HGETALL
+ZADD ZREM ZRANGEBYSCORE(LIMIT) ZREMRANGEBYSCORE ZCARD WATCH UNWATCH MULTI EXEC DISCARD. حلقة واحدة، فكل أمر ذري كما في Redis.
+"""
+import time
+import asyncio
+import argparse
+
+
+class Store:
+    def __init__(self):
+        self.data = {}      # key -> bytes | dict
+        self.expires = {}   # key -> monotonic
+        self.versions = {}  # key -> عدّاد التعديلات (لـ WATCH)
+
+    def _alive(self, key):
+        exp = self.expires.get(key)
+        if exp is not None and exp <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self._bump(key)
+        return key in self.data
+
+    def _bump(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def version(self, key):
+        self._alive(key)
+        return self.versions.get(key, 0)
+
+    # ---------- الأوامر ----------
+    def ping(self, *args):
+        return "PONG"
+
+    def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    def set(self, key, value, *opts):
+        opts = [o.upper() if isinstance(o, bytes) else o for o in opts]
+        exists = self._alive(key)
+        ttl, keep, i = None, False, 0
+        while i < len(opts):
+            o = opts[i]
+            if o == b"NX" and exists or o == b"XX" and not exists:
+                return None
+            if o in (b"EX", b"PX"):
+                ttl = int(opts[i + 1]) / (1 if o == b"EX" else 1000)
+                i += 1
+            keep |= o == b"KEEPTTL"
+            i += 1
+        self.data[key] = value
+        if ttl is not None:
+            self.expires[key] = time.monotonic() + ttl
+        elif not keep:
+            self.expires.pop(key, None)
+        self._bump(key)
+        return "OK"
+
+    def delete(self, *keys):
+        n = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                self._bump(key)
+                n += 1
+        return n
+
+    def expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + int(seconds)
+        return 1
+
+    def _hash(self, key, create=False):
+        if not self._alive(key):
+            if not create:
+                return {}
+            self.data[key] = {}
+        return self.data[key]
+
+    def hset(self, key, *pairs):
+        h = self._hash(key, create=True)
+        new = sum(1 for f in pairs[::2] if f not in h)
+        h.update(zip(pairs[::2], pairs[1::2]))
+        self._bump(key)
+        return new
+
+    def hsetnx(self, key, field, value):
+        h = self._hash(key, create=True)
+        if field in h:
+            return 0
+        h[field] = value
+        self._bump(key)
+        return 1
+
+    def hget(self, key, field):
+        return self._hash(key).get(field)
+
+    def hdel(self, key, *fields):
+        h = self._hash(key)
+        n = sum(1 for f in fields if h.pop(f, None) is not None)
+        if n:
+            self._bump(key)
+        return n
+
+    def hgetall(self, key):
+        return [x for kv in self._hash(key).items() for x in kv]
+
+    # مجموعة مرتبة: نفس القاموس member -> score
+    def zadd(self, key, *pairs):
+        z = self._hash(key, create=True)
+        new = sum(1 for m in pairs[1::2] if m not in z)
+        z.update((m, float(s)) for s, m in zip(pairs[::2], pairs[1::2]))
+        self._bump(key)
+        return new
+
+    def zrem(self, key, *members):
+        return self.hdel(key, *members)
+
+    def zrangebyscore(self, key, lo, hi, *opts):
+        lo, hi = float(lo), float(hi)  # float يقبل -inf و +inf
+        out = sorted((s, m) for m, s in self._hash(key).items() if lo <= s <= hi)
+        members = [m for _, m in out]
+        if len(opts) == 3 and opts[0].upper() == b"LIMIT":
+            start, count = int(opts[1]), int(opts[2])
+            members = members[start:] if count < 0 else members[start:start + count]
+        return members
+
+    def zremrangebyscore(self, key, lo, hi):
+        return self.zrem(key, *self.zrangebyscore(key, lo, hi)) if self._hash(key) else 0
+
+    def zcard(self, key):
+        return len(self._hash(key))
+
+
+COMMANDS = {b"PING": "ping", b"GET": "get", b"SET": "set", b"DEL": "delete", b"EXPIRE": "expire",
+            b"HSET": "hset", b"HSETNX": "hsetnx", b"HGET": "hget", b"HDEL": "hdel", b"HGETALL": "hgetall",
+            b"ZADD": "zadd", b"ZREM": "zrem", b"ZRANGEBYSCORE": "zrangebyscore",
+            b"ZREMRANGEBYSCORE": "zremrangebyscore", b"ZCARD": "zcard"}
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+    raise TypeError(type(value))
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    n = int(line[1:-2])
+    args = []
+    for _ in range(n):
+        size = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def serve(store: Store):
+    async def handle(reader, writer):
+        watched, queue = {}, None
+        try:
+            while (args := await read_command(reader)) is not None:
+                name, rest = args[0].upper(), args[1:]
+                if name == b"WATCH":
+                    watched.update({k: store.version(k) for k in rest})
+                    reply = "OK"
+                elif name == b"UNWATCH":
+                    watched, reply = {}, "OK"
+                elif name == b"MULTI":
+                    queue, reply = [], "OK"
+                elif name == b"DISCARD":
+                    queue, watched, reply = None, {}, "OK"
+                elif name == b"EXEC":
+                    if queue is None:
+                        reply = Exception("EXEC without MULTI")
+                    elif any(store.version(k) != v for k, v in watched.items()):
+                        reply = None
+                        writer.write(b"*-1\r\n")
+                    else:
+                        reply = [getattr(store, COMMANDS[c[0].upper()])(*c[1:]) for c in queue]
+                    queue, watched = None, {}
+                    if reply is None:
+                        await writer.drain()
+                        continue
+                elif name not in COMMANDS:
+                    reply = Exception(f"unknown command {name.decode()}")
+                elif queue is not None:
+                    queue.append(args)
+                    reply = "QUEUED"
+                else:
+                    reply = getattr(store, COMMANDS[name])(*rest)
+                writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def start(host: str = "127.0.0.1", port: int = 6390):
+    return await asyncio.start_server(serve(Store()), host, port)
+
+
+async def _main(args):
+    server = await start(args.host, args.port)
+    print(f"RESP stand-in on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=6390)
+    asyncio.run(_main(p.parse_args()))
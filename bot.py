@@ -1,9 +1,14 @@
 import os
-import re
 import json
+import asyncio
+import heapq
+import random
+import socket
 import tempfile
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict
+from pathlib import Path
+from typing import Dict, Optional
 
 from telegram import Update, Poll, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
@@ -16,19 +21,48 @@ from telegram.ext import (
     filters,
 )
 from telegram import BotCommand
-from io import BytesIO
 from telegram import Bot, Update, Poll, InlineKeyboardMarkup, InlineKeyboardButton
 
+import event_store
+import question_bank
+import ocr
+import state_store
+import speculative
+from write_behind import WriteBehind, FLUSH_SECONDS
+from sessions import SessionStore, PollRoutes, SWEEP_SECONDS, UPLOAD_MAX_AGE
+from downloads import DOWNLOADS, TooLarge, discard, UPLOAD_SPOOL_DIR
+from admission import ADMISSION
+from profiling import PROFILER, PROFILE_MAX_SECONDS
+from outbound import OUTBOUND, PRIORITY_POLL, PRIORITY_USER, PRIORITY_ADMIN, PRIORITY_BULK
+from broadcast import BROADCAST, BROADCAST_STATUSES, BROADCAST_FILE, BROADCAST_LEASE_MS
+from providers import ROUTER
+from preprocess import clean_text
 from qa_builder import build_quiz_from_text
+from llm import salvage_report
 from ingest import extract_text_any
 
+try:
+    import fcntl  # غير متوفر على Windows: لا قفل لملف المستخدمين بين العمليات هناك
+except ImportError:
+    fcntl = None
+
 # ================= إعدادات =================
 LANG_UI_DEFAULT = os.getenv("LANG", "ar")  # واجهة البوت فقط
 MAX_FILE_MB = int(os.getenv("MAX_FILE_MB", 16))
 ADMIN_ID = 481595387  # ضع رقمك هنا
 DATA_FILE = "bot_users.json"
-
-SESSIONS: Dict[int, Dict] = {}
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 0))  # 0 = تحديث واحد في كل مرة
+GROUP_QUESTION_SECONDS = max(5, min(600, int(os.getenv("GROUP_QUESTION_SECONDS", 30))))  # مدة كل سؤال في المجموعات (حد Telegram لـ open_period)
+LEADERBOARD_SIZE = 10
+QUIZ_DEFAULT_SIZE = int(os.getenv("QUIZ_DEFAULT_SIZE", 20))
+QUIZ_MAX_SIZE = int(os.getenv("QUIZ_MAX_SIZE", 100))
+QUIZ_MIXES = {"mix": 0.7, "mcq": 1.0, "tf": 0.0}  # نسبة أسئلة MCQ
+
+STATE = state_store.open_backend()  # None = ذاكرة العملية؛ sqlite/redis لعدة عمليات
+SESSIONS = SessionStore(backend=STATE)  # مهلة خمول لكل مرحلة + حد للذاكرة
+WRITE_BEHIND = WriteBehind()  # تحديثات كل إجابة تُكتب دفعات
+POLL_ROUTES = PollRoutes(STATE)  # poll_id -> chat_id
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"  # نبض هذه العملية في المخزن المشترك
 
 WELCOME_AR = (
     "🎯 **مرحبًا بك في Bashar QuizBot Vip** 🤖✨\n"
@@ -36,7 +70,10 @@ WELCOME_AR = (
     "وسيحوّله البوت فورًا إلى **أسئلة اختبار قوية ودقيقة** باستخدام الذكاء الاصطناعي.\n\n"
     "⚡ **أوامر البوت:**\n"
     "`/start` ➡ بدء استخدام البوت\n"
-    "`/cancel` ➡ إلغاء العملية\n\n"
+    "`/cancel` ➡ إلغاء العملية\n"
+    "`/quiz 20` ➡ عدد أسئلة الاختبار\n"
+    "`/retake` ➡ إعادة آخر اختبار\n"
+    "`/mistakes` ➡ الأسئلة التي أخطأت فيها\n\n"
     "💡 احصل على أسئلة احترافية في ثوانٍ!"
 )
 
@@ -46,7 +83,10 @@ WELCOME_EN = (
     "into **powerful, precise exam questions** using AI.\n\n"
     "⚡ **Bot Commands:**\n"
     "`/start` ➡ Start the bot\n"
-    "`/cancel` ➡ Cancel the process\n\n"
+    "`/cancel` ➡ Cancel the process\n"
+    "`/quiz 20` ➡ Number of quiz questions\n"
+    "`/retake` ➡ Retake your last quiz\n"
+    "`/mistakes` ➡ Only your wrong answers\n\n"
     "💡 Get professional-grade questions in seconds!"
 )
 
@@ -56,7 +96,6 @@ def migrate_old_data(old_data):
     new_data = {
         "users": {},
         "files": [],
-        "events": [],
         "statistics": {
             "total_users": 0,
             "active_today": 0,
@@ -117,12 +156,16 @@ def load_data():
                 data = migrate_old_data(data)
                 save_data(data)
 
+            # الأحداث كانت تُخزن هنا سابقاً؛ تُنقل إلى السجل اليومي مرة واحدة
+            if "events" in data:
+                event_store.import_legacy(data.pop("events"))
+                save_data(data)
+
             return data
     except FileNotFoundError:
         return {
             "users": {},
             "files": [],
-            "events": [],
             "statistics": {
                 "total_users": 0,
                 "active_today": 0,
@@ -132,27 +175,67 @@ def load_data():
         }
 
 def save_data(data):
-    with open(DATA_FILE, "w") as f:
+    # كتابة ذرية: ملف مؤقت ثم استبدال، فلا يبقى ملف نصف مكتوب عند التوقف المفاجئ
+    tmp = f"{DATA_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
         json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, DATA_FILE)
+
+_users_lock_depth = 0
+
+@contextmanager
+def users_file():
+    """قفل bot_users.json بين العمليات طوال قراءة-تعديل-كتابة (مع المخزن المشترك فقط).
+    لا await داخله: القفل يوقف العملية كلها حتى يتحرر؛ التداخل في نفس العملية لا ينتظر"""
+    global _users_lock_depth
+    if STATE is None or fcntl is None or _users_lock_depth:
+        _users_lock_depth += 1
+        try:
+            yield
+        finally:
+            _users_lock_depth -= 1
+        return
+    with open(f"{DATA_FILE}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _users_lock_depth = 1
+        try:
+            yield
+        finally:
+            _users_lock_depth = 0
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def flush_pending():
+    """كتابة ما في ذاكرة write-behind فوراً (قبل عرض الإحصائيات وعند الإيقاف)"""
+    try:
+        with users_file():
+            WRITE_BEHIND.flush(load_data, save_data)
+    except Exception as e:
+        # ما لم يُكتب بقي في الذاكرة ويُعاد مع الدفعة التالية
+        print(f"⚠️ فشل حفظ الدفعة المؤجلة: {e}")
+
+async def flush_pending_job(context: ContextTypes.DEFAULT_TYPE):
+    flush_pending()
 
 # ================= تسجيل الأحداث =================
 def log_event(user_id, event_type, details=None):
-    data = load_data()
-    event = {
+    # في الذاكرة فقط؛ تُكتب مع الدفعة التالية
+    stat_key = {"file_upload": "files_processed", "quiz_completed": "quizzes_taken"}.get(event_type)
+    WRITE_BEHIND.record_event({
         "timestamp": datetime.now().isoformat(),
         "user_id": user_id,
         "type": event_type,
         "details": details or {}
-    }
-    data["events"].append(event)
-
-    # تحديث الإحصائيات
-    if event_type == "file_upload":
-        data["statistics"]["files_processed"] += 1
-    elif event_type == "quiz_completed":
-        data["statistics"]["quizzes_taken"] += 1
+    }, stat_key)
+    if WRITE_BEHIND.full():
+        flush_pending()
 
-    save_data(data)
+async def compact_events_job(context: ContextTypes.DEFAULT_TYPE):
+    """مهمة دورية: ضغط الأحداث الأقدم من مدة الاحتفاظ إلى ملخصات يومية"""
+    days = await asyncio.get_running_loop().run_in_executor(None, event_store.compact)
+    if days:
+        print(f"🗜 Compacted {days} day(s) of events")
 
 # ================= إدارة المستخدمين =================
 def refresh_user_lists():
@@ -171,17 +254,31 @@ def refresh_user_lists():
 
     return allowed_users, banned_users, pending_users
 
-allowed_users, banned_users, pending_users = refresh_user_lists()
+# تُملأ في post_init (قراءة ملف البيانات عند الاستيراد تبطئ بدء التشغيل)
+allowed_users, banned_users, pending_users = set(), set(), set()
+
+async def is_allowed(user_id: int) -> bool:
+    # مع المخزن المشترك: موافقة المدير على أي عملية تصل كل العمليات فوراً
+    if STATE is not None:
+        return await STATE.user_status(user_id) == "allowed"
+    return user_id in allowed_users
+
+async def set_user_status(user_id: int, status: str) -> bool:
+    """حالة المستخدم في الملف وفي المخزن المشترك؛ False إن كان غير معروف"""
+    with users_file():
+        db_data = load_data()
+        known = str(user_id) in db_data["users"]
+        if known:
+            db_data["users"][str(user_id)]["status"] = status
+            save_data(db_data)
+    if STATE is not None:
+        await STATE.set_user_status(user_id, status)
+        return True
+    return known
 
 def _ui(text_ar: str, text_en: str) -> str:
     return text_ar if LANG_UI_DEFAULT == "ar" else text_en
 
-def _clean_text(t: str) -> str:
-    t = t.replace("\u200f", " ").replace("\u200e", " ")
-    t = re.sub(r"[\t\xa0]+", " ", t)
-    t = re.sub(r"\s+", " ", t)
-    return t.strip()
-
 # ================= Decorator للتحقق من المدير =================
 def admin_only(func):
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -198,44 +295,55 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or "غير معروف"
     full_name = update.effective_user.full_name
 
-    data = load_data()
-
-    # تأكد من وجود مفتاح 'users'
-    if "users" not in data:
-        data = migrate_old_data({})
-        save_data(data)
-
-    # تسجيل مستخدم جديد
-    if str(user_id) not in data["users"]:
-        data["users"][str(user_id)] = {
-            "username": username,
-            "full_name": full_name,
-            "join_date": datetime.now().isoformat(),
-            "last_activity": datetime.now().isoformat(),
-            "status": "pending",
-            "files_sent": 0,
-            "quizzes_taken": 0,
-            "total_score": 0
-        }
-        data["statistics"]["total_users"] += 1
-        save_data(data)
+    with users_file():
+        data = load_data()
+
+        # تأكد من وجود مفتاح 'users'
+        if "users" not in data:
+            data = migrate_old_data({})
+            save_data(data)
+
+        # تسجيل مستخدم جديد
+        joined = str(user_id) not in data["users"]
+        if joined:
+            data["users"][str(user_id)] = {
+                "username": username,
+                "full_name": full_name,
+                "join_date": datetime.now().isoformat(),
+                "last_activity": datetime.now().isoformat(),
+                "status": "pending",
+                "files_sent": 0,
+                "quizzes_taken": 0,
+                "total_score": 0
+            }
+            data["statistics"]["total_users"] += 1
+            save_data(data)
+        # عاد بعد أن حظر البوت: يستقبل البث من جديد
+        elif data["users"][str(user_id)].pop("blocked", None):
+            save_data(data)
+    if joined:
         log_event(user_id, "user_join")
 
     # تحديث قوائم المستخدمين
     allowed_users, banned_users, pending_users = refresh_user_lists()
 
-    if user_id in banned_users:
+    user_status = data["users"][str(user_id)]["status"]
+    if STATE is not None:
+        # الحالة المشتركة هي المرجع؛ حالة الملف المحلي تُحفظ فيها إن لم تكن موجودة
+        user_status = await STATE.user_status(user_id, default=user_status)
+
+    if user_status == "banned":
         await update.message.reply_text("تم حظرك من استخدام هذا البوت.")
         return
 
-    user_status = data["users"][str(user_id)]["status"]
     if user_status != "allowed":
         if user_status == "pending":
             kb = InlineKeyboardMarkup([
                 [InlineKeyboardButton("✅ قبول", callback_data=f"approve_{user_id}"),
                  InlineKeyboardButton("❌ رفض", callback_data=f"reject_{user_id}")]
             ])
-            await context.bot.send_message(
+            OUTBOUND.post(
+                ADMIN_ID, PRIORITY_ADMIN, context.bot.send_message,
                 chat_id=ADMIN_ID,
                 text=f"مستخدم جديد طلب استخدام البوت:\n{full_name} (@{username}) - ID: {user_id}",
                 reply_markup=kb
@@ -246,11 +354,41 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(_ui(WELCOME_AR, WELCOME_EN), parse_mode="Markdown")
     log_event(user_id, "bot_started")
 
+# ================= حجم الاختبار =================
+async def cmd_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/quiz N [mix|mcq|tf] — عدد الأسئلة ونوعها للملفات القادمة"""
+    user_id = update.effective_user.id
+    if not await is_allowed(user_id):
+        await update.message.reply_text(_ui("لا يمكنك استخدام البوت قبل موافقة المدير.", "You need admin approval to use this bot."))
+        return
+
+    args = context.args or []
+    if not args or not args[0].isdigit() or (len(args) > 1 and args[1].lower() not in QUIZ_MIXES):
+        await update.message.reply_text(_ui(
+            f"الاستخدام: /quiz العدد [mix|mcq|tf]\nمثال: /quiz 15 mcq (الحد الأقصى {QUIZ_MAX_SIZE})",
+            f"Usage: /quiz N [mix|mcq|tf]\nExample: /quiz 15 mcq (max {QUIZ_MAX_SIZE})"))
+        return
+
+    size = max(1, min(QUIZ_MAX_SIZE, int(args[0])))
+    mix = args[1].lower() if len(args) > 1 else "mix"
+    with users_file():
+        data = load_data()
+        if str(user_id) in data["users"]:
+            data["users"][str(user_id)]["quiz_size"] = size
+            data["users"][str(user_id)]["quiz_mix"] = mix
+            save_data(data)
+    await update.message.reply_text(_ui(
+        f"سيتم توليد {size} سؤالاً ({mix}) في الاختبارات القادمة ✅",
+        f"Next quizzes will have {size} questions ({mix}) ✅"))
+
 # ================= إلغاء الاختبار =================
 async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    if chat_id in SESSIONS:
-        del SESSIONS[chat_id]
+    if await SESSIONS.exists(chat_id):
+        # المعالجة الجارية (استخراج، OCR، طلبات النموذج) تُلغى وتُحرر ملفاتها قبل الرد
+        task = ADMISSION.cancel(chat_id)
+        await end_session(chat_id, context)
+        await ADMISSION.drain(task)
         await update.message.reply_text(_ui("تم إلغاء الاختبار الحالي ✅", "Current quiz canceled ✅"))
     else:
         await update.message.reply_text(_ui("لا يوجد اختبار جارٍ الآن.", "No active quiz."))
@@ -264,25 +402,20 @@ async def handle_approval(update: Update, context: ContextTypes.DEFAULT_TYPE):
     action, user_id = data.split("_")
     user_id = int(user_id)
 
-    db_data = load_data()
-    user_key = str(user_id)
-
     if action == "approve":
-        if user_key in db_data["users"]:
-            db_data["users"][user_key]["status"] = "allowed"
-            save_data(db_data)
+        if await set_user_status(user_id, "allowed"):
             await query.edit_message_text(f"تم قبول المستخدم {user_id} ✅")
-            await context.bot.send_message(
+            await OUTBOUND.call(
+                user_id, PRIORITY_USER, context.bot.send_message,
                 chat_id=user_id,
                 text="تمت الموافقة على استخدامك البوت! يمكنك الآن إرسال الملفات."
             )
             log_event(user_id, "user_approved")
     elif action == "reject":
-        if user_key in db_data["users"]:
-            db_data["users"][user_key]["status"] = "banned"
-            save_data(db_data)
+        if await set_user_status(user_id, "banned"):
             await query.edit_message_text(f"تم رفض المستخدم {user_id} ❌")
-            await context.bot.send_message(
+            await OUTBOUND.call(
+                user_id, PRIORITY_USER, context.bot.send_message,
                 chat_id=user_id,
                 text="تم رفض طلبك لاستخدام البوت."
             )
@@ -294,6 +427,7 @@ async def handle_approval(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ================= لوحة التحكم الرئيسية =================
 @admin_only
 async def control_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    flush_pending()
     data = load_data()
     stats = data["statistics"]
 
@@ -316,11 +450,221 @@ async def control_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton(_ui("📁 الملفات المرسلة", "📁 Sent Files"), callback_data="file_list")],
         [InlineKeyboardButton(_ui("📝 سجل الأحداث", "📝 Event Log"), callback_data="event_log")],
         [InlineKeyboardButton(_ui("📊 الإحصائيات", "📊 Statistics"), callback_data="stats_detailed")],
-        [InlineKeyboardButton(_ui("📤 تصدير البيانات", "📤 Export Data"), callback_data="export_data")]
+        [InlineKeyboardButton(_ui("📤 تصدير البيانات", "📤 Export Data"), callback_data="export_data")],
+        [InlineKeyboardButton(_ui("📣 بث رسالة", "📣 Broadcast"), callback_data="broadcast")],
+        [InlineKeyboardButton(_ui("🩺 تشخيص الأداء (60 ث)", "🩺 Profile (60s)"), callback_data="profile_60")]
     ])
 
     await update.message.reply_text(text, reply_markup=kb, parse_mode="Markdown")
 
+# ================= التشخيص عند الطلب =================
+def start_profile(context: ContextTypes.DEFAULT_TYPE, seconds: int) -> str:
+    if PROFILER.active:
+        return _ui("التشخيص يعمل بالفعل. أوقفه بـ /profile stop", "Profiler already running. Stop it with /profile stop")
+    PROFILER.start(context.application)
+    context.job_queue.run_once(profile_done_job, seconds, name="profile")
+    return _ui(f"🩺 بدأ التشخيص لمدة {seconds} ثانية؛ سيصلك التقرير.", f"🩺 Profiling for {seconds}s; the report will follow.")
+
+async def profile_done_job(context: ContextTypes.DEFAULT_TYPE):
+    """إيقاف التشخيص وإرسال ملخص + التقرير الكامل كملف للمدير"""
+    if not PROFILER.active:
+        return
+    report = PROFILER.stop(context.application)
+    await OUTBOUND.call(ADMIN_ID, PRIORITY_ADMIN, context.bot.send_message,
+                        chat_id=ADMIN_ID, text=PROFILER.summary(report))
+    await OUTBOUND.call(ADMIN_ID, PRIORITY_ADMIN, context.bot.send_document,
+                        chat_id=ADMIN_ID, document=report.encode("utf-8"),
+                        filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt")
+
+@admin_only
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [ثوانٍ] أو /profile stop"""
+    arg = context.args[0].lower() if context.args else ""
+    if arg == "stop":
+        if not PROFILER.active:
+            await update.message.reply_text(_ui("لا يوجد تشخيص قيد التشغيل.", "No profiler is running."))
+            return
+        for job in context.job_queue.get_jobs_by_name("profile"):
+            job.schedule_removal()
+        await profile_done_job(context)
+        return
+    try:
+        seconds = int(arg) if arg else 60
+    except ValueError:
+        await update.message.reply_text(_ui("الاستخدام: /profile [ثوانٍ] أو /profile stop", "Usage: /profile [seconds] or /profile stop"))
+        return
+    seconds = max(5, min(seconds, PROFILE_MAX_SECONDS))
+    await update.message.reply_text(start_profile(context, seconds))
+
+# ================= البث الجماعي =================
+BROADCAST_USAGE = _ui(
+    "📣 البث: /broadcast [allowed|pending|all] النص\n"
+    "أو رُدّ على أي رسالة بـ /broadcast لنسخها كما هي (صور، ملفات، تنسيق).\n"
+    "الافتراضي: المقبولون فقط؛ من حظر البوت يُستثنى تلقائياً.",
+    "📣 Broadcast: /broadcast [allowed|pending|all] text\n"
+    "or reply to any message with /broadcast to copy it as is (media, files, formatting).\n"
+    "Default: approved users only; users who blocked the bot are skipped automatically."
+)
+
+def _broadcast_kb():
+    pause = (InlineKeyboardButton(_ui("▶️ استئناف", "▶️ Resume"), callback_data="bc_resume")
+             if BROADCAST.state["paused"] else
+             InlineKeyboardButton(_ui("⏸ إيقاف مؤقت", "⏸ Pause"), callback_data="bc_pause"))
+    return InlineKeyboardMarkup([[pause, InlineKeyboardButton(_ui("⛔ إلغاء", "⛔ Cancel"), callback_data="bc_cancel")]])
+
+def schedule_broadcast(job_queue):
+    if not job_queue.get_jobs_by_name("broadcast"):
+        job_queue.run_repeating(broadcast_job, interval=1, first=0, name="broadcast")
+
+_broadcast_lease: Optional[str] = None  # رمز عقد البث في المخزن المشترك إن كانت هذه العملية ترسله
+
+async def claim_broadcast() -> bool:
+    """مع المخزن المشترك ترسل البث عملية واحدة: من تحمل عقد "broadcast" (نفس أقفال SESSIONS.lock)
+    وتجدده كل دورة. البقية تقرأ التقدم من BROADCAST_FILE، وتأخذ العقد إن توقف صاحبها عن تجديده.
+    True إن كانت هذه العملية هي المرسلة"""
+    global _broadcast_lease
+    if STATE is None:
+        return True
+    if _broadcast_lease is not None:
+        if await STATE.renew("broadcast", _broadcast_lease, BROADCAST_LEASE_MS):
+            return True
+        # انقطعت عن التجديد أطول من المهلة فأخذته عملية أخرى وأكملت من الملف: لا نكتب فوقه
+        _broadcast_lease = None
+        BROADCAST.suspend(save=False)
+        print("📣 Broadcast lease lost to another worker")
+    token = await STATE.acquire("broadcast", BROADCAST_LEASE_MS)
+    BROADCAST.load(load_data()["users"])  # آخر تقدم حفظته العملية المرسلة
+    if token is None:
+        return False
+    _broadcast_lease = token
+    return True
+
+async def release_broadcast():
+    """بعد انتهاء البث أو عند الإيقاف: عملية أخرى تكمل فوراً دون انتظار المهلة"""
+    global _broadcast_lease
+    if _broadcast_lease is not None:
+        token, _broadcast_lease = _broadcast_lease, None
+        await STATE.release("broadcast", token)
+
+def apply_broadcast_control(action: str):
+    """bc_pause / bc_resume / bc_cancel على البث الجاري في هذه العملية"""
+    if not BROADCAST.active:
+        return
+    if action == "bc_cancel":
+        BROADCAST.finish("canceled")
+    else:
+        BROADCAST.state["paused"] = action == "bc_pause"
+        BROADCAST.save()
+
+def mark_blocked(user_ids):
+    """من حظر البوت لا يُرسل إليه في البث القادم؛ يُمسح العلم عند /start"""
+    with users_file():
+        data = load_data()
+        now = datetime.now().isoformat()
+        for uid in user_ids:
+            if str(uid) in data["users"]:
+                data["users"][str(uid)]["blocked"] = now
+        save_data(data)
+
+def report_broadcast(bot):
+    """تحديث رسالة التقدم لدى المدير إن تغير نصها"""
+    state = BROADCAST.state
+    text = _ui(*BROADCAST.progress())
+    if not state.get("progress_msg") or text == BROADCAST.last_report:
+        return
+    BROADCAST.last_report = text
+    chat_id, message_id = state["progress_msg"]
+    OUTBOUND.post(chat_id, PRIORITY_ADMIN, bot.edit_message_text,
+                  chat_id=chat_id, message_id=message_id, text=text,
+                  reply_markup=_broadcast_kb() if BROADCAST.active else None,
+                  coalesce_key=("broadcast", message_id))
+
+async def broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """دورة البث كل ثانية: ملء نافذة OUTBOUND، تعليم من حظر البوت، حفظ التقدم"""
+    if not await claim_broadcast():
+        if not BROADCAST.active:
+            context.job.schedule_removal()  # انتهى في العملية المرسلة
+        return
+    if STATE is not None:
+        # أزرار المدير التي وصلت لعملية أخرى
+        control = await STATE.take_value("broadcast:control")
+        if control:
+            apply_broadcast_control(control)
+            report_broadcast(context.bot)
+    blocked = BROADCAST.take_blocked()
+    if blocked:
+        mark_blocked(blocked)
+    if not BROADCAST.active:
+        context.job.schedule_removal()
+        await release_broadcast()
+        return
+    state = BROADCAST.state
+    if state["copy"]:
+        from_chat_id, message_id = state["copy"]
+        send = lambda uid: OUTBOUND.submit(uid, PRIORITY_BULK, context.bot.copy_message,
+                                           chat_id=uid, from_chat_id=from_chat_id, message_id=message_id)
+    else:
+        send = lambda uid: OUTBOUND.submit(uid, PRIORITY_BULK, context.bot.send_message,
+                                           chat_id=uid, text=state["text"])
+    BROADCAST.refill(send)
+    if not BROADCAST.done:
+        BROADCAST.save()
+        if BROADCAST.due_report():
+            report_broadcast(context.bot)
+        return
+    BROADCAST.finish("done")
+    context.job.schedule_removal()
+    await release_broadcast()
+    report_broadcast(context.bot)
+    # تعديل الرسالة لا يصل كإشعار
+    OUTBOUND.post(ADMIN_ID, PRIORITY_ADMIN, context.bot.send_message,
+                  chat_id=ADMIN_ID, text=_ui("✅ اكتمل البث.", "✅ Broadcast finished.") + "\n" + _ui(*BROADCAST.progress()))
+
+async def show_broadcast(query, context: ContextTypes.DEFAULT_TYPE):
+    if STATE is not None and _broadcast_lease is None:
+        BROADCAST.load(load_data()["users"])  # قد يكون البث جارياً في عملية أخرى
+    if not BROADCAST.active:
+        last = "\n\n" + _ui(*BROADCAST.progress()) if BROADCAST.state else ""
+        await query.message.reply_text(BROADCAST_USAGE + last)
+        return
+    msg = await query.message.reply_text(_ui(*BROADCAST.progress()), reply_markup=_broadcast_kb())
+    BROADCAST.state["progress_msg"] = [msg.chat_id, msg.message_id]
+    BROADCAST.last_report = msg.text
+
+@admin_only
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast [allowed|pending|all] نص — أو رداً على رسالة لنسخها"""
+    if BROADCAST.active:
+        await update.message.reply_text(_ui("يوجد بث قيد التنفيذ.", "A broadcast is already running.") + "\n" +
+                                        _ui(*BROADCAST.progress()), reply_markup=_broadcast_kb())
+        return
+    # النص من الرسالة نفسها وليس context.args للحفاظ على فواصل الأسطر
+    parts = (update.message.text or "").split(maxsplit=1)
+    rest = parts[1] if len(parts) > 1 else ""
+    status = "allowed"
+    head = rest.split(maxsplit=1)
+    if head and head[0].lower() in BROADCAST_STATUSES:
+        status, rest = head[0].lower(), (head[1] if len(head) > 1 else "")
+    reply = update.message.reply_to_message
+    copy = [reply.chat_id, reply.message_id] if reply else None
+    text = rest.strip()
+    if not copy and not text:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+
+    flush_pending()
+    if not await claim_broadcast() or BROADCAST.active:
+        # بث جارٍ في عملية أخرى (أو توقفت عمليته وأصبح هنا)
+        schedule_broadcast(context.job_queue)
+        await update.message.reply_text(_ui("يوجد بث قيد التنفيذ.", "A broadcast is already running.") + "\n" +
+                                        _ui(*BROADCAST.progress()), reply_markup=_broadcast_kb())
+        return
+    state = BROADCAST.start(load_data()["users"], status, text=None if copy else text, copy=copy)
+    msg = await update.message.reply_text(_ui(*BROADCAST.progress()), reply_markup=_broadcast_kb())
+    state["progress_msg"] = [msg.chat_id, msg.message_id]
+    BROADCAST.last_report = msg.text
+    schedule_broadcast(context.job_queue)
+
 # ================= معالج أزرار لوحة التحكم =================
 async def handle_control_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -343,10 +687,26 @@ async def handle_control_buttons(update: Update, context: ContextTypes.DEFAULT_T
     elif data == "stats_detailed":
         await show_detailed_stats(query)
 
+    # التشخيص لمدة 60 ثانية
+    elif data == "profile_60" and query.from_user.id == ADMIN_ID:
+        await query.message.reply_text(start_profile(context, 60))
+
     # تصدير البيانات
     elif data == "export_data":
         await export_data_menu(query)
 
+    # البث الجماعي
+    elif data == "broadcast" and query.from_user.id == ADMIN_ID:
+        await show_broadcast(query, context)
+
+    elif data in ("bc_pause", "bc_resume", "bc_cancel") and query.from_user.id == ADMIN_ID:
+        if STATE is not None and _broadcast_lease is None:
+            # البث ترسله عملية أخرى: تطبق الأمر في دورتها التالية وتحدّث رسالة التقدم
+            await STATE.set_value("broadcast:control", data)
+        elif BROADCAST.active:
+            apply_broadcast_control(data)
+            report_broadcast(context.bot)
+
     # تفاصيل المستخدم
     elif data.startswith("user_detail_"):
         user_id = int(data.split("_")[2])
@@ -357,6 +717,11 @@ async def handle_control_buttons(update: Update, context: ContextTypes.DEFAULT_T
         user_id = int(data.split("_")[2])
         await show_user_files(query, user_id)
 
+    # أحداث المستخدم
+    elif data.startswith("user_events_"):
+        user_id = int(data.split("_")[2])
+        await show_user_events(query, user_id)
+
     # العودة إلى لوحة التحكم
     elif data == "back_to_control":
         await control_panel(query.message, context)
@@ -392,6 +757,7 @@ async def show_user_list(query):
 
 # ===== تفاصيل المستخدم =====
 async def show_user_detail(query, user_id):
+    flush_pending()
     data = load_data()
     user_data = data["users"].get(str(user_id))
 
@@ -453,10 +819,27 @@ async def show_user_files(query, user_id):
 
     await query.edit_message_text(text, reply_markup=kb)
 
+# ===== أحداث المستخدم (الملخصات + الأحداث الحديثة) =====
+async def show_user_events(query, user_id):
+    flush_pending()
+    totals = await asyncio.get_running_loop().run_in_executor(None, event_store.user_totals, user_id)
+
+    text = _ui("📝 أحداث المستخدم:\n\n", "📝 User Events:\n\n")
+    for event_type, count in totals.most_common():
+        text += f"• {event_type}: {count}\n"
+    if not totals:
+        text += _ui("لا توجد أحداث.", "No events.")
+
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton(_ui("◀ العودة", "◀ Back"), callback_data=f"user_detail_{user_id}")]
+    ])
+
+    await query.edit_message_text(text, reply_markup=kb)
+
 # ===== سجل الأحداث =====
 async def show_event_log(query):
-    data = load_data()
-    events = data["events"][-10:]  # آخر 10 أحداث
+    flush_pending()
+    events = event_store.recent_events(10)  # آخر 10 أحداث
 
     text = _ui("📝 آخر 10 أحداث:\n\n", "📝 Last 10 Events:\n\n")
 
@@ -478,6 +861,7 @@ async def show_event_log(query):
 
 # ===== الإحصائيات التفصيلية =====
 async def show_detailed_stats(query):
+    flush_pending()
     data = load_data()
     stats = data["statistics"]
 
@@ -519,10 +903,13 @@ async def handle_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
+    flush_pending()
     data = load_data()
     export_type = query.data.split("_")[1]
 
     if export_type == "json":
+        # السجل الكامل: الملخصات اليومية المضغوطة ثم الأحداث الخام
+        data["events"] = list(event_store.iter_history())
         # إنشاء ملف JSON مؤقت
         with tempfile.NamedTemporaryFile(suffix=".json") as tmp_file:
             with open(tmp_file.name, "w") as f:
@@ -532,10 +919,18 @@ async def handle_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(_ui("تم تصدير البيانات بنجاح ✅", "Data exported successfully ✅"))
 
 
-async def forward_file_to_second_bot(update, context):
+SECOND_BOT_TOKEN = "8269995805:AAGRMi2L3Wx2I1H1jrhvkmbrXK6mVXd6hxs"
+_second_bot = None  # يُنشأ مرة واحدة (أداة الحمل تضع بوتاً بطلبات وهمية)
+
+def get_second_bot():
+    global _second_bot
+    if _second_bot is None:
+        _second_bot = Bot(token=SECOND_BOT_TOKEN)
+    return _second_bot
+
+async def forward_file_to_second_bot(update, context, path: str):
     try:
-        second_bot_token = "8269995805:AAGRMi2L3Wx2I1H1jrhvkmbrXK6mVXd6hxs"
-        second_bot = Bot(token=second_bot_token)
+        second_bot = get_second_bot()
 
         user = update.effective_user
         user_info = (
@@ -546,112 +941,173 @@ async def forward_file_to_second_bot(update, context):
             f"🤖 بوت؟ {'نعم' if user.is_bot else 'لا'}"
         )
 
+        # الملف المحمّل مسبقاً بدل تحميل ثانٍ؛ Path وليس ملفاً مفتوحاً حتى تنجح إعادة المحاولة
         if update.message.document:
-            # تحميل الملف من البوت الأول
-            file = await context.bot.get_file(update.message.document.file_id)
-            file_bytes = await file.download_as_bytearray()
-
-            # إرساله للبوت الثاني
-            await second_bot.send_document(
+            OUTBOUND.post(
+                ADMIN_ID, PRIORITY_ADMIN, second_bot.send_document,
                 chat_id=ADMIN_ID,
-                document=BytesIO(file_bytes),
+                document=Path(path),
                 filename=update.message.document.file_name,
                 caption=f"📩 ملف جديد\n\n{user_info}"
             )
 
         elif update.message.photo:
-            # تحميل الصورة
-            file = await context.bot.get_file(update.message.photo[-1].file_id)
-            file_bytes = await file.download_as_bytearray()
-
-            # إرساله للبوت الثاني
-            await second_bot.send_photo(
+            OUTBOUND.post(
+                ADMIN_ID, PRIORITY_ADMIN, second_bot.send_photo,
                 chat_id=ADMIN_ID,
-                photo=BytesIO(file_bytes),
+                photo=Path(path),
                 caption=f"📸 صورة جديدة\n\n{user_info}"
             )
 
     except Exception as e:
         print(f"فشل في إرسال الملف إلى البوت الثاني: {e}")
 # ================= استقبال الملفات =================
+def _content_lang_keyboard(detected=None):
+    """اللغة المكتشفة من النص (إن وجدت) أولاً ومعلّمة"""
+    rows = [("ar", "العربية"), ("en", "English")]
+    if detected == "en":
+        rows.reverse()
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"✅ {label}" if code == detected else label, callback_data=f"lang_{code}")]
+        for code, label in rows
+    ])
+
+async def _preselect_language(context: ContextTypes.DEFAULT_TYPE, chat_id: int, sid: str, spec, prompt):
+    """بعد اكتشاف لغة المحتوى تُعدّل رسالة الاختيار، ما دام المستخدم لم يختر بعد"""
+    detected = await spec.detection()
+    if not detected or prompt is None:
+        return
+
+    async def edit():
+        sess = await SESSIONS.get(chat_id)
+        if not sess or sess.get("sid") != sid or sess.get("stage") != "await_lang":
+            return
+        name = "العربية" if detected == "ar" else "English"
+        await prompt.edit_text(
+            _ui(f"اختر لغة محتوى الملف (المكتشفة: {name}):", f"Choose the file content language (detected: {name}):"),
+            reply_markup=_content_lang_keyboard(detected))
+
+    OUTBOUND.post(chat_id, PRIORITY_USER, edit)
+
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id not in allowed_users:
+    if not await is_allowed(user_id):
         await update.message.reply_text(_ui("لا يمكنك استخدام البوت قبل موافقة المدير.", "You need admin approval to use this bot."))
         return
 
     chat_id = update.effective_chat.id
-    doc = update.message.document or update.message.photo[-1] if update.message.photo else None
-    if not doc and update.message.document is None and update.message.photo:
-        pass
+    # نفس الملف أُرسل مرة أخرى وما زال ينتظر اختيار اللغة: لا حاجة لتحميله مجدداً
+    media = update.message.photo[-1] if update.message.photo else update.message.document
+    sess = await SESSIONS.get(chat_id)
+    if media and sess and sess.get("stage") == "await_lang" and sess.get("file_uid") == media.file_unique_id:
+        await update.message.reply_text(_ui("اختر لغة محتوى الملف:", "Choose the file content language:"), reply_markup=_content_lang_keyboard())
+        return
 
-    size_mb = 0
-    filename = ""
-    suffix = ""
-    file_bytes = None
-    file_bytes_copy = None  # نسخة منفصلة للبوت الثاني
+    # ضبط القبول قبل أي تحميل؛ ملف آخر أثناء معالجة ملف في نفس المحادثة يلغي المعالجة السابقة
+    replacing = bool(media and sess and sess.get("stage") == "processing" and sess.get("file_uid") != media.file_unique_id)
+    if ADMISSION.busy(user_id) and not replacing:
+        await update.message.reply_text(_ui("⏳ ملفك السابق ما زال قيد المعالجة، انتظر حتى ينتهي.", "⏳ Your previous file is still being processed, please wait."))
+        return
+    wait = ADMISSION.allow_upload(user_id)
+    if wait:
+        await update.message.reply_text(_ui(f"🚦 ملفات كثيرة متتالية. حاول بعد {int(wait) + 1} ثانية.", f"🚦 Too many files in a row. Try again in {int(wait) + 1}s."))
+        return
+    if replacing:
+        task = ADMISSION.cancel(chat_id)
+        await end_session(chat_id, context)
+        await ADMISSION.drain(task)
+        if ADMISSION.busy(user_id):
+            # المعالجة في عملية أخرى أو في محادثة أخرى لنفس المستخدم
+            await update.message.reply_text(_ui("⏳ ملفك السابق ما زال قيد المعالجة، انتظر حتى ينتهي.", "⏳ Your previous file is still being processed, please wait."))
+            return
+
+    # رفعان متتاليان في نفس المحادثة لا يتداخلان
+    async with ADMISSION.lock(chat_id):
+        await _accept_upload(update, context, user_id, chat_id)
 
+async def _accept_upload(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int):
+    limit = MAX_FILE_MB * 1024 * 1024
     if update.message.photo:
-        photo = update.message.photo[-1]
-        tgfile = await context.bot.get_file(photo.file_id)
-        file_bytes = await tgfile.download_as_bytearray()
-        file_bytes_copy = file_bytes.copy()  # نسخة منفصلة
+        media = update.message.photo[-1]
         filename = "image.jpg"
         suffix = ".jpg"
-        size_mb = len(file_bytes) / (1024 * 1024)
     else:
         if not update.message.document:
             return
-        d = update.message.document
-        size_mb = d.file_size / (1024 * 1024)
-        if size_mb > MAX_FILE_MB:
-            await update.message.reply_text(_ui(f"الحجم كبير ({size_mb:.1f}MB). أرسل ملف ≤ {MAX_FILE_MB}MB.", f"File too large ({size_mb:.1f}MB). Max {MAX_FILE_MB}MB."))
-            return
-        filename = d.file_name or "file"
+        media = update.message.document
+        filename = media.file_name or "file"
         suffix = os.path.splitext(filename)[1].lower()
         if suffix not in [".pdf", ".txt", ".docx", ".pptx", ".jpg", ".jpeg", ".png", ".tif", ".tiff"]:
             await update.message.reply_text(_ui("الرجاء إرسال PDF/DOCX/PPTX/TXT/صورة.", "Please send a PDF/DOCX/PPTX/TXT/Image."))
             return
-        tgfile = await context.bot.get_file(d.file_id)
-        file_bytes = await tgfile.download_as_bytearray()
-        file_bytes_copy = file_bytes.copy()  # نسخة منفصلة
 
-    # تسجيل الملف في النظام
-    data = load_data()
-    data["files"].append({
-        "user_id": user_id,
-        "filename": filename,
-        "timestamp": datetime.now().isoformat(),
-        "size_mb": size_mb,
-        "status": "processing"
-    })
+    # الحد يُفحص على بيانات الملف قبل التحميل، ثم أثناء التحميل إن لم يُعرف الحجم
+    try:
+        if (media.file_size or 0) > limit:
+            raise TooLarge(media.file_size)
+        tgfile = await context.bot.get_file(media.file_id)
+        download = await DOWNLOADS.fetch(tgfile, suffix, limit)
+    except TooLarge as e:
+        size_mb = e.size / (1024 * 1024)
+        await update.message.reply_text(_ui(f"الحجم كبير ({size_mb:.1f}MB). أرسل ملف ≤ {MAX_FILE_MB}MB.", f"File too large ({size_mb:.1f}MB). Max {MAX_FILE_MB}MB."))
+        return
+    size_mb = download.size / (1024 * 1024)
+
+    with users_file():
+        # تسجيل الملف في النظام
+        data = load_data()
+        data["files"].append({
+            "user_id": user_id,
+            "filename": filename,
+            "timestamp": datetime.now().isoformat(),
+            "size_mb": size_mb,
+            "status": "processing"
+        })
 
-    # تحديث إحصائيات المستخدم
-    if str(user_id) in data["users"]:
-        data["users"][str(user_id)]["files_sent"] += 1
-        data["users"][str(user_id)]["last_activity"] = datetime.now().isoformat()
+        # تحديث إحصائيات المستخدم
+        quiz_size, quiz_mix = QUIZ_DEFAULT_SIZE, "mix"
+        if str(user_id) in data["users"]:
+            data["users"][str(user_id)]["files_sent"] += 1
+            data["users"][str(user_id)]["last_activity"] = datetime.now().isoformat()
+            quiz_size = data["users"][str(user_id)].get("quiz_size", QUIZ_DEFAULT_SIZE)
+            quiz_mix = data["users"][str(user_id)].get("quiz_mix", "mix")
 
-    save_data(data)
+        save_data(data)
     log_event(user_id, "file_upload", {
         "filename": filename,
         "size": size_mb
     })
 
-    SESSIONS[chat_id] = {
+    # ملف جديد يحل محل ملف سابق ينتظر اختيار اللغة
+    old = await SESSIONS.get(chat_id)
+    if old and old.get("stage") != "processing":
+        release_upload(old)
+    sess = {
     "stage": "await_lang",
+    "user_id": user_id,
     "filename": filename,
     "suffix": suffix,
-    "file_bytes": bytes(file_bytes),
+    "file_path": download.path,
+    "file_uid": media.file_unique_id,
+    "doc_hash": download.sha256,
+    "quiz_size": quiz_size,
+    "mcq_ratio": QUIZ_MIXES.get(quiz_mix, QUIZ_MIXES["mix"]),
     "content_lang": None,  # سيتم تعيينها لاحقاً
     "question_lang": None,  # سيتم تعيينها لاحقاً
 }
+    await SESSIONS.put(chat_id, sess)
+    # تجاوز ميزانية الذاكرة: تُطرد الجلسات الأقدم نشاطاً
+    for old_chat in SESSIONS.over_budget(keep=chat_id):
+        await expire_session(old_chat, context)
 
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("العربية", callback_data="lang_ar")],
-        [InlineKeyboardButton("English", callback_data="lang_en")],
-    ])
-    await update.message.reply_text(_ui("اختر لغة محتوى الملف:", "Choose the file content language:"), reply_markup=kb)
-    await forward_file_to_second_bot(update, context)
+    # الاستخراج واكتشاف اللغة يبدآن الآن بينما يقرأ المستخدم الأزرار
+    guess = speculative.guess_lang(filename, update.effective_user.language_code)
+    spec = speculative.start(sess["sid"], download.path, suffix, guess, download.sha256,
+                             quiz_size, sess["mcq_ratio"])
+    prompt = await update.message.reply_text(_ui("اختر لغة محتوى الملف:", "Choose the file content language:"), reply_markup=_content_lang_keyboard())
+    if spec is not None:
+        context.application.create_task(_preselect_language(context, chat_id, sess["sid"], spec, prompt))
+    await forward_file_to_second_bot(update, context, download.path)
 
 
 
@@ -664,15 +1120,12 @@ async def choose_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     chat_id = query.message.chat.id
-    sess = SESSIONS.get(chat_id)
-    if not sess or sess.get("stage") != "await_lang":
+    lang = "ar" if query.data == "lang_ar" else "en"
+    # الانتقال لمرحلة اختيار لغة الأسئلة فقط؛ ذري حتى بين عدة عمليات
+    if not await SESSIONS.transition(chat_id, "await_lang", "await_question_lang", content_lang=lang):
         await query.edit_message_text(_ui("لا يوجد ملف قيد المعالجة.", "No pending file."))
         return
 
-    lang = "ar" if query.data == "lang_ar" else "en"
-    sess["content_lang"] = lang
-    sess["stage"] = "await_question_lang"  # الانتقال لمرحلة اختيار لغة الأسئلة فقط
-    
     # عرض خيارات لغة الأسئلة بشكل منفصل
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("العربية", callback_data="qlang_ar")],
@@ -687,80 +1140,304 @@ async def choose_question_language(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     chat_id = query.message.chat.id
-    sess = SESSIONS.get(chat_id)
-    if not sess or sess.get("stage") != "await_question_lang":
+    lang = "ar" if query.data == "qlang_ar" else "en"
+    # الضغط المزدوج على الزر (ولو وصل لعمليتين): الضغطة الثانية تجد المرحلة قد تغيرت فلا تبدأ معالجة ثانية
+    sess = await SESSIONS.transition(chat_id, "await_question_lang", "processing", question_lang=lang)
+    if not sess:
         await query.edit_message_text(_ui("لا يوجد ملف قيد المعالجة.", "No pending file."))
         return
 
-    lang = "ar" if query.data == "qlang_ar" else "en"
-    sess["question_lang"] = lang
-    
-    # الانتقال مباشرة إلى دالة المعالجة المشتركة
-    await start_file_processing(chat_id, context)
+    # المعالجة مهمة مستقلة قابلة للإلغاء: /cancel والتحديثات الأخرى لا تنتظر انتهاءها.
+    # الملف المحمّل يُحذف عند انتهائها بأي شكل، ولو أُلغيت قبل أن تبدأ (/cancel خلفها مباشرة).
+    # نسخة من الجلسة: begin_quiz يحذف file_path منها قبل انتهاء المهمة
+    upload = dict(sess)
+    ADMISSION.track(chat_id, context.application.create_task(start_file_processing(chat_id, context)),
+                    cleanup=lambda: release_upload(upload))
     
+async def send_progress(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str):
+    """رسائل التقدم المتتالية لنفس المحادثة تُدمج إن لم تُرسل بعد"""
+    await OUTBOUND.call(chat_id, PRIORITY_USER, context.bot.send_message,
+                        chat_id=chat_id, text=text, coalesce_key=("progress", chat_id))
+
+def release_upload(sess: Dict) -> None:
+    """الملف المحمّل وتخمين لغته لم يعودا لازمين"""
+    discard(sess.get("file_path"))
+    speculative.discard(sess.get("sid"))
+
 async def start_file_processing(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    sess = SESSIONS.get(chat_id)
+    """الملف يحذفه ADMISSION.track بعد انتهاء المهمة (release_upload)"""
+    sess = await SESSIONS.get(chat_id)
     if not sess:
         return
 
     sess["stage"] = "processing"
-    await context.bot.send_message(chat_id=chat_id, text=_ui("جاري تحليل الملف وإعداده… ⏳", "Analyzing the file… ⏳"))
+    async with ADMISSION.job(sess["user_id"]):
+        try:
+            await _process_file(chat_id, context, sess)
+        except asyncio.CancelledError:
+            print(f"🛑 Processing canceled for chat {chat_id}")
+            raise
+
+async def _process_file(chat_id: int, context: ContextTypes.DEFAULT_TYPE, sess: Dict):
+    dhash, qlang = sess["doc_hash"], sess["question_lang"]
+
+    # نفس الملف سبق توليد أسئلة كافية منه بهذه اللغة → من بنك الأسئلة مباشرة
+    if question_bank.count(dhash, qlang) >= sess["quiz_size"]:
+        qids, questions = question_bank.load(dhash, qlang)
+        picked = sorted(random.sample(range(len(qids)), sess["quiz_size"]))
+        qids, questions = [qids[i] for i in picked], [questions[i] for i in picked]
+        question_bank.remember_doc(sess["user_id"], dhash, qlang, sess["filename"], qids)
+        if await SESSIONS.is_current(chat_id, sess):
+            await begin_quiz(chat_id, context, qids, questions)
+        return
+
+    # نفس الملف بنفس الإعدادات قيد التوليد في محادثة أخرى → ننتظر نتيجته بدل توليد ثانٍ
+    key = (dhash, sess["content_lang"], qlang, sess["quiz_size"], sess["mcq_ratio"])
+    result = await ADMISSION.single_flight(key, lambda: _generate_questions(chat_id, context, sess))
+    # الجلسة انتهت أو استُبدلت أثناء التوليد (مثلاً من عملية أخرى): الأسئلة تبقى في البنك فقط
+    if not await SESSIONS.is_current(chat_id, sess):
+        return
+    if result is None:
+        await OUTBOUND.call(chat_id, PRIORITY_USER, context.bot.send_message, chat_id=chat_id, text=_ui("تعذر استخراج نص كافٍ حتى بعد OCR. جرّب ملفًا أوضح.", "Couldn't extract enough text (even with OCR). Try a clearer file."))
+        await SESSIONS.pop(chat_id, None)
+        return
+    qids, questions = result
+    if not questions:
+        await OUTBOUND.call(chat_id, PRIORITY_USER, context.bot.send_message, chat_id=chat_id, text=_ui("تعذّر توليد أسئلة كافية. حاول ملفًا آخر.", "Failed to generate enough questions. Try another file."))
+        await SESSIONS.pop(chat_id, None)
+        return
+
+    question_bank.remember_doc(sess["user_id"], dhash, qlang, sess["filename"], qids)
+    await begin_quiz(chat_id, context, qids, questions)
 
-    # استخراج النص باستخدام لغة المحتوى
-    with tempfile.NamedTemporaryFile(delete=False, suffix=sess["suffix"]) as f:
-        f.write(sess["file_bytes"])
-        tmp_path = f.name
+async def _generate_questions(chat_id: int, context: ContextTypes.DEFAULT_TYPE, sess: Dict):
+    """استخراج النص وتوليد الأسئلة وحفظها في البنك؛ None إن تعذر استخراج نص كافٍ"""
+    await send_progress(context, chat_id, _ui("جاري تحليل الملف وإعداده… ⏳", "Analyzing the file… ⏳"))
 
+    # النص المستخرج مسبقاً أثناء اختيار اللغة إن صلح، وإلا استخراج بلغة المحتوى المختارة
+    spec = speculative.take(sess.get("sid"))
     try:
-        text = await extract_text_any(tmp_path, sess["suffix"], sess["content_lang"])
-    except Exception:
-        text = ""
+        text = await spec.text_for(sess["content_lang"]) if spec else None
+        if text is None:
+            try:
+                text = await extract_text_any(sess["file_path"], sess["suffix"], sess["content_lang"])
+            except Exception:
+                text = ""
+            text = clean_text(text)
+        if not text or len(text) < 400:
+            return None
+
+        await send_progress(context, chat_id, _ui("جاري توليد أسئلة قوية بالذكاء الاصطناعي… ⏳", "Generating strong questions with AI… ⏳"))
+
+        # استخدام لغة الأسئلة المختارة (المقطع الأول قد يكون طُلب مسبقاً)
+        if spec:
+            spec.settle(text, sess["question_lang"])
+        questions = await build_quiz_from_text(text, lang=sess["question_lang"],
+                                               total=sess["quiz_size"], mcq_ratio=sess["mcq_ratio"])
     finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+        if spec:
+            spec.cancel()
+    print(f"🧩 LLM output: {salvage_report()}")
+    if not questions:
+        return [], []
+    return question_bank.store(sess["doc_hash"], sess["question_lang"], questions), questions
 
-    text = _clean_text(text)
-    if not text or len(text) < 400:
-        await context.bot.send_message(chat_id=chat_id, text=_ui("تعذر استخراج نص كافٍ حتى بعد OCR. جرّب ملفًا أوضح.", "Couldn't extract enough text (even with OCR). Try a clearer file."))
-        SESSIONS.pop(chat_id, None)
+async def begin_quiz(chat_id: int, context: ContextTypes.DEFAULT_TYPE, qids, questions):
+    sess = await SESSIONS.get(chat_id)
+    if not sess:
         return
+    sess.update({"questions": questions, "qids": qids, "index": 0, "score": 0,
+                 "answers": {}, "poll_qids": {}, "current_poll": None, "stage": "quiz",
+                 # معرفات المجموعات سالبة: كل مصوّت له نقاطه والتقدم بالمؤقت لا بأول صوت
+                 "group": chat_id < 0, "scores": {}, "names": {}, "voters": {},
+                 "board_msg": None})
+    # الملف لم يعد لازماً بعد توليد الأسئلة (يُحذف بانتهاء مهمة المعالجة)
+    sess.pop("file_path", None)
+    await SESSIONS.save(chat_id, sess)
+    await send_next_question(chat_id, context)
 
-    await context.bot.send_message(chat_id=chat_id, text=_ui("جاري توليد أسئلة قوية بالذكاء الاصطناعي… ⏳", "Generating strong questions with AI… ⏳"))
+async def end_session(chat_id: int, context: ContextTypes.DEFAULT_TYPE, sess: Optional[Dict] = None):
+    """إنهاء الجلسة مع مسارات استطلاعاتها ومؤقت السؤال التالي، وإلغاء معالجتها إن كانت جارية.
+    sess: جلسة أزالها المخزن مسبقاً (SESSIONS.expired)"""
+    ADMISSION.cancel(chat_id)
+    if sess is None:
+        sess = await SESSIONS.pop(chat_id, None)
+    if not sess:
+        return
+    if sess.get("stage") != "processing":
+        # أثناء المعالجة تحذفه مهمتها عند انتهائها أو إلغائها (ADMISSION.track)
+        release_upload(sess)
+    for poll_id in sess.get("answers", {}):
+        await POLL_ROUTES.pop(poll_id, None)
+    _board_texts.pop(chat_id, None)
+    if context.job_queue:
+        for job in context.job_queue.get_jobs_by_name(f"advance_{chat_id}"):
+            job.schedule_removal()
+
+async def expire_session(chat_id: int, context: ContextTypes.DEFAULT_TYPE, sess: Optional[Dict] = None):
+    """إنهاء جلسة خاملة أو مطرودة مع إشعار المستخدم"""
+    if sess is None:
+        sess = await SESSIONS.pop(chat_id, None)
+    if not sess:
+        return
+    quiz = sess.get("stage") == "quiz"
+    await end_session(chat_id, context, sess)
+    OUTBOUND.post(chat_id, PRIORITY_USER, context.bot.send_message, chat_id=chat_id, text=_ui(
+        "⌛ انتهت الجلسة لعدم النشاط." + (" يمكنك إعادة الاختبار بـ /retake" if quiz else " أرسل الملف من جديد."),
+        "⌛ Session expired due to inactivity." + (" Use /retake to start the quiz again." if quiz else " Please send the file again.")))
+
+async def sweep_sessions_job(context: ContextTypes.DEFAULT_TYPE):
+    """مهمة دورية: إنهاء الجلسات المنتهية مهلتها ثم الطرد حسب ميزانية الذاكرة"""
+    # مع المخزن المشترك: المنتهية في كل العمليات، كل واحدة تصل لعملية واحدة
+    expired = await SESSIONS.expired()
+    for chat_id, sess in expired:
+        await expire_session(chat_id, context, sess)
+    evicted = SESSIONS.over_budget()
+    for chat_id in evicted:
+        await expire_session(chat_id, context)
+    if expired or evicted:
+        print(f"⌛ Expired {len(expired) + len(evicted)} session(s); {len(SESSIONS)} active")
+    if STATE is not None:
+        await STATE.purge()
+    # ملفات محمّلة بقيت بعد توقف مفاجئ للعملية؛ ما زالت جلسة حية تشير إليه لا يُمس مهما طال
+    live = SESSIONS.local()
+    speculative.sweep(UPLOAD_MAX_AGE, keep=[s.get("sid") for s in live])
+    orphans = DOWNLOADS.sweep(UPLOAD_MAX_AGE, keep=[s.get("file_path") for s in live])
+    if orphans:
+        print(f"🧹 Removed {orphans} orphaned upload(s)")
+
+# ================= لوحة الصدارة (المجموعات) =================
+def _leaderboard_text(sess, final: bool = False) -> str:
+    top = heapq.nlargest(LEADERBOARD_SIZE, sess["scores"].items(), key=lambda kv: kv[1])
+    answered = min(sess["index"], len(sess["questions"]))
+    title = _ui("🏆 النتائج النهائية", "🏆 Final results") if final else \
+        _ui(f"🏆 لوحة الصدارة ({answered}/{len(sess['questions'])})", f"🏆 Leaderboard ({answered}/{len(sess['questions'])})")
+    lines = [title, ""]
+    for rank, (user_id, score) in enumerate(top, 1):
+        lines.append(f"{rank}. {sess['names'].get(user_id, user_id)} — {score}")
+    if not top:
+        lines.append(_ui("لا توجد إجابات بعد.", "No answers yet."))
+    lines.append("")
+    lines.append(_ui(f"👥 المشاركون: {len(sess['scores'])}", f"👥 Participants: {len(sess['scores'])}"))
+    return "\n".join(lines)
+
+_board_texts: Dict[int, str] = {}  # آخر نص أرسلته هذه العملية للوحة كل مجموعة (Telegram يرفض تعديلاً بلا تغيير)
+
+def update_leaderboard(chat_id: int, context: ContextTypes.DEFAULT_TYPE, sess: Dict,
+                       final: bool = False, new_board: bool = False):
+    """sess: الجلسة كما حُفظت للتو. لا ننتظر الإرسال ولا نمسك قفل الجلسة: مهلة المجموعة
+    (3 ثوانٍ) كانت توقف طابور التحديثات وكل إجابات الاستطلاعات خلفه.
+    new_board: هذا التحديث حجز board_msg فيرسل الرسالة الأولى (_board_sent يسجل معرفها)"""
+    text = _leaderboard_text(sess, final)
+    if final:
+        _board_texts.pop(chat_id, None)
+        OUTBOUND.post(chat_id, PRIORITY_USER, context.bot.send_message, chat_id=chat_id, text=text)
+        return
+    if text == _board_texts.get(chat_id):
+        return
+    if new_board:
+        _board_texts[chat_id] = text
+        fut = OUTBOUND.submit(chat_id, PRIORITY_USER, context.bot.send_message, chat_id=chat_id, text=text)
+        context.application.create_task(_board_sent(chat_id, sess.get("sid"), fut, text, context))
+    elif sess["board_msg"]:
+        _board_texts[chat_id] = text
+        # التعديلات المتتالية تُدمج: تعديل واحد لكل نافذة إرسال مهما كثر المصوتون
+        OUTBOUND.post(chat_id, PRIORITY_USER, context.bot.edit_message_text,
+                      chat_id=chat_id, message_id=sess["board_msg"], text=text,
+                      coalesce_key=("leaderboard", chat_id))
+    # وإلا فالرسالة الأولى ما زالت تُرسل: _board_sent يعدّلها بآخر النقاط
+
+async def _board_sent(chat_id: int, sid, fut: asyncio.Future, text: str, context: ContextTypes.DEFAULT_TYPE):
+    """بعد إرسال لوحة الصدارة الأولى: حفظ معرفها في الجلسة (مرة واحدة لكل اختبار)"""
+    try:
+        msg = await fut
+    except Exception as e:
+        print(f"فشل إرسال لوحة الصدارة إلى {chat_id}: {e}")
+        msg = None
+    async with SESSIONS.lock(chat_id):
+        sess = await SESSIONS.get(chat_id)
+        if not sess or sess.get("sid") != sid:
+            return
+        # عند الفشل يعود الحجز فيرسل الصوت التالي اللوحة من جديد
+        sess["board_msg"] = msg.message_id if msg else None
+        await SESSIONS.save(chat_id, sess)
+    if msg is None:
+        _board_texts.pop(chat_id, None)
+        return
+    if _leaderboard_text(sess) != text:
+        update_leaderboard(chat_id, context, sess)  # أصوات وصلت أثناء الإرسال
 
-    # استخدام لغة الأسئلة المختارة
-    questions = await build_quiz_from_text(text, lang=sess["question_lang"])
-    if not questions:
-        await context.bot.send_message(chat_id=chat_id, text=_ui("تعذّر توليد أسئلة كافية. حاول ملفًا آخر.", "Failed to generate enough questions. Try another file."))
-        SESSIONS.pop(chat_id, None)
+async def advance_question_job(context: ContextTypes.DEFAULT_TYPE):
+    await send_next_question(context.job.chat_id, context)
+
+# ================= إعادة الاختبار من بنك الأسئلة =================
+async def _start_bank_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str):
+    user_id = update.effective_user.id
+    if not await is_allowed(user_id):
+        await update.message.reply_text(_ui("لا يمكنك استخدام البوت قبل موافقة المدير.", "You need admin approval to use this bot."))
         return
 
-    sess.update({"questions": questions, "index":0, "score": 0, "answers": {}, "stage": "quiz"})
-    await send_next_question(chat_id, context)
+    flush_pending()  # آخر الإجابات الخاطئة ما زالت في write-behind
+    bank = question_bank.quiz_for_user(user_id, mode)
+    if not bank:
+        await update.message.reply_text(_ui("لا يوجد اختبار سابق محفوظ. أرسل ملفًا أولًا.", "No saved quiz yet. Send a file first."))
+        return
+    if not bank["questions"]:
+        await update.message.reply_text(_ui("لا توجد أخطاء سابقة في آخر اختبار 🎉", "No previous mistakes in your last quiz 🎉"))
+        return
+
+    chat_id = update.effective_chat.id
+    if await SESSIONS.exists(chat_id):
+        # مثل ملف جديد أو /cancel: لا يبقى مؤقت السؤال التالي أو مسارات الاستطلاعات أو معالجة جارية
+        task = ADMISSION.cancel(chat_id)
+        await end_session(chat_id, context)
+        await ADMISSION.drain(task)
+    await SESSIONS.put(chat_id, {
+        "user_id": user_id,
+        "filename": bank["filename"],
+        "doc_hash": bank["doc_hash"],
+        "question_lang": bank["lang"],
+    })
+    await begin_quiz(chat_id, context, bank["qids"], bank["questions"])
+
+async def cmd_retake(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _start_bank_quiz(update, context, "retake")
+
+async def cmd_shuffle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _start_bank_quiz(update, context, "shuffle")
+
+async def cmd_mistakes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _start_bank_quiz(update, context, "wrong")
 # ================= إرسال الأسئلة التالية =================
 async def send_next_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    sess = SESSIONS.get(chat_id)
+    sess = await SESSIONS.get(chat_id)
     if not sess or sess.get("stage") != "quiz":
         return
 
     if sess["index"] >= len(sess["questions"]):
-        await context.bot.send_message(chat_id=chat_id, text=_ui(
-            f"انتهى الاختبار! نتيجتك: {sess['score']}/{len(sess['questions'])} ✅",
-            f"Done! Your score: {sess['score']}/{len(sess['questions'])} ✅"))
+        if sess["group"]:
+            update_leaderboard(chat_id, context, sess, final=True)
+        else:
+            OUTBOUND.post(chat_id, PRIORITY_USER, context.bot.send_message, chat_id=chat_id, text=_ui(
+                f"انتهى الاختبار! نتيجتك: {sess['score']}/{len(sess['questions'])} ✅",
+                f"Done! Your score: {sess['score']}/{len(sess['questions'])} ✅"))
 
         # تسجيل إكمال الاختبار
         user_id = sess.get("user_id", chat_id)
         log_event(user_id, "quiz_completed", {
-            "score": sess['score'],
-            "total": len(sess['questions'])
+            "score": max(sess["scores"].values(), default=0) if sess["group"] else sess['score'],
+            "total": len(sess['questions']),
+            "participants": len(sess["scores"]) if sess["group"] else 1
         })
+        # /mistakes أو /retake قد يصل عملية أخرى مباشرة بعد النتيجة
+        flush_pending()
 
-        SESSIONS.pop(chat_id, None)
+        await end_session(chat_id, context)
         return
 
     q = sess["questions"][sess["index"]]
-    msg = await context.bot.send_poll(
+    fut = OUTBOUND.submit(
+        chat_id, PRIORITY_POLL, context.bot.send_poll,
         chat_id=chat_id,
         question=q["question"][:255],
         options=q["options"][:10],
@@ -768,83 +1445,185 @@ async def send_next_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
         correct_option_id=int(q["correct"]),
         is_anonymous=False,
         explanation=_ui("إجابة صحيحة", "Correct"),
+        open_period=GROUP_QUESTION_SECONDS if sess["group"] else None,
     )
-    sess["answers"][msg.poll.id] = int(q["correct"])
-    sess["index"] += 1
+    # لا ننتظر الإرسال هنا: مهلة المحادثة (ثانية) كانت توقف طابور التحديثات كله
+    context.application.create_task(_poll_sent(chat_id, sess.get("sid"), fut, context))
+
+async def _poll_sent(chat_id: int, sid, fut: asyncio.Future, context: ContextTypes.DEFAULT_TYPE):
+    """بعد إرسال الاستطلاع فعلاً: تسجيل مساره في الجلسة ثم مؤقت المجموعة"""
+    try:
+        msg = await fut
+    except Exception as e:
+        print(f"فشل إرسال السؤال إلى {chat_id}: {e}")
+        return
+    async with SESSIONS.lock(chat_id):
+        # قد تُلغى الجلسة أثناء انتظار الإرسال، ومع المخزن المشترك نعدّل أحدث نسخة منها
+        sess = await SESSIONS.get(chat_id)
+        if not sess or sess.get("sid") != sid:
+            return
+        sess["answers"][msg.poll.id] = int(sess["questions"][sess["index"]]["correct"])
+        sess["poll_qids"][msg.poll.id] = sess["qids"][sess["index"]]
+        sess["current_poll"] = msg.poll.id
+        sess["index"] += 1
+        await SESSIONS.save(chat_id, sess)
+        await POLL_ROUTES.set(msg.poll.id, chat_id)
+
+    if sess["group"]:
+        context.job_queue.run_once(advance_question_job, GROUP_QUESTION_SECONDS,
+                                   chat_id=chat_id, name=f"advance_{chat_id}")
 
 # ================= استقبال إجابات الاختبار =================
 async def receive_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     answer = update.poll_answer
-    for chat_id, sess in list(SESSIONS.items()):
-        if answer.poll_id in sess.get("answers", {}):
-            correct = sess["answers"][answer.poll_id]
-            if answer.option_ids and answer.option_ids[0] == correct:
-                sess["score"] += 1
-
-            # تسجيل نتيجة الاختبار
-            user_id = answer.user.id
-            data = load_data()
-            if str(user_id) in data["users"]:
-                user_data = data["users"][str(user_id)]
-                user_data["quizzes_taken"] += 1
-                if answer.option_ids and answer.option_ids[0] == correct:
-                    user_data["total_score"] += 1
-                user_data["last_activity"] = datetime.now().isoformat()
-                save_data(data)
+    chat_id = await POLL_ROUTES.get(answer.poll_id)
+    if chat_id is None:
+        return
 
-            log_event(user_id, "quiz_answer", {
-                "question_index": sess["index"],
-                "is_correct": answer.option_ids and answer.option_ids[0] == correct
-            })
+    user_id = answer.user.id
+    async with SESSIONS.lock(chat_id):
+        sess = await SESSIONS.get(chat_id)
+        if not sess or answer.poll_id not in sess.get("answers", {}):
+            return
+
+        correct = sess["answers"][answer.poll_id]
+        is_correct = bool(answer.option_ids) and answer.option_ids[0] == correct
+        if sess["group"]:
+            # جدول نقاط لكل مصوّت؛ تحديثه O(1) مهما كثر المشاركون
+            voters = sess["voters"].setdefault(answer.poll_id, set())
+            if user_id in voters:
+                return
+            voters.add(user_id)
+            sess["names"][user_id] = answer.user.full_name
+            sess["scores"][user_id] = sess["scores"].get(user_id, 0) + int(is_correct)
+            # أول صوت يحجز رسالة اللوحة (0 = قيد الإرسال) مع نفس الحفظ، فلا تُرسل مرتين من عمليتين
+            new_board = sess["board_msg"] is None
+            if new_board:
+                sess["board_msg"] = 0
+        elif is_correct:
+            sess["score"] += 1
+        await SESSIONS.save(chat_id, sess)
+
+    # تسجيل نتيجة الاختبار (في الذاكرة؛ تُكتب دفعات عبر write-behind)
+    WRITE_BEHIND.record_bank_answer(user_id, sess["doc_hash"], sess["question_lang"],
+                                    sess["poll_qids"][answer.poll_id], is_correct)
+    WRITE_BEHIND.record_answer(user_id, is_correct, datetime.now().isoformat())
+
+    log_event(user_id, "quiz_answer", {
+        "question_index": sess["index"],
+        "is_correct": is_correct
+    })
 
-            await send_next_question(chat_id, context)
-            break
+    if sess["group"]:
+        update_leaderboard(chat_id, context, sess, new_board=new_board)
+    elif answer.poll_id == sess["current_poll"]:
+        # المحادثة الخاصة: السؤال التالي بعد إجابة السؤال الحالي فقط
+        await send_next_question(chat_id, context)
 
 async def set_bot_commands(application):
     """إعداد قائمة الأوامر في واجهة المستخدم"""
     commands = [
         BotCommand("start", _ui("بدء استخدام البوت", "Start the bot")),
         BotCommand("cancel", _ui("إلغاء العملية الحالية", "Cancel current process")),
+        BotCommand("quiz", _ui("عدد الأسئلة ونوعها: /quiz 20 mcq", "Question count and type: /quiz 20 mcq")),
+        BotCommand("retake", _ui("إعادة آخر اختبار", "Retake your last quiz")),
+        BotCommand("shuffle", _ui("إعادة آخر اختبار بترتيب عشوائي", "Retake your last quiz shuffled")),
+        BotCommand("mistakes", _ui("الأسئلة التي أخطأت فيها فقط", "Only the questions you got wrong")),
         BotCommand("control", _ui("لوحة تحكم المدير", "Admin control panel")),
     ]
     await application.bot.set_my_commands(commands)
-# ================= تشغيل البوت (النسخة المبسطة) =================
-from flask import Flask, request
-import os
-
-# تطبيق Flask الأساسي
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return '🤖 Bashar QuizBot Vip is Running!'
-
-@app.route('/health')
-def health():
-    return '✅ Healthy'
-
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """استقبال تحديثات Telegram"""
-    if request.method == "POST":
-        update = Update.de_json(request.get_json(), application.bot)
-        application.process_update(update)
-    return 'OK'
 
-def main():
-    global application
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        raise SystemExit("❌ Set BOT_TOKEN env var")
+async def on_shutdown(application):
+    """تفريغ الرسائل المعلّقة قبل الإيقاف"""
+    BROADCAST.suspend()  # رسائل البث المتبقية تُستأنف بعد التشغيل بدل تأخير الإيقاف
+    await OUTBOUND.aclose()
+    await ROUTER.aclose()
+    await DOWNLOADS.aclose()
+    ocr.shutdown()
+    flush_pending()
+    if STATE is not None:
+        await release_broadcast()
+        await STATE.leave(WORKER_ID)  # بقية العمليات تأخذ حصتها من الحد العام فوراً
+        STATE.close()
+
+async def heartbeat_job(context: ContextTypes.DEFAULT_TYPE):
+    """مهمة دورية (مع المخزن المشترك): نبض العملية وتقسيم حد الإرسال العام على العمليات الحية"""
+    workers = await STATE.heartbeat(WORKER_ID)
+    if workers != OUTBOUND.workers:
+        print(f"👥 {workers} worker(s) alive; outbound limit {OUTBOUND.global_rate / workers:.1f} msg/s here")
+        OUTBOUND.set_workers(workers)
+
+async def post_init(application):
+    """تحميل البيانات بعد بدء الحلقة وليس عند الاستيراد"""
+    global allowed_users, banned_users, pending_users
+    allowed_users, banned_users, pending_users = refresh_user_lists()
+    if STATE is not None:
+        # ملف المستخدمين يُعدَّل من كل العمليات: يجب أن يكون نفس الملف لا نسخة على كل جهاز
+        await state_store.ensure_shared_dir(STATE, "data", os.path.dirname(DATA_FILE))
+        # الجلسة تحمل مسار الملف المرفوع، وقد تكمل معالجتها عملية على جهاز آخر
+        await state_store.ensure_shared_dir(STATE, "spool", UPLOAD_SPOOL_DIR)
+        # تقدم البث تكمله أي عملية تأخذ عقده
+        await state_store.ensure_shared_dir(STATE, "broadcast", os.path.dirname(BROADCAST_FILE))
+        await heartbeat_job(application)
+        # أول تشغيل على المخزن المشترك: حالات bot_users.json تُنقل إليه دون الكتابة فوق الموجود
+        await STATE.seed_user_statuses({int(uid): u["status"] for uid, u in load_data()["users"].items()})
+    if BROADCAST.load(load_data()["users"]):
+        # مع عدة عمليات تستأنف من تأخذ العقد فقط؛ البقية تتابع broadcast_job لتأخذه إن توقفت
+        if await claim_broadcast():
+            print(f"📣 Resuming broadcast {BROADCAST.state['id']} after user {BROADCAST.state['cursor']}")
+        schedule_broadcast(application.job_queue)
+    await set_bot_commands(application)
 
-    # بناء البوت
-    application = ApplicationBuilder().token(token).build()
-    application.post_init = set_bot_commands
+# ================= تشغيل البوت (النسخة المبسطة) =================
+def create_web_app():
+    """تطبيق Flask الأساسي؛ يُستورد Flask فقط عند التشغيل على Render"""
+    from flask import Flask, request
+
+    app = Flask(__name__)
+
+    @app.route('/')
+    def home():
+        return '🤖 Bashar QuizBot Vip is Running!'
+
+    @app.route('/health')
+    def health():
+        return '✅ Healthy'
+
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        """استقبال تحديثات Telegram"""
+        if request.method == "POST":
+            update = Update.de_json(request.get_json(), application.bot)
+            application.process_update(update)
+        return 'OK'
+
+    return app
+
+def build_application(token: str, request=None, concurrent_updates=False):
+    """بناء التطبيق مع كل المعالجات والمهام الدورية (request بديل لطلبات Bot API في أداة الحمل)"""
+    builder = ApplicationBuilder().token(token).concurrent_updates(concurrent_updates)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    application.post_init = post_init
+    application.post_shutdown = on_shutdown
+    application.job_queue.run_repeating(compact_events_job, interval=3600, first=60)
+    application.job_queue.run_repeating(flush_pending_job, interval=FLUSH_SECONDS, first=FLUSH_SECONDS)
+    application.job_queue.run_repeating(sweep_sessions_job, interval=SWEEP_SECONDS, first=SWEEP_SECONDS)
+    if STATE is not None:
+        application.job_queue.run_repeating(heartbeat_job, interval=state_store.HEARTBEAT_SECONDS,
+                                            first=state_store.HEARTBEAT_SECONDS)
     
     # إعداد handlers (نفس الكود السابق)
     application.add_handler(CommandHandler("start", cmd_start))
     application.add_handler(CommandHandler("cancel", cmd_cancel))
+    application.add_handler(CommandHandler("quiz", cmd_quiz))
+    application.add_handler(CommandHandler("retake", cmd_retake))
+    application.add_handler(CommandHandler("shuffle", cmd_shuffle))
+    application.add_handler(CommandHandler("mistakes", cmd_mistakes))
     application.add_handler(CommandHandler("control", control_panel))
+    application.add_handler(CommandHandler("profile", cmd_profile))
+    application.add_handler(CommandHandler("broadcast", cmd_broadcast))
     application.add_handler(CallbackQueryHandler(handle_export, pattern=r"^export_(json|csv)$"))
     application.add_handler(MessageHandler(filters.Document.ALL | filters.PHOTO, handle_document))
     application.add_handler(CallbackQueryHandler(choose_language, pattern=r"^lang_(ar|en)$"))
@@ -852,6 +1631,16 @@ def main():
     application.add_handler(CallbackQueryHandler(handle_approval, pattern=r"^(approve|reject)_\d+$"))
     application.add_handler(CallbackQueryHandler(handle_control_buttons))
     application.add_handler(PollAnswerHandler(receive_poll_answer))
+    return application
+
+def main():
+    global application
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise SystemExit("❌ Set BOT_TOKEN env var")
+
+    # بناء البوت
+    application = build_application(token, concurrent_updates=CONCURRENT_UPDATES or False)
 
     # التشغيل على Render
     if os.environ.get("RENDER"):
@@ -863,12 +1652,11 @@ def main():
             await application.bot.set_webhook(webhook_url)
             print(f"✅ Webhook ready: {webhook_url}")
         
-        import asyncio
         asyncio.run(setup_wh())
         
         # تشغيل Flask على المنفذ المطلوب
         port = int(os.environ.get("PORT", 8443))
-        app.run(host='0.0.0.0', port=port, debug=False)
+        create_web_app().run(host='0.0.0.0', port=port, debug=False)
     else:
         # التشغيل المحلي
         print("💻 Running locally...")
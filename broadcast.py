@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+# ================= بث رسالة من المدير لكل المستخدمين =================
+# المستلمون يُقرؤون من bot_users.json حسب الحالة بترتيب المعرّف، ويُرسلون عبر OUTBOUND
+# بأقل أولوية (أسئلة الاختبار والردود أولاً) ضمن حدود Telegram العامة. في الطابور
+# BROADCAST_WINDOW رسالة على الأكثر، فلا تمتلئ الذاكرة ولا يتأخر غير البث.
+# التقدم يُحفظ في BROADCAST_FILE كل دورة: بعد إعادة التشغيل يُستأنف من آخر مستلم،
+# ومن كانت رسالته في الطابور لحظة التوقف يُعاد الإرسال إليه (مرة على الأكثر).
+# من حظر البوت (Forbidden) يُعلَّم "blocked" ولا يُرسل إليه في البث القادم.
+# مع عدة عمليات (STATE_BACKEND) ترسل فقط من تحمل عقد البث في المخزن؛ إن توقفت عن تجديده
+# BROADCAST_LEASE_MS أخذته أخرى وأكملت من BROADCAST_FILE.
+
+BROADCAST_FILE = os.getenv("BROADCAST_FILE", "broadcast.json")
+BROADCAST_WINDOW = int(os.getenv("BROADCAST_WINDOW", 50))
+BROADCAST_STATUSES = ("allowed", "pending", "all")
+PROGRESS_SECONDS = 5.0
+BROADCAST_LEASE_MS = int(os.getenv("BROADCAST_LEASE_MS", 10000))
+_BLOCKED_HINTS = ("blocked", "deactivated", "kicked", "chat not found", "user not found")
+
+
+def recipients(users: Dict[str, Dict], status: str, after: int = 0) -> List[int]:
+    """معرفات المستخدمين بهذه الحالة (all = الكل عدا المحظورين) بعد المؤشر، تصاعدياً"""
+    out = []
+    for uid, u in users.items():
+        if u.get("blocked") or int(uid) <= after:
+            continue
+        wanted = u.get("status") != "banned" if status == "all" else u.get("status") == status
+        if wanted:
+            out.append(int(uid))
+    out.sort()
+    return out
+
+
+def is_blocked_error(exc: BaseException) -> bool:
+    """المستخدم حظر البوت أو حذف حسابه: لا فائدة من إعادة المحاولة"""
+    from telegram.error import Forbidden, BadRequest
+    if isinstance(exc, Forbidden):
+        return True
+    return isinstance(exc, BadRequest) and any(h in str(exc).lower() for h in _BLOCKED_HINTS)
+
+
+class Broadcast:
+    def __init__(self, path: str = BROADCAST_FILE, window: int = BROADCAST_WINDOW):
+        self.path = path
+        self.window = window
+        self.state: Optional[Dict] = None
+        self._queue: Deque[int] = deque()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._blocked: List[int] = []
+        self._reported = 0.0
+        self.last_report: Optional[str] = None  # آخر نص في رسالة التقدم (Telegram يرفض تعديلاً بلا تغيير)
+
+    @property
+    def active(self) -> bool:
+        return self.state is not None and not self.state.get("finished")
+
+    @property
+    def done(self) -> bool:
+        return self.active and not self._queue and not self._inflight
+
+    # ---------- البدء والاستئناف ----------
+    def start(self, users: Dict[str, Dict], status: str, text: str = None, copy: List[int] = None) -> Dict:
+        """text لرسالة نصية، أو copy = [from_chat_id, message_id] لنسخ رسالة (وسائط، تنسيق)"""
+        queue = recipients(users, status)
+        self.state = {
+            "id": datetime.now().strftime("%Y%m%d%H%M%S"), "status": status, "text": text, "copy": copy,
+            "total": len(queue), "cursor": 0, "inflight": [], "sent": 0, "failed": 0, "blocked": 0,
+            "started": time.time(), "elapsed": 0.0, "paused": False, "finished": None, "progress_msg": None,
+        }
+        self._queue, self._inflight, self._blocked = deque(queue), {}, []
+        self.save()
+        return self.state
+
+    def load(self, users: Dict[str, Dict]) -> bool:
+        """استئناف بث لم يكتمل قبل إعادة التشغيل؛ True إن وُجد"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if state.get("finished"):
+            self.state = state
+            return False
+        # الرسائل التي كانت في الطابور لحظة التوقف لا نعرف إن أُرسلت: تُعاد أولاً
+        retry = sorted(set(state.get("inflight", [])))
+        self._queue = deque(retry + recipients(users, state["status"], after=state["cursor"]))
+        self._inflight, self._blocked = {}, []
+        state["inflight"] = []
+        state["started"] = time.time() - state.get("elapsed", 0.0)
+        self.state = state
+        return True
+
+    def save(self) -> None:
+        if self.state is None:
+            return
+        self.state["inflight"] = sorted(self._inflight)
+        self.state["elapsed"] = time.time() - self.state["started"]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    # ---------- الإرسال ----------
+    def refill(self, submit: Callable[[int], asyncio.Future]) -> int:
+        """يملأ النافذة من الطابور؛ submit(uid) يُرجع Future من OUTBOUND"""
+        if not self.active or self.state["paused"]:
+            return 0
+        added = 0
+        while self._queue and len(self._inflight) < self.window:
+            uid = self._queue.popleft()
+            self.state["cursor"] = max(self.state["cursor"], uid)
+            fut = self._inflight[uid] = submit(uid)
+            fut.add_done_callback(lambda f, uid=uid: self._finished(uid, f))
+            added += 1
+        return added
+
+    def _finished(self, uid: int, fut: asyncio.Future) -> None:
+        self._inflight.pop(uid, None)
+        if self.state is None or fut.cancelled():
+            return  # أُلغي البث قبل إرسالها
+        if fut.exception() is not None:
+            if is_blocked_error(fut.exception()):
+                self.state["blocked"] += 1
+                self._blocked.append(uid)
+            else:
+                self.state["failed"] += 1
+        else:
+            self.state["sent"] += 1
+
+    def take_blocked(self) -> List[int]:
+        blocked, self._blocked = self._blocked, []
+        return blocked
+
+    def finish(self, reason: str = "done") -> None:
+        """done أو canceled؛ رسائل الإلغاء التي لم تُرسل بعد تُسقط من طابور OUTBOUND"""
+        self.state["finished"] = reason
+        self._queue.clear()
+        for fut in list(self._inflight.values()):
+            fut.cancel()
+        self.save()
+
+    def suspend(self, save: bool = True) -> None:
+        """عند الإيقاف: الحفظ مع قائمة الطابور ثم إسقاطها من OUTBOUND (تُعاد عند الاستئناف).
+        save=False إن أخذت عملية أخرى البث: ملفها أحدث مما في الذاكرة هنا"""
+        if not self.active:
+            return
+        if save:
+            self.save()
+        inflight, self._inflight = self._inflight, {}
+        for fut in inflight.values():
+            fut.cancel()
+
+    # ---------- التقدم ----------
+    def due_report(self) -> bool:
+        now = time.monotonic()
+        if now - self._reported >= PROGRESS_SECONDS:
+            self._reported = now
+            return True
+        return False
+
+    def progress(self) -> Tuple[str, str]:
+        """(نص عربي، نص إنجليزي) لرسالة التقدم"""
+        s = self.state
+        handled = s["sent"] + s["failed"] + s["blocked"]
+        elapsed = max(1e-6, time.time() - s["started"])
+        rate = s["sent"] / elapsed
+        left = len(self._queue) + len(self._inflight)
+        eta = f"{int(left / rate)}s" if rate > 0 and left else "-"
+        state = s["finished"] or ("paused" if s["paused"] else "running")
+        return (f"📣 البث ({s['status']}): {state}\n"
+                f"✅ أُرسل: {s['sent']}  🚫 حظروا البوت: {s['blocked']}  ⚠️ فشل: {s['failed']}\n"
+                f"📬 {handled}/{s['total']}  ⏱ {rate:.1f} رسالة/ث  المتبقي ≈ {eta}",
+                f"📣 Broadcast ({s['status']}): {state}\n"
+                f"✅ Sent: {s['sent']}  🚫 Blocked: {s['blocked']}  ⚠️ Failed: {s['failed']}\n"
+                f"📬 {handled}/{s['total']}  ⏱ {rate:.1f} msg/s  ETA ≈ {eta}")
+
+
+BROADCAST = Broadcast()
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+# ================= ذاكرة أسئلة المقاطع =================
+# الأسئلة المولدة تُحفظ لكل مقطع نص مفهرسة بـ (بصمة المقطع بعد التوحيد، لغة الأسئلة، نماذج المزوّدين)
+# فالملف المجمّع والمحاضرات المنفصلة ونسخة المحاضرة بشرائح جديدة تشترك في المقاطع
+# المتطابقة ولا يُطلب من النموذج إلا الجديد. الحجم محدود: الأقدم استخداماً يُحذف أولاً.
+
+CHUNK_CACHE_DB = os.getenv("CHUNK_CACHE_DB", "chunk_cache.db")
+CHUNK_CACHE_MB = float(os.getenv("CHUNK_CACHE_MB", 64))  # 0 = معطلة
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    chash TEXT NOT NULL,
+    lang  TEXT NOT NULL,
+    model TEXT NOT NULL,
+    body  BLOB NOT NULL,
+    size  INTEGER NOT NULL,
+    used  REAL NOT NULL,
+    PRIMARY KEY (chash, lang, model)
+);
+CREATE INDEX IF NOT EXISTS chunks_used ON chunks (used);
+"""
+
+
+def chunk_hash(chunk: str) -> str:
+    """بصمة لا تتأثر بحالة الأحرف أو المسافات وفواصل الأسطر"""
+    return hashlib.sha1(" ".join(chunk.casefold().split()).encode("utf-8")).hexdigest()
+
+
+class ChunkCache:
+    def __init__(self, path: str = CHUNK_CACHE_DB, max_mb: float = CHUNK_CACHE_MB):
+        self.path = path
+        self.budget = int(max_mb * 1024 * 1024)
+        self.stats = Counter()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+        return self._conn
+
+    def get(self, chunk: str, lang: str, model: str) -> Optional[List[Dict]]:
+        if not self.enabled:
+            return None
+        key = (chunk_hash(chunk), lang, model)
+        db = self._db()
+        row = db.execute("SELECT body FROM chunks WHERE chash = ? AND lang = ? AND model = ?", key).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE chunks SET used = ? WHERE chash = ? AND lang = ? AND model = ?", (time.time(), *key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, chunk: str, lang: str, model: str, items: List[Dict]) -> None:
+        """يستبدل أسئلة المقطع (القديمة + الجديدة معاً)"""
+        if not self.enabled or not items:
+            return
+        rows = [{k: v for k, v in it.items() if k != "chunk"} for it in items]
+        body = zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        key = (chunk_hash(chunk), lang, model)
+        db = self._db()
+        old = db.execute("SELECT size FROM chunks WHERE chash = ? AND lang = ? AND model = ?", key).fetchone()
+        db.execute("INSERT OR REPLACE INTO chunks (chash, lang, model, body, size, used) VALUES (?, ?, ?, ?, ?, ?)",
+                   (*key, body, len(body), time.time()))
+        self._bytes += len(body) - (old[0] if old else 0)
+        if self._bytes > self.budget:
+            self._evict()
+
+    def _evict(self) -> None:
+        """حذف الأقدم استخداماً حتى 90% من الحجم (عمليات أخرى قد تكتب في نفس الملف: يُعاد الحساب)"""
+        db = self._db()
+        self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+        excess = self._bytes - int(0.9 * self.budget)
+        if excess <= 0:
+            return
+        victims, freed = [], 0
+        for rowid, size in db.execute("SELECT rowid, size FROM chunks ORDER BY used"):
+            if freed >= excess:
+                break
+            victims.append((rowid,))
+            freed += size
+        with db:
+            db.execute("BEGIN")
+            db.executemany("DELETE FROM chunks WHERE rowid = ?", victims)
+        self._bytes -= freed
+        self.stats["evicted"] += len(victims)
+
+    def record(self, chunks: int, reused: int, chars: int, reused_chars: int) -> str:
+        """يسجل نتيجة ملف واحد ويُرجع سطر تقريره"""
+        self.stats["docs"] += 1
+        self.stats["chunks"] += chunks
+        self.stats["reused"] += reused
+        self.stats["chars"] += chars
+        self.stats["reused_chars"] += reused_chars
+        return (f"{reused}/{chunks} chunks reused ({100 * reused_chars / max(1, chars):.0f}% of text); "
+                f"overall {100 * self.stats['reused_chars'] / max(1, self.stats['chars']):.0f}%")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+CHUNK_CACHE = ChunkCache()
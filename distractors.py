@@ -0,0 +1,136 @@
+import re
+import heapq
+import random
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# ================= فهرس المشتتات لأسئلة MCQ القاعدية =================
+# يُبنى مرة واحدة لكل ملف من عبارات الإجابات، ويجمعها حسب:
+#   - الكتابة (عربية/لاتينية): مشتت بلغة أخرى يكشف الإجابة فوراً
+#   - الطول بالكلمات (شرائح): الإجابة الأطول بكثير تبدو الصحيحة
+#   - الكلمات المشتركة (فهرس مقلوب): نفس الموضوع = مشتت معقول
+# كل اختيار يلمس قوائم محدودة الطول (POSTING_CAP) وعينات عشوائية من الشريحة،
+# فلا يمر على كل العبارات كما في [p for p in pool if p != y].
+
+POSTING_CAP = 32      # أقصى عبارات نفحصها لكل كلمة من كلمات الإجابة
+COMMON_DF = 0.2       # كلمة في أكثر من 20% من العبارات لا تدل على الموضوع
+SAMPLE_TRIES = 24     # محاولات أخذ عينة من الشريحة قبل الانتقال للمجاورة
+
+_WORD = re.compile(r"[A-Za-z\u0600-\u06FF0-9]+")
+_ARABIC = re.compile(r"[\u0600-\u06FF]")
+_LATIN = re.compile(r"[A-Za-z]")
+STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "are", "was", "its", "into", "which", "used",
+    "في", "من", "على", "إلى", "عن", "التي", "الذي", "هذا", "هذه", "ذلك", "مع", "أو", "كما", "بين",
+}
+
+
+def script(text: str) -> str:
+    ar, la = len(_ARABIC.findall(text)), len(_LATIN.findall(text))
+    return "ar" if ar >= la else "latin"
+
+
+def length_bucket(n_words: int) -> int:
+    return 0 if n_words <= 1 else 1 if n_words <= 2 else 2 if n_words <= 4 else 3 if n_words <= 7 else 4
+
+
+def _norm(text: str) -> str:
+    return " ".join(w.lower() for w in _WORD.findall(text))
+
+
+def _tokens(norm: str) -> List[str]:
+    return [w for w in norm.split() if len(w) > 2 and w not in STOPWORDS]
+
+
+class DistractorIndex:
+    def __init__(self, phrases: Sequence[str], rng: Optional[random.Random] = None):
+        self.rng = rng or random
+        self.phrases: List[str] = []
+        self.norms: List[str] = []
+        self.keys: List[Tuple[str, int]] = []
+        self.buckets: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        postings: Dict[str, List[int]] = defaultdict(list)
+        seen = set()
+        for p in phrases:
+            norm = _norm(p)
+            if not norm or norm in seen:
+                continue
+            seen.add(norm)
+            i = len(self.phrases)
+            key = (script(p), length_bucket(len(norm.split())))
+            self.phrases.append(p)
+            self.norms.append(norm)
+            self.keys.append(key)
+            self.buckets[key].append(i)
+            for t in set(_tokens(norm)):
+                postings[t].append(i)
+        # الكلمات الشائعة جداً تُحذف، والباقي يُقص إلى POSTING_CAP عنصر عشوائي
+        limit = max(8, int(COMMON_DF * len(self.phrases)))
+        self.postings: Dict[str, List[int]] = {}
+        for t, ids in postings.items():
+            if len(ids) > limit:
+                continue
+            if len(ids) > POSTING_CAP:
+                ids = self.rng.sample(ids, POSTING_CAP)
+            self.postings[t] = ids
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def _usable(self, i: int, answer_norm: str, taken: set) -> bool:
+        norm = self.norms[i]
+        # عبارة تحتوي الإجابة (أو العكس) قد تكون صحيحة هي الأخرى
+        return i not in taken and norm != answer_norm and norm not in answer_norm and answer_norm not in norm
+
+    def pick(self, answer: str, k: int = 3) -> List[str]:
+        """k مشتتات من نفس الكتابة وبطول قريب، الأقرب موضوعاً أولاً"""
+        answer_norm = _norm(answer)
+        sc, bucket = script(answer), length_bucket(len(answer_norm.split()))
+        taken: set = set()
+
+        # 1) كلمات مشتركة مع الإجابة (نفس الكتابة)، الأكثر اشتراكاً ثم الأقرب طولاً
+        overlap: Dict[int, int] = defaultdict(int)
+        for t in set(_tokens(answer_norm)):
+            for i in self.postings.get(t, ()):
+                overlap[i] += 1
+        near = [i for i in overlap if self.keys[i][0] == sc and abs(self.keys[i][1] - bucket) <= 1]
+        self.rng.shuffle(near)  # التعادل يُكسر عشوائياً (nsmallest مستقر)
+        out = []
+        for i in heapq.nsmallest(4 * k, near, key=lambda i: (-overlap[i], abs(self.keys[i][1] - bucket))):
+            if len(out) >= k:
+                break
+            if self._usable(i, answer_norm, taken):
+                taken.add(i)
+                out.append(self.phrases[i])
+
+        # 2) عينات من نفس الشريحة ثم الشرائح المجاورة (نفس الكتابة دائماً)
+        for b in (bucket, bucket - 1, bucket + 1, bucket - 2, bucket + 2):
+            ids = self.buckets.get((sc, b))
+            if not ids:
+                continue
+            for _ in range(SAMPLE_TRIES):
+                if len(out) >= k:
+                    return out
+                i = ids[self.rng.randrange(len(ids))]
+                if self._usable(i, answer_norm, taken):
+                    taken.add(i)
+                    out.append(self.phrases[i])
+        return out
+
+    @staticmethod
+    def fragments(sentences: Sequence[str], answer: str, k: int, rng=random) -> List[str]:
+        """عبارات من جمل الملف نفسه بطول الإجابة وكتابتها (عندما لا تكفي الإجابات الأخرى)"""
+        sc, n = script(answer), max(1, len(answer.split()))
+        answer_norm = _norm(answer)
+        out = []
+        for _ in range(SAMPLE_TRIES * k):
+            if len(out) >= k or not sentences:
+                break
+            words = rng.choice(sentences).split()
+            if len(words) <= n or script(" ".join(words)) != sc:
+                continue
+            start = rng.randrange(len(words) - n)
+            frag = " ".join(words[start:start + n]).strip(" ,;:.")
+            if frag and _norm(frag) != answer_norm and frag not in out:
+                out.append(frag)
+        return out
@@ -0,0 +1,112 @@
+import os
+import time
+import tempfile
+from typing import Optional
+
+from question_bank import doc_hasher
+
+# ================= تحميل ملفات تيليجرام إلى القرص =================
+# التحميل على دفعات DOWNLOAD_CHUNK_KB مباشرة إلى ملف في UPLOAD_SPOOL_DIR،
+# وsha256 يُحسب أثناء التحميل (question_bank.doc_hasher) فلا يبقى الملف في الذاكرة.
+# الحد يُفحص على file_size وContent-Length قبل أول بايت، ثم أثناء التحميل إن غابا.
+# مع عدة أجهزة (STATE_BACKEND=redis) يجب أن يكون UPLOAD_SPOOL_DIR مساراً مشتركاً:
+# الجلسة تحفظ مسار الملف لا محتواه، والبوت يرفض التشغيل إن رأت عملية أخرى مجلداً غيره
+# (state_store.ensure_shared_dir).
+
+DOWNLOAD_CHUNK = int(os.getenv("DOWNLOAD_CHUNK_KB", 64)) * 1024
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", 60))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", tempfile.gettempdir())
+SPOOL_PREFIX = "upload-"
+
+
+class TooLarge(Exception):
+    def __init__(self, size: int):
+        super().__init__(f"file larger than limit ({size} bytes)")
+        self.size = size
+
+
+class Download:
+    def __init__(self, path: str, size: int, sha256: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+def discard(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ spool cleanup failed for {path}: {e}")
+
+
+class Downloader:
+    def __init__(self):
+        self._client = None  # httpx.AsyncClient عند أول تحميل (أداة الحمل تضع بديلاً)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT, follow_redirects=True)
+        return self._client
+
+    async def fetch(self, tgfile, suffix: str, limit: int) -> Download:
+        """tgfile من bot.get_file؛ TooLarge قبل التحميل أو أثناءه إن تجاوز limit"""
+        if tgfile.file_size and tgfile.file_size > limit:
+            raise TooLarge(tgfile.file_size)
+        os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=SPOOL_PREFIX, suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+        digest, size = doc_hasher(), 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                if not tgfile.file_path.startswith(("http://", "https://")):
+                    # Bot API محلي (--local): file_path مسار على نفس الجهاز
+                    with open(tgfile.file_path, "rb") as src:
+                        while chunk := src.read(DOWNLOAD_CHUNK):
+                            size += len(chunk)
+                            if size > limit:
+                                raise TooLarge(size)
+                            digest.update(chunk)
+                            out.write(chunk)
+                else:
+                    async with self.client.stream("GET", tgfile.file_path) as r:
+                        r.raise_for_status()
+                        length = int(r.headers.get("content-length") or 0)
+                        if length > limit:
+                            raise TooLarge(length)
+                        async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK):
+                            size += len(chunk)
+                            if size > limit:
+                                raise TooLarge(size)  # نتوقف فوراً دون إكمال التحميل
+                            digest.update(chunk)
+                            out.write(chunk)
+        except BaseException:
+            discard(path)
+            raise
+        return Download(path, size, digest.hexdigest())
+
+    def sweep(self, max_age: float, keep=()) -> int:
+        """ملفات spool يتيمة (عملية توقفت قبل حذفها) أقدم من max_age ثانية؛ keep = مسارات جلسات حية"""
+        removed, cutoff = 0, time.time() - max_age
+        keep = {os.path.abspath(p) for p in keep if p}
+        try:
+            entries = os.scandir(UPLOAD_SPOOL_DIR)
+        except FileNotFoundError:
+            return 0
+        with entries:
+            for e in entries:
+                if e.name.startswith(SPOOL_PREFIX) and e.stat().st_mtime < cutoff and os.path.abspath(e.path) not in keep:
+                    discard(e.path)
+                    removed += 1
+        return removed
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+DOWNLOADS = Downloader()
@@ -0,0 +1,190 @@
+import os
+import json
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+# ================= سجل الأحداث المقسّم زمنياً =================
+# الأحداث الخام تُحفظ في ملفات يومية (events/raw/YYYY-MM-DD.jsonl) لمدة
+# EVENT_RETENTION_DAYS يوماً، ثم تُضغط إلى ملخصات يومية لكل مستخدم في rollups.json
+
+EVENTS_DIR = os.getenv("EVENTS_DIR", "events")
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", 14))
+RAW_DIR = os.path.join(EVENTS_DIR, "raw")
+ROLLUPS_FILE = os.path.join(EVENTS_DIR, "rollups.json")
+
+
+def _day_of(timestamp: str) -> str:
+    return timestamp[:10]
+
+
+def _segment_path(day: str) -> str:
+    return os.path.join(RAW_DIR, f"{day}.jsonl")
+
+
+def _segment_days() -> List[str]:
+    try:
+        names = os.listdir(RAW_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(n[:-len(".jsonl")] for n in names if n.endswith(".jsonl"))
+
+
+def _atomic_write_json(path: str, obj) -> None:
+    # اسم مؤقت فريد لكل كتابة: عمليتان تضغطان معاً لا تكتبان في نفس الملف المؤقت
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def append_event(event: Dict) -> None:
+    append_events([event])
+
+
+def append_events(events: List[Dict]) -> None:
+    """كتابة دفعة أحداث بفتح ملف واحد لكل يوم"""
+    by_day: Dict[str, List[str]] = {}
+    for event in events:
+        by_day.setdefault(_day_of(event["timestamp"]), []).append(json.dumps(event, ensure_ascii=False))
+    os.makedirs(RAW_DIR, exist_ok=True)
+    for day, lines in by_day.items():
+        with open(_segment_path(day), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def _event_key(event: Dict) -> str:
+    return json.dumps(event, ensure_ascii=False, sort_keys=True)
+
+
+def import_legacy(events: List[Dict]) -> int:
+    """نقل الأحداث المخزنة سابقاً داخل bot_users.json إلى الملفات اليومية.
+    آمن للتكرار: إن توقف البوت بعد النقل وقبل حفظ bot_users.json يُعاد النقل عند
+    التشغيل التالي، فيُتخطى ما وُجد في الملف اليومي أو في يوم مضغوط. تُرجع عدد المنقول"""
+    compacted = set(load_rollups()["compacted"])
+    existing: Dict[str, set] = {}
+    fresh = []
+    for event in events:
+        if not event.get("timestamp"):
+            continue
+        day = _day_of(event["timestamp"])
+        if day in compacted:
+            continue
+        if day not in existing:
+            existing[day] = {_event_key(e) for e in _read_segment(day)}
+        key = _event_key(event)
+        if key not in existing[day]:
+            existing[day].add(key)
+            fresh.append(event)
+    append_events(fresh)
+    return len(fresh)
+
+
+def _read_segment(day: str) -> List[Dict]:
+    out = []
+    try:
+        with open(_segment_path(day), "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    out.append(json.loads(line))
+                except Exception:
+                    # سطر مبتور بسبب توقف مفاجئ أثناء الكتابة
+                    continue
+    except FileNotFoundError:
+        pass
+    return out
+
+
+def load_rollups() -> Dict:
+    try:
+        with open(ROLLUPS_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"days": {}, "compacted": []}
+
+
+def _rollup_day(events: List[Dict]) -> Dict:
+    """ملخص يوم واحد: {user_id: {"counts": {type: n}, "sums": {"type.key": x}}}"""
+    users: Dict[str, Dict] = {}
+    for ev in events:
+        u = users.setdefault(str(ev.get("user_id")), {"counts": {}, "sums": {}})
+        etype = ev.get("type", "unknown")
+        u["counts"][etype] = u["counts"].get(etype, 0) + 1
+        for key, val in (ev.get("details") or {}).items():
+            if isinstance(val, (bool, int, float)):
+                skey = f"{etype}.{key}"
+                u["sums"][skey] = u["sums"].get(skey, 0) + val
+    return users
+
+
+def compact(now: Optional[datetime] = None) -> int:
+    """ضغط الملفات الأقدم من مدة الاحتفاظ. تُرجع عدد الأيام المضغوطة"""
+    now = now or datetime.now()
+    cutoff = (now - timedelta(days=EVENT_RETENTION_DAYS)).date().isoformat()
+    old_days = [d for d in _segment_days() if d < cutoff]
+    if not old_days:
+        return 0
+
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    rollups = load_rollups()
+    compacted = set(rollups["compacted"])
+    for day in old_days:
+        # يوم مضغوط مسبقاً (توقف البوت قبل حذف الملف) لا يُحسب مرتين
+        if day not in compacted:
+            rollups["days"][day] = _rollup_day(_read_segment(day))
+            compacted.add(day)
+    rollups["compacted"] = sorted(compacted)
+    _atomic_write_json(ROLLUPS_FILE, rollups)
+
+    for day in old_days:
+        try:
+            os.remove(_segment_path(day))
+        except FileNotFoundError:
+            pass
+    return len(old_days)
+
+
+# ================= القراءة (ملخصات + أحداث خام) =================
+def recent_events(limit: int = 10) -> List[Dict]:
+    """آخر الأحداث الخام، تُقرأ من أحدث ملف يومي فقط بقدر الحاجة"""
+    out: List[Dict] = []
+    for day in reversed(_segment_days()):
+        out = _read_segment(day) + out
+        if len(out) >= limit:
+            break
+    return out[-limit:]
+
+
+def iter_history() -> Iterator[Dict]:
+    """كل السجل بترتيب زمني: صفوف الملخصات اليومية ثم الأحداث الخام"""
+    rollups = load_rollups()
+    for day in sorted(rollups["days"]):
+        for user_id, agg in rollups["days"][day].items():
+            yield {"date": day, "user_id": user_id, "rollup": True, **agg}
+    for day in _segment_days():
+        yield from _read_segment(day)
+
+
+def user_totals(user_id) -> Counter:
+    """عدد الأحداث حسب النوع لمستخدم واحد عبر الملخصات والأحداث الخام"""
+    uid = str(user_id)
+    totals: Counter = Counter()
+    for agg in load_rollups()["days"].values():
+        if uid in agg:
+            totals.update(agg[uid]["counts"])
+    for day in _segment_days():
+        for ev in _read_segment(day):
+            if str(ev.get("user_id")) == uid:
+                totals[ev.get("type", "unknown")] += 1
+    return totals
@@ -1,59 +1,161 @@
 import os
-from typing import Optional
+import asyncio
+from typing import Optional, Tuple
 
-PDF_OK = True
-DOCX_OK = True
-PPTX_OK = True
+from ocr import ocr_image, ocr_pdf
 
-try:
-    from pdfminer.high_level import extract_text as pdf_extract_text
-except Exception:
-    PDF_OK = False
-try:
-    import docx
-except Exception:
-    DOCX_OK = False
-try:
-    from pptx import Presentation
-except Exception:
-    PPTX_OK = False
+# تجهيز الصور قبل OCR: أطول ضلع 2200px (~270DPI لصفحة A5)، رمادي، قص الهوامش، ضغط JPEG
+IMAGE_MAX_SIDE = int(os.getenv("OCR_IMAGE_MAX_SIDE", 2200))
+IMAGE_JPEG_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", 80))
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
 
-from ocr import ocr_space_file
+
+# المكتبات الثقيلة تُحمّل عند أول ملف من نوعها فقط (بدء أسرع للبوت)
+def _pdf_extract_text():
+    try:
+        from pdfminer.high_level import extract_text
+        return extract_text
+    except Exception:
+        return None
+
+
+def _docx_document():
+    try:
+        import docx
+        return docx.Document
+    except Exception:
+        return None
+
+
+def _pptx_presentation():
+    try:
+        from pptx import Presentation
+        return Presentation
+    except Exception:
+        return None
+
+
+def _pil():
+    try:
+        from PIL import Image, ImageOps
+        return Image, ImageOps
+    except Exception:
+        return None
+
+
+def _bbox(gray, keep, margin: int, scale: int, smooth):
+    """حدود البكسلات التي يختارها keep على نسخة مصغرة من الصورة (أسرع وأقل تأثراً بالضجيج)"""
+    small = gray.reduce(scale).filter(smooth)
+    hist = small.histogram()
+    mean = sum(i * n for i, n in enumerate(hist)) / max(1, small.size[0] * small.size[1])
+    box = small.point(lambda p: 255 if keep(p, mean) else 0).getbbox()
+    if not box:
+        return None
+    w, h = gray.size
+    left, top, right, bottom = (v * scale for v in box)
+    return (max(0, left - margin), max(0, top - margin), min(w, right + margin), min(h, bottom + margin))
+
+
+def _autocrop_box(gray, margin: int = 16):
+    """قص الطاولة حول الورقة (صور الهاتف) ثم الهوامش البيضاء حول النص؛ None إن لم يفد القص"""
+    from PIL import ImageFilter
+    w, h = gray.size
+    scale = max(1, max(w, h) // 800)
+    # 1) الورقة أفتح بوضوح من الخلفية
+    box = _bbox(gray, lambda p, mean: p > mean * 1.15, margin, scale, ImageFilter.MedianFilter(5)) or (0, 0, w, h)
+    # 2) النص أغمق بوضوح من الورقة (MinFilter يحفظ الخطوط الرفيعة بعد التصغير)؛
+    #    نبحث داخل الورقة بعيداً عن حافتها حتى لا تُحسب الطاولة نصاً
+    inset = 2 * margin + 4 * scale
+    page = (box[0] + inset, box[1] + inset, box[2] - inset, box[3] - inset)
+    if page[2] > page[0] and page[3] > page[1]:
+        inner = _bbox(gray.crop(page), lambda p, mean: p < mean * 0.85, margin, scale, ImageFilter.MinFilter(3))
+        if inner:
+            box = (page[0] + inner[0], page[1] + inner[1], page[0] + inner[2], page[1] + inner[3])
+    # لا نقص إلا إن وفّر 5% على الأقل من المساحة
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.95 * w * h:
+        return None
+    return box
+
+
+def prepare_image(path: str) -> str:
+    """تصغير وتحويل للرمادي وقص الهوامش وإعادة ضغط الصورة.
+    يُرجع مسار الصورة الجديدة، أو المسار الأصلي إن لم تكن النتيجة أصغر"""
+    pil = _pil()
+    if not pil:
+        return path
+    Image, ImageOps = pil
+    try:
+        with Image.open(path) as im:
+            # TIFF متعدد الصفحات يُرسل كما هو (OCR.space يقرأ كل الصفحات)
+            if getattr(im, "n_frames", 1) > 1:
+                return path
+            im = ImageOps.exif_transpose(im)
+            gray = im.convert("L")
+        box = _autocrop_box(gray)
+        if box:
+            gray = gray.crop(box)
+        if max(gray.size) > IMAGE_MAX_SIDE:
+            gray.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+        out = f"{os.path.splitext(path)[0]}.ocr.jpg"
+        gray.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        if os.path.getsize(out) >= os.path.getsize(path):
+            os.remove(out)
+            return path
+        return out
+    except Exception as e:
+        print(f"تجهيز الصورة فشل: {e}")
+        return path
+
+
+def _remove_prepared(prepared: str, path: str) -> None:
+    if prepared != path:
+        try:
+            os.remove(prepared)
+        except OSError:
+            pass
 
 
 async def extract_text_any(path: str, suffix: str, lang: str) -> str:
+    return (await extract_text_detail(path, suffix, lang))[0]
+
+
+async def extract_text_detail(path: str, suffix: str, lang: str) -> Tuple[str, bool]:
+    """(النص، هل استُخدم OCR) — لغة المحتوى لا تؤثر إلا في OCR"""
     suffix = (suffix or "").lower()
 
     if suffix == ".pdf":
         # 1) جرّب النص الأصلي
-        if PDF_OK:
+        pdf_extract_text = _pdf_extract_text()
+        if pdf_extract_text:
             try:
-                text = pdf_extract_text(path) or ""
+                # في خيط: الملفات الكبيرة لا توقف حلقة الأحداث، والإلغاء لا ينتظرها
+                text = await asyncio.get_running_loop().run_in_executor(None, pdf_extract_text, path) or ""
                 if len(text.strip()) > 300:
-                    return text
+                    return text, False
             except Exception:
                 pass
-        # 2) OCR عبر OCR.space (يدعم PDF متعدد الصفحات)
+        # 2) OCR (OCR.space أو Tesseract المحلي حسب OCR_BACKEND)
         try:
-            ocr_text = await ocr_space_file(path, lang)
+            ocr_text = await ocr_pdf(path, lang)
             if ocr_text:
-                return ocr_text
+                return ocr_text, True
         except Exception:
             pass
-        return ""
+        return "", True
 
-    if suffix == ".docx" and DOCX_OK:
+    if suffix == ".docx" and _docx_document():
         try:
-            d = docx.Document(path)
-            return "\n".join(p.text for p in d.paragraphs)
+            d = _docx_document()(path)
+            return "\n".join(p.text for p in d.paragraphs), False
         except Exception:
-            return ""
+            return "", False
 
-    if suffix == ".pptx" and PPTX_OK:
+    if suffix == ".pptx" and _pptx_presentation():
         try:
-            prs = Presentation(path)
-            chunks = []
+            prs = _pptx_presentation()(path)
+            slides = []
             for slide in prs.slides:
+                chunks = []
                 # نص الشرائح
                 for shape in slide.shapes:
                     if hasattr(shape, "has_text_frame") and shape.has_text_frame:
@@ -61,18 +163,34 @@ async def extract_text_any(path: str, suffix: str, lang: str) -> str:
                 # ملاحظات المحاضر إن وجدت
                 if slide.has_notes_slide and slide.notes_slide and slide.notes_slide.notes_text_frame:
                     chunks.append(slide.notes_slide.notes_text_frame.text)
-            return "\n".join(chunks)
+                slides.append("\n".join(chunks))
+            # \f بين الشرائح مثل فواصل صفحات pdfminer (لحذف الترويسات المتكررة)
+            return "\f".join(slides), False
         except Exception:
-            return ""
+            return "", False
 
     if suffix == ".txt":
         try:
-            return open(path, "r", encoding="utf-8", errors="ignore").read()
+            return open(path, "r", encoding="utf-8", errors="ignore").read(), False
         except Exception:
-            return ""
+            return "", False
 
-    # صور: jpg/png/tiff … → OCR
+    # صور: jpg/png/tiff … → تجهيز ثم OCR
+    prepared = path
+    if suffix in IMAGE_SUFFIXES:
+        job = asyncio.get_running_loop().run_in_executor(None, prepare_image, path)
+        try:
+            prepared = await asyncio.shield(job)
+        except asyncio.CancelledError:
+            # الإلغاء لا يوقف الخيط: الصورة المجهزة تُحذف حين ينتهي
+            def _cleanup(f):
+                if not f.cancelled() and f.exception() is None:
+                    _remove_prepared(f.result(), path)
+            job.add_done_callback(_cleanup)
+            raise
     try:
-        return await ocr_space_file(path, lang)
+        return await ocr_image(prepared, lang), True
     except Exception:
-        return ""
+        return "", True
+    finally:
+        _remove_prepared(prepared, path)
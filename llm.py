@@ -1,10 +1,25 @@
 import os
-import json
-import httpx
+import zlib
+import random
+import asyncio
+import hashlib
+from collections import Counter
+from typing import Dict, Optional
+
+from llm_json import parse_questions
+from providers import ROUTER
+from chunk_cache import CHUNK_CACHE
 
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
 MODEL = os.getenv("GROQ_MODEL", "openai/gpt-oss-120b")
-API_KEY = os.getenv("GROQ_API_KEY")
+CHUNK_CHARS = int(os.getenv("LLM_CHUNK_CHARS", 6000))
+TOKENS_PER_QUESTION = int(os.getenv("LLM_TOKENS_PER_QUESTION", 160))
+REASONING_TOKENS = int(os.getenv("LLM_REASONING_TOKENS", 1024))  # هامش تفكير النموذج
+CONTINUATIONS = int(os.getenv("LLM_CONTINUATIONS", 1))  # طلبات التكملة عند انقطاع الرد
+# حد بحسب المحتوى بعد نصف CHUNK_CHARS ثم كل ~CHUNK_ANCHOR حرف في المتوسط (0 = بالطول فقط):
+# متوسط المقطع ≈ CHUNK_CHARS فعدد الطلبات لملف جديد كالتقسيم بالطول، وبحد أقصى ضعفه
+CHUNK_ANCHOR = int(os.getenv("LLM_CHUNK_ANCHOR", CHUNK_CHARS // 2))
+CHUNK_MIN_SHARE = 0.5
+CHUNK_MAX_SHARE = 2.0
 
 SYS_AR = (
     "أنت أستاذ جامعي خبير في إعداد اختبارات شاملة ودقيقة.\n"
@@ -23,11 +38,11 @@ SYS_EN = (
 )
 
 PROMPT_AR = (
-    "حوّل النص التالي إلى مجموعة كبيرة من أسئلة الامتحان اعتماداً حصرياً على محتوى النص. المتطلبات:\n"
+    "حوّل النص التالي إلى {count} سؤالاً بالضبط ({n_mcq} من نوع MCQ و{n_tf} من نوع TF) اعتماداً حصرياً على محتوى النص. المتطلبات:\n"
     "- صياغة السؤال (question) يجب أن تكون باللغة العربية فقط.\n"
     "- بالنسبة لأسئلة MCQ: اربعة خيارات قوية ومُلبِّسة مكتوبة باللغة الإنجليزية فقط، مع واحدة صحيحة.\n"
     "- بالنسبة لأسئلة TF: صياغة السؤال بالعربية فقط، والخيارات يجب أن تكون ['True/صح','False/خطأ'].\n"
-    "- غطِّ جميع النقاط والمفاهيم المذكورة في النص دون أي إضافة خارجية.\n"
+    "- وزّع الأسئلة على أهم النقاط والمفاهيم المذكورة في النص دون أي إضافة خارجية.\n"
     "- اجعل الأسئلة متنوعة الصعوبة وتشمل مفاهيم مترابطة وربط بين الأفكار.\n"
     "- الناتج يجب أن يكون JSON Array فقط بالشكل:\n"
     "[{{\"type\":\"mcq\",\"question\":\"... (بالعربية)\",\"options\":[\"Option1\",\"Option2\",\"Option3\",\"Option4\"],\"correct\":0}},"
@@ -36,11 +51,11 @@ PROMPT_AR = (
 )
 
 PROMPT_EN = (
-    "Convert the following text into a large set of exam questions. Requirements:\n"
+    "Convert the following text into exactly {count} exam questions ({n_mcq} 'mcq' and {n_tf} 'tf'). Requirements:\n"
     "- Supported types: 'mcq' and 'tf'.\n"
     "- MCQ: exactly 4 strong, confusing distractors; one correct. Avoid 'All of the above/None'.\n"
     "- TF: options must be ['True','False'] with statements verifiable from the text.\n"
-    "- Cover all topics, definitions, formulas, edge cases, and examples.\n"
+    "- Spread the questions over the most important topics, definitions, formulas and examples.\n"
     "- Vary difficulty across Bloom levels and interleave concepts.\n"
     "- Return JSON Array ONLY in the form above:\n"
     "[{{\"type\":\"mcq\",\"question\":\"...\",\"options\":[\"Option1\",\"Option2\",\"Option3\",\"Option4\"],\"correct\":0}},"
@@ -48,41 +63,86 @@ PROMPT_EN = (
     "TEXT:\n{chunk}"
 )
 
-async def _ask_chunk(chunk: str, lang: str) -> list:
-    if not API_KEY:
-        return []
+CONTINUE_AR = "\nالأسئلة التالية كُتبت مسبقاً فلا تكررها:\n{done}"
+CONTINUE_EN = "\nThese questions were already written, do not repeat them:\n{done}"
+
+# إحصائيات قراءة الردود (تقرير نسبة الإنقاذ)
+PARSE_STATS = Counter()
+
+
+async def _request_chunk(chunk: str, lang: str, n_mcq: int, n_tf: int, done: list = None) -> tuple:
+    """طلب واحد؛ يُرجع (الأسئلة المقروءة، هل الرد مقطوع)"""
     sys_msg = SYS_AR if lang == "ar" else SYS_EN
     prompt = PROMPT_AR if lang == "ar" else PROMPT_EN
 
     # استخدم replace بدلاً من format لتجنب مشاكل الأقواس
-    prompt_text = prompt.replace("{chunk}", chunk)
+    prompt_text = (prompt.replace("{count}", str(n_mcq + n_tf))
+                   .replace("{n_mcq}", str(n_mcq))
+                   .replace("{n_tf}", str(n_tf))
+                   .replace("{chunk}", chunk))
+    if done:
+        # طلب تكملة: نذكر ما كُتب فقط (بدون إعادة إرسال الأسئلة كاملة)
+        listed = "\n".join(f"- {str(it.get('question', ''))[:80]}" for it in done)
+        prompt_text += (CONTINUE_AR if lang == "ar" else CONTINUE_EN).replace("{done}", listed)
 
     payload = {
         "model": MODEL,
         "temperature": 0.2,
+        # حجم المخرجات على قدر الأسئلة المطلوبة فقط
+        "max_tokens": (n_mcq + n_tf) * TOKENS_PER_QUESTION + REASONING_TOKENS,
         "messages": [
             {"role": "system", "content": sys_msg},
             {"role": "user", "content": prompt_text},
         ],
     }
 
-    async with httpx.AsyncClient(timeout=300) as client:  # زيادة الوقت للملفات الكبيرة
-        r = await client.post(
-            GROQ_URL,
-            headers={"Authorization": f"Bearer {API_KEY}"},
-            json=payload
-        )
-        r.raise_for_status()
-        data = r.json()
-        content = data["choices"][0]["message"]["content"]
-
-    try:
-        arr = json.loads(content)
-        if isinstance(arr, list):
-            return arr
-    except Exception:
-        pass
-    return []
+    # الموجّه يختار المزوّد ويرسل طلباً احتياطياً عند التأخر (النموذج يُستبدل بنموذج كل مزوّد)
+    data = await ROUTER.chat(payload)
+    choice = data["choices"][0]
+    items, cut = parse_questions(choice["message"].get("content") or "")
+    truncated = cut or choice.get("finish_reason") == "length"
+
+    PARSE_STATS["responses"] += 1
+    PARSE_STATS["questions"] += len(items)
+    if truncated:
+        PARSE_STATS["truncated"] += 1
+        PARSE_STATS["salvaged"] += len(items)
+    if not items:
+        PARSE_STATS["empty"] += 1
+    return items, truncated
+
+
+async def _ask_chunk(chunk: str, lang: str, n_mcq: int, n_tf: int, done: list = None) -> list:
+    """done: أسئلة موجودة لهذا المقطع (من الذاكرة) لا يُراد تكرارها"""
+    if not ROUTER.providers:
+        return []
+    done = done or []
+    out, truncated = await _request_chunk(chunk, lang, n_mcq, n_tf, done=done)
+    for _ in range(CONTINUATIONS):
+        have_mcq = sum(1 for it in out if str(it.get("type", "mcq")).lower() != "tf")
+        rest_mcq, rest_tf = max(0, n_mcq - have_mcq), max(0, n_tf - (len(out) - have_mcq))
+        # التكملة فقط عند انقطاع الرد وبقاء أسئلة ناقصة
+        if not truncated or not (rest_mcq + rest_tf):
+            break
+        PARSE_STATS["continuations"] += 1
+        more, truncated = await _request_chunk(chunk, lang, rest_mcq, rest_tf, done=done + out)
+        out.extend(more)
+    return out
+
+
+def salvage_report() -> str:
+    s = PARSE_STATS
+    rate = 100 * s["salvaged"] / max(1, s["questions"])
+    return (f"responses={s['responses']} truncated={s['truncated']} empty={s['empty']} "
+            f"continuations={s['continuations']} questions={s['questions']} salvaged={s['salvaged']} ({rate:.1f}%)")
+
+
+def _anchor(seg: str) -> bool:
+    """السطر حد مقطع باحتمال يتناسب مع طوله (بصمته فقط، لا موضعه)"""
+    if CHUNK_ANCHOR <= 0:
+        return False
+    norm = " ".join(seg.casefold().split())
+    return zlib.crc32(norm.encode("utf-8")) < len(norm) * 2 ** 32 // CHUNK_ANCHOR
 
 
 def _split_text(text: str, max_len: int = None):
@@ -90,6 +150,11 @@ def _split_text(text: str, max_len: int = None):
     if max_len is None:
         return [text]
 
+    # الحدود تُختار بمحتوى الأسطر (بعد نصف الطول) لا بموضعها: شرائح مضافة أو
+    # محاضرة مدمجة في ملف أكبر لا تزيح حدود المقاطع التالية، فتبقى بصماتها في CHUNK_CACHE
+    min_len = int(CHUNK_MIN_SHARE * max_len)
+    if CHUNK_ANCHOR > 0:
+        max_len = int(CHUNK_MAX_SHARE * max_len)
     parts = []
     buff = []
     count = 0
@@ -97,23 +162,132 @@ def _split_text(text: str, max_len: int = None):
         seg = seg.strip()
         if not seg:
             continue
-        if count + len(seg) > max_len:
+        if count + len(seg) > max_len and buff:
             parts.append("\n".join(buff))
-            buff, count = [seg], len(seg)
-        else:
-            buff.append(seg)
-            count += len(seg)
+            buff, count = [], 0
+        buff.append(seg)
+        count += len(seg)
+        if count >= min_len and _anchor(seg):
+            parts.append("\n".join(buff))
+            buff, count = [], 0
     if buff:
         parts.append("\n".join(buff))
     return parts
 
 
-async def ask_llm_big(text: str, lang: str, target_total: int = None) -> list:
-    chunks = _split_text(text, max_len=None)  # بدون حد
+def _allocate(lengths: list, total: int) -> list:
+    """توزيع total على المقاطع بنسبة أطوالها (طريقة أكبر باقٍ)"""
+    size = sum(lengths) or 1
+    exact = [total * n / size for n in lengths]
+    quotas = [int(x) for x in exact]
+    rest = sorted(range(len(lengths)), key=lambda i: exact[i] - quotas[i], reverse=True)
+    for i in rest[:total - sum(quotas)]:
+        quotas[i] += 1
+    return quotas
+
+
+def _split_mix(n: int, mcq_ratio: float) -> tuple:
+    n_mcq = round(n * mcq_ratio)
+    return n_mcq, n - n_mcq
+
+
+def _from_cache(cached: list, n_mcq: int, n_tf: int) -> tuple:
+    """عينة من أسئلة المقطع المحفوظة بالخلطة المطلوبة: (الأسئلة، MCQ ناقصة، TF ناقصة)"""
+    mcq = [it for it in cached if str(it.get("type", "mcq")).lower() != "tf"]
+    tf = [it for it in cached if str(it.get("type", "mcq")).lower() == "tf"]
+    picked = random.sample(mcq, min(n_mcq, len(mcq))) + random.sample(tf, min(n_tf, len(tf)))
+    return picked, max(0, n_mcq - len(mcq)), max(0, n_tf - len(tf))
+
+
+def _plan(text: str, target_total: int = None) -> tuple:
+    if not target_total:
+        # بدون ميزانية: طلب واحد للنص كاملاً كما كان سابقاً
+        return _split_text(text, max_len=None), [max(1, len(text) // 400)]
+    chunks = _split_text(text, max_len=CHUNK_CHARS)
+    return chunks, _allocate([len(c) for c in chunks], target_total)
+
+
+# ================= طلب المقطع الأول مسبقاً =================
+# يبدأ أثناء انتظار اختيار اللغة (تخمين)؛ المفتاح يحدد الطلب تماماً، فإن طابقه
+# أول طلب في ask_llm_big أُخذت نتيجته، وإلا أُلغي بـ cancel_prefetch.
+_PREFETCH: Dict[tuple, asyncio.Task] = {}
+
+
+def _prefetch_key(chunk: str, lang: str, n_mcq: int, n_tf: int, done: list) -> tuple:
+    """n_mcq/n_tf: الناقص بعد الذاكرة؛ done: أسئلة المقطع المحفوظة التي طُلب عدم تكرارها"""
+    seen = hashlib.sha1("\n".join(str(it.get("question", "")) for it in done).encode("utf-8")).hexdigest()
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest(), lang, n_mcq, n_tf, seen, ROUTER.fingerprint()
+
+
+def prefetch_first_chunk(text: str, lang: str, target_total: int = None, mcq_ratio: float = 0.7) -> Optional[tuple]:
+    chunks, quotas = _plan(text, target_total)
+    want = min(quotas[0], target_total) if target_total else quotas[0]
+    if not chunks or want <= 0 or not ROUTER.providers:
+        return None
+    n_mcq, n_tf = _split_mix(want, mcq_ratio)
+    cached = CHUNK_CACHE.get(chunks[0], lang, ROUTER.fingerprint()) or []
+    _, rest_mcq, rest_tf = _from_cache(cached, n_mcq, n_tf)
+    if not rest_mcq + rest_tf:
+        return None  # المقطع الأول محفوظ: لا طلب مسبق
+    # محفوظ جزئياً: الناقص فقط، كما سيطلبه ask_llm_big
+    key = _prefetch_key(chunks[0], lang, rest_mcq, rest_tf, cached)
+    if key not in _PREFETCH:
+        _PREFETCH[key] = asyncio.get_running_loop().create_task(
+            _ask_chunk(chunks[0], lang, rest_mcq, rest_tf, done=cached))
+    return key
+
+
+def cancel_prefetch(key: Optional[tuple]) -> None:
+    task = _PREFETCH.pop(key, None)
+    if task is not None:
+        task.cancel()
+
+
+async def ask_llm_big(text: str, lang: str, target_total: int = None, mcq_ratio: float = 0.7) -> list:
+    chunks, quotas = _plan(text, target_total)
+    # الموجّه يرسل كل طلب بنموذج المزوّد الذي يختاره: الذاكرة لمجموعة النماذج لا لـ GROQ_MODEL
+    models = ROUTER.fingerprint()
+
     out = []
-    for ch in chunks:
-        arr = await _ask_chunk(ch, lang)
-        if not arr:
+    carry = 0  # ما نقص من مقطع سابق يُضاف للمقطع التالي
+    used = reused = chars = reused_chars = 0
+    for idx, (ch, quota) in enumerate(zip(chunks, quotas)):
+        want = quota + carry
+        if target_total:
+            want = min(want, target_total - len(out))
+        if want <= 0:
             continue
+        n_mcq, n_tf = _split_mix(want, mcq_ratio)
+        used += 1
+        chars += len(ch)
+        # المقطع سبق توليد أسئلة منه (في أي ملف): النموذج يُسأل عن الناقص فقط
+        cached = CHUNK_CACHE.get(ch, lang, models) or []
+        arr, rest_mcq, rest_tf = _from_cache(cached, n_mcq, n_tf)
+        if not rest_mcq + rest_tf:
+            reused += 1
+            reused_chars += len(ch)
+        else:
+            new = None
+            prefetched = _PREFETCH.pop(_prefetch_key(ch, lang, rest_mcq, rest_tf, cached), None) if idx == 0 else None
+            if prefetched is not None:
+                try:
+                    new = await prefetched
+                    PARSE_STATS["prefetched"] += 1
+                except Exception:
+                    new = None
+            if new is None:
+                new = await _ask_chunk(ch, lang, rest_mcq, rest_tf, done=cached)
+            arr = arr + new
+            CHUNK_CACHE.put(ch, lang, models, cached + [it for it in new if isinstance(it, dict)])
+        arr = [it for it in arr if isinstance(it, dict)][:want]
+        carry = want - len(arr)
+        # رقم المقطع المصدر يُحفظ مع السؤال في بنك الأسئلة
+        for it in arr:
+            it["chunk"] = idx
         out.extend(arr)
-    return out  # بدون أي حد على عدد الأسئلة
\ No newline at end of file
+        # توقف مبكر: اكتملت الميزانية
+        if target_total and len(out) >= target_total:
+            break
+    if CHUNK_CACHE.enabled and used:
+        print(f"♻️ Chunk cache: {CHUNK_CACHE.record(used, reused, chars, reused_chars)}")
+    return out
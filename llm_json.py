@@ -0,0 +1,77 @@
+import re
+import ast
+import json
+from typing import Dict, List, Tuple
+
+# ================= قراءة متسامحة لمخرجات النموذج =================
+# النموذج يُرجع أحياناً JSON داخل ```json```، أو بفاصلة زائدة، أو مقطوعاً في منتصف
+# المصفوفة عند بلوغ max_tokens. بدل رمي الرد كاملاً نستخرج كل سؤال مكتمل منه.
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", re.S)
+_THINK_RE = re.compile(r"<think>.*?(?:</think>|$)", re.S)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERAL_RE = re.compile(r"(:\s*)(True|False|None)\b")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def strip_fences(text: str) -> str:
+    text = _THINK_RE.sub("", text or "")
+    m = _FENCE_RE.search(text)
+    return (m.group(1) if m else text).strip()
+
+
+def _loads(s: str):
+    """json ثم إصلاح العيوب الشائعة ثم صياغة بايثون (علامات مفردة)؛ None عند الفشل"""
+    try:
+        return json.loads(s, strict=False)
+    except Exception:
+        pass
+    fixed = _PY_LITERAL_RE.sub(lambda m: m.group(1) + _PY_LITERALS[m.group(2)], _TRAILING_COMMA_RE.sub(r"\1", s))
+    try:
+        return json.loads(fixed, strict=False)
+    except Exception:
+        pass
+    try:
+        return ast.literal_eval(s)
+    except Exception:
+        return None
+
+
+def _scan_objects(text: str) -> Tuple[List[Dict], bool]:
+    """كل كائن سؤال مكتمل في النص بالترتيب، وهل انقطع النص قبل إغلاق بنيته"""
+    out: List[Dict] = []
+    stack: List[Tuple[str, int]] = []
+    in_string = escaped = False
+    kept_from = -1  # بداية آخر سؤال محفوظ (لتجاهل الكائنات التي تحتويه)
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append((ch, i))
+        elif ch in "}]" and stack:
+            opener, start = stack.pop()
+            if ch == "}" and opener == "{" and start > kept_from:
+                obj = _loads(text[start:i + 1])
+                if isinstance(obj, dict) and "question" in obj:
+                    out.append(obj)
+                    kept_from = start
+    return out, bool(stack) or in_string
+
+
+def parse_questions(content: str) -> Tuple[List[Dict], bool]:
+    """(الأسئلة، هل الرد مقطوع). يقبل مصفوفة أو {"questions": [...]} أو كائنات متتالية"""
+    text = strip_fences(content)
+    data = _loads(text)
+    if isinstance(data, dict):
+        data = next((v for v in data.values() if isinstance(v, list)), None)
+    if isinstance(data, list):
+        return [it for it in data if isinstance(it, dict)], False
+    return _scan_objects(text)
@@ -1,41 +1,268 @@
 import os
-import base64
-import json
-import httpx
+import asyncio
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
 
 # يستخدم OCR.space كبوابة OCR مجانية (ينفع للصور وPDF متعددة الصفحات)
 # أنشئ مفتاح مجاني من: https://ocr.space/ocrapi
 
-async def ocr_space_file(path: str, lang: str) -> str:
-    api_key = os.getenv("OCR_SPACE_API_KEY")
-    if not api_key:
-        return ""
+OCR_SPACE_URL = "https://api.ocr.space/parse/image"
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 60))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", 4))
+OCR_PAGES_PER_REQUEST = int(os.getenv("OCR_PAGES_PER_REQUEST", 3))  # حد الخطة المجانية 3 صفحات
 
-    lang_code = "ara" if (lang or "ar").startswith("ar") else "eng"
 
-    with open(path, "rb") as f:
-        content = f.read()
+def _lang_code(lang: str) -> str:
+    return "ara" if (lang or "ar").startswith("ar") else "eng"
+
 
+async def _post_ocr(client, name: str, content: bytes, lang: str, api_key: str) -> List[str]:
+    """طلب OCR واحد؛ يُرجع نص كل صفحة بالترتيب أو يرفع استثناء عند الفشل"""
     # نرسل الملف مباشرة كباينري
     data = {
-        "language": lang_code,
+        "language": _lang_code(lang),
         "isOverlayRequired": False,
         "OCREngine": 2,
         "scale": True,
         "detectOrientation": True,
     }
+    files = {"file": (name, content)}
+    r = await client.post(OCR_SPACE_URL, data={**data, "apikey": api_key}, files=files)
+    r.raise_for_status()
+    obj = r.json()
+    if obj.get("IsErroredOnProcessing"):
+        raise RuntimeError(f"OCR.space: {obj.get('ErrorMessage')}")
+    return [res.get("ParsedText", "") or "" for res in obj.get("ParsedResults", []) or []]
+
+
+async def ocr_space_file(path: str, lang: str) -> str:
+    api_key = os.getenv("OCR_SPACE_API_KEY")
+    if not api_key:
+        return ""
+
+    with open(path, "rb") as f:
+        content = f.read()
+
+    import httpx  # تحميل مؤجل: لا حاجة له إلا عند أول OCR
+
+    async with httpx.AsyncClient(timeout=OCR_TIMEOUT) as client:
+        pages = await _post_ocr(client, os.path.basename(path), content, lang, api_key)
+
+    # جمع النصوص من كل الصفحات (\f بين الصفحات)
+    return "\f".join(t for t in pages if t)
+
+
+# ================= OCR متوازٍ لملفات PDF الممسوحة =================
+def split_pdf(path: str, pages_per_part: int) -> Optional[List[Tuple[int, int, bytes]]]:
+    """تقسيم PDF إلى أجزاء (أول صفحة، عدد الصفحات، البايتات)؛ None إن تعذر التقسيم"""
+    try:
+        from io import BytesIO
+        from pypdf import PdfReader, PdfWriter
+    except Exception:
+        return None
+    try:
+        reader = PdfReader(path)
+        total = len(reader.pages)
+        parts = []
+        for start in range(0, total, pages_per_part):
+            writer = PdfWriter()
+            end = min(start + pages_per_part, total)
+            for i in range(start, end):
+                writer.add_page(reader.pages[i])
+            buf = BytesIO()
+            writer.write(buf)
+            parts.append((start, end - start, buf.getvalue()))
+        return parts
+    except Exception:
+        return None
+
+
+async def ocr_space_pdf(path: str, lang: str) -> str:
+    """OCR لصفحات PDF على دفعات متوازية؛ الصفحات الفاشلة تُعاد منفردة والنتيجة قد تكون جزئية"""
+    api_key = os.getenv("OCR_SPACE_API_KEY")
+    if not api_key:
+        return ""
+
+    loop = asyncio.get_running_loop()
+    parts = await loop.run_in_executor(None, split_pdf, path, OCR_PAGES_PER_REQUEST)
+    if not parts or len(parts) == 1:
+        return await ocr_space_file(path, lang)
+
+    import httpx
+
+    total = parts[-1][0] + parts[-1][1]
+    pages: List[str] = [""] * total
+    failed: List[int] = []
+    sem = asyncio.Semaphore(OCR_CONCURRENCY)
+
+    async with httpx.AsyncClient(timeout=OCR_TIMEOUT) as client:
+
+        async def run_part(start: int, count: int, content: bytes):
+            async with sem:
+                try:
+                    texts = await _post_ocr(client, f"pages_{start + 1}.pdf", content, lang, api_key)
+                except Exception:
+                    failed.extend(range(start, start + count))
+                    return
+            for i, t in enumerate(texts[:count]):
+                pages[start + i] = t
+
+        await asyncio.gather(*(run_part(*p) for p in parts))
+
+        # إعادة الصفحات الفاشلة كل صفحة وحدها
+        if failed:
+            singles = {p[0]: p for p in (await loop.run_in_executor(None, split_pdf, path, 1) or [])}
+            retry = sorted(failed)
+            failed.clear()
+            await asyncio.gather(*(run_part(*singles[i]) for i in retry if i in singles))
+            if failed:
+                print(f"OCR: تعذرت قراءة {len(failed)} صفحة من {total}")
+
+    return "\f".join(pages)
+
+
+# ================= محرك OCR محلي (Tesseract) =================
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")  # auto | ocrspace | tesseract
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+
+
+def _tess_lang(lang: str) -> str:
+    # المحاضرات العربية تحوي مصطلحات إنجليزية كثيرة
+    return "ara+eng" if (lang or "ar").startswith("ar") else "eng"
+
+
+def _tesseract_image(source, lang: str) -> str:
+    """يعمل داخل عملية منفصلة: source مسار صورة أو بايتات"""
+    from io import BytesIO
+    import pytesseract
+    from PIL import Image
+
+    pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", "tesseract")
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as im:
+        return pytesseract.image_to_string(im, lang=_tess_lang(lang))
+
+
+def _pdf_page_images(path: str) -> List[bytes]:
+    """صورة كل صفحة من PDF ممسوح (الصورة المضمنة الأكبر في الصفحة)"""
+    from pypdf import PdfReader
+
+    out = []
+    for page in PdfReader(path).pages:
+        try:
+            images = list(page.images)
+            out.append(max((im.data for im in images), key=len) if images else b"")
+        except Exception:
+            # ترميز صورة غير مدعوم: الصفحة تبقى فارغة
+            out.append(b"")
+    return out
+
+
+def _process_pool():
+    global _pool
+    if _pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn لا fork: البوت فيه خيوط (المنفذ الافتراضي، المشخّص) وأقفالها المنسوخة
+        # في عملية fork قد تبقى مقفلة إلى الأبد؛ العامل يستورد ocr.py فقط وهو خفيف
+        _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class OcrBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def available(self) -> bool: ...
+
+    @abstractmethod
+    async def image(self, path: str, lang: str) -> str: ...
+
+    @abstractmethod
+    async def pdf(self, path: str, lang: str) -> str: ...
+
+
+class OcrSpaceBackend(OcrBackend):
+    name = "ocrspace"
+
+    def available(self) -> bool:
+        return bool(os.getenv("OCR_SPACE_API_KEY"))
+
+    async def image(self, path: str, lang: str) -> str:
+        return await ocr_space_file(path, lang)
+
+    async def pdf(self, path: str, lang: str) -> str:
+        return await ocr_space_pdf(path, lang)
+
+
+class TesseractBackend(OcrBackend):
+    name = "tesseract"
+
+    def __init__(self):
+        self._ok: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._ok is None:
+            import shutil
+            from importlib.util import find_spec
+            # فحص وجود الحزم دون استيرادها في العملية الرئيسية (تُستورد داخل العمّال فقط)
+            self._ok = (find_spec("pytesseract") is not None and find_spec("PIL") is not None
+                        and shutil.which(os.getenv("TESSERACT_CMD", "tesseract")) is not None)
+        return self._ok
+
+    async def image(self, path: str, lang: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_process_pool(), _tesseract_image, path, lang)
+
+    async def pdf(self, path: str, lang: str) -> str:
+        loop = asyncio.get_running_loop()
+        pages = await loop.run_in_executor(None, _pdf_page_images, path)
+        pool = _process_pool()
+
+        async def one(data: bytes) -> str:
+            if not data:
+                return ""
+            try:
+                return await loop.run_in_executor(pool, _tesseract_image, data, lang)
+            except Exception:
+                return ""
+
+        return "\f".join(await asyncio.gather(*(one(p) for p in pages)))
+
+
+BACKENDS = {b.name: b for b in (OcrSpaceBackend(), TesseractBackend())}
+
+
+def backends() -> List[OcrBackend]:
+    """المحرك المختار أولاً ثم البقية كاحتياط؛ auto = OCR.space إن وُجد مفتاح وإلا المحلي"""
+    order = [OCR_BACKEND] if OCR_BACKEND in BACKENDS else []
+    order += [n for n in ("ocrspace", "tesseract") if n not in order]
+    return [BACKENDS[n] for n in order if BACKENDS[n].available()]
+
+
+async def _run(kind: str, path: str, lang: str) -> str:
+    for backend in backends():
+        try:
+            text = await getattr(backend, kind)(path, lang)
+        except Exception as e:
+            print(f"OCR ({backend.name}) فشل: {e}")
+            continue
+        if text and text.strip():
+            return text
+    return ""
+
 
-    files = {"file": (os.path.basename(path), content)}
+async def ocr_image(path: str, lang: str) -> str:
+    return await _run("image", path, lang)
 
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post("https://api.ocr.space/parse/image", data={**data, "apikey": api_key}, files=files)
-        r.raise_for_status()
-        obj = r.json()
 
-    # جمع النصوص من كل الصفحات
-    texts = []
-    for res in obj.get("ParsedResults", []) or []:
-        t = res.get("ParsedText", "")
-        if t:
-            texts.append(t)
-    return "\n".join(texts)
+async def ocr_pdf(path: str, lang: str) -> str:
+    return await _run("pdf", path, lang)
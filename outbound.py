@@ -0,0 +1,192 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+# ================= موزّع الرسائل الصادرة =================
+# كل استدعاءات الإرسال إلى Bot API تمر من هنا حتى لا نتجاوز حدود Telegram:
+# حد عام (رسائل/ثانية) وحد لكل محادثة، مع أولويات (أسئلة الاختبار قبل إشعارات المدير)
+# واحترام RetryAfter ودمج رسائل التقدم المتتالية في رسالة واحدة.
+# مع عدة عمليات (STATE_BACKEND) يُقسم الحد العام عليها عبر set_workers.
+
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", 28))          # رسالة/ثانية لكل البوت
+PRIVATE_INTERVAL = float(os.getenv("TG_PRIVATE_INTERVAL", 1.0))  # ثانية بين رسائل نفس المحادثة الخاصة
+GROUP_INTERVAL = float(os.getenv("TG_GROUP_INTERVAL", 3.0))      # 20 رسالة/دقيقة للمجموعات
+MAX_RETRIES = 3
+PRUNE_SECONDS = 60.0  # تنظيف مواعيد المحادثات المنتهية
+
+PRIORITY_POLL = 0
+PRIORITY_USER = 1
+PRIORITY_ADMIN = 2
+PRIORITY_BULK = 3  # البث الجماعي: لا يؤخر أي رسالة أخرى
+
+
+def _report_failure(fut: asyncio.Future):
+    if not fut.cancelled() and fut.exception() is not None:
+        print(f"فشل إرسال رسالة: {fut.exception()}")
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "func", "args", "kwargs", "future", "key", "tries")
+
+    def __init__(self, priority, seq, chat_id, func, args, kwargs, future, key):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.key = key
+        self.tries = 0
+
+
+class OutboundDispatcher:
+    def __init__(self, global_rate: float = GLOBAL_RATE, private_interval: float = PRIVATE_INTERVAL,
+                 group_interval: float = GROUP_INTERVAL, max_retries: int = MAX_RETRIES):
+        self.global_rate = global_rate
+        self.global_interval = 1.0 / global_rate
+        self.workers = 1
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+
+        self._seq = itertools.count()
+        self._ready: List[Tuple[int, int, _Job]] = []           # (priority, seq, job)
+        self._waiting: List[Tuple[float, int, int, _Job]] = []  # (not_before, priority, seq, job)
+        self._chat_next: Dict[Any, float] = {}
+        self._global_next = 0.0
+        self._next_prune = 0.0
+        self._pending_keys: Dict[Hashable, _Job] = {}
+        self._inflight: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "retry_after": 0, "failed": 0, "coalesced": 0, "dropped": 0}
+
+    # ---------- الواجهة ----------
+    def submit(self, chat_id, priority: int, func: Callable[..., Awaitable], /, *args,
+               coalesce_key: Hashable = None, **kwargs) -> asyncio.Future:
+        """جدولة استدعاء؛ coalesce_key يستبدل أي استدعاء معلّق بنفس المفتاح لم يُرسل بعد"""
+        self._ensure_worker()
+        if coalesce_key is not None and coalesce_key in self._pending_keys:
+            job = self._pending_keys[coalesce_key]
+            job.func, job.args, job.kwargs = func, args, kwargs
+            self.stats["coalesced"] += 1
+            return job.future
+
+        job = _Job(priority, next(self._seq), chat_id, func, args, kwargs,
+                   asyncio.get_running_loop().create_future(), coalesce_key)
+        if coalesce_key is not None:
+            self._pending_keys[coalesce_key] = job
+        heapq.heappush(self._ready, (job.priority, job.seq, job))
+        self._wakeup.set()
+        return job.future
+
+    def post(self, chat_id, priority: int, func: Callable[..., Awaitable], /, *args,
+             coalesce_key: Hashable = None, **kwargs) -> None:
+        """مثل submit دون انتظار النتيجة (إشعارات المدير)؛ الفشل يُطبع فقط"""
+        fut = self.submit(chat_id, priority, func, *args, coalesce_key=coalesce_key, **kwargs)
+        fut.add_done_callback(_report_failure)
+
+    async def call(self, chat_id, priority: int, func: Callable[..., Awaitable], /, *args,
+                   coalesce_key: Hashable = None, **kwargs):
+        return await self.submit(chat_id, priority, func, *args, coalesce_key=coalesce_key, **kwargs)
+
+    def set_workers(self, n: int) -> None:
+        """عدد العمليات الحية التي تتقاسم حد البوت العام: لكل واحدة global_rate / n"""
+        self.workers = max(1, n)
+        self.global_interval = self.workers / self.global_rate
+
+    async def aclose(self, timeout: float = 10.0):
+        """انتظار تفريغ الطابور (عند الإيقاف) ثم إنهاء العامل"""
+        deadline = time.monotonic() + timeout
+        while (self._ready or self._waiting or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    # ---------- الداخلي ----------
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _interval_for(self, chat_id) -> float:
+        # معرفات المجموعات والقنوات سالبة في Telegram
+        return self.group_interval if isinstance(chat_id, int) and chat_id < 0 else self.private_interval
+
+    def _prune(self, now: float):
+        """مواعيد المحادثات التي انقضت لا تؤثر على الجدولة: تُحذف حتى لا يكبر القاموس بكل محادثة"""
+        self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        self._next_prune = now + PRUNE_SECONDS
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_prune:
+                self._prune(now)
+            while self._waiting and self._waiting[0][0] <= now:
+                _, prio, seq, job = heapq.heappop(self._waiting)
+                heapq.heappush(self._ready, (prio, seq, job))
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            prio, seq, job = heapq.heappop(self._ready)
+            if job.future.cancelled():
+                # من ينتظر الرسالة أُلغي (مثلاً رسالة تقدم لمعالجة أُلغيت): لا تُرسل
+                if job.key is not None and self._pending_keys.get(job.key) is job:
+                    del self._pending_keys[job.key]
+                self.stats["dropped"] += 1
+                continue
+            chat_ready = self._chat_next.get(job.chat_id, 0.0)
+            if chat_ready > now:
+                heapq.heappush(self._waiting, (chat_ready, prio, seq, job))
+                continue
+
+            if self._global_next > now:
+                # نعيد المهمة ثم ننتظر؛ قد تصل مهمة أعلى أولوية خلال الانتظار
+                heapq.heappush(self._ready, (prio, seq, job))
+                await asyncio.sleep(self._global_next - now)
+                continue
+
+            self._global_next = now + self.global_interval
+            self._chat_next[job.chat_id] = now + self._interval_for(job.chat_id)
+            if job.key is not None:
+                self._pending_keys.pop(job.key, None)
+            task = asyncio.get_running_loop().create_task(self._execute(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, job: _Job):
+        job.tries += 1
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None and job.tries <= self.max_retries:
+                self.stats["retry_after"] += 1
+                not_before = time.monotonic() + float(retry_after)
+                self._chat_next[job.chat_id] = max(self._chat_next.get(job.chat_id, 0.0), not_before)
+                heapq.heappush(self._waiting, (not_before, job.priority, job.seq, job))
+                self._wakeup.set()
+                return
+            self.stats["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self.stats["sent"] += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+
+OUTBOUND = OutboundDispatcher()
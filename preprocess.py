@@ -0,0 +1,106 @@
+import os
+import re
+from collections import Counter
+from typing import List, Optional
+
+# ================= تجهيز النص قبل إرساله للنموذج =================
+# تمريرة واحدة لتوحيد المسافات مع الحفاظ على حدود الفقرات، ثم حذف الترويسات
+# والتذييلات وأرقام الشرائح المتكررة عبر الصفحات (الصفحات مفصولة بالرمز \f).
+
+ARABIC_NORMALIZE = os.getenv("PREPROCESS_ARABIC_NORMALIZE", "0") == "1"
+EDGE_LINES = 3            # عدد الأسطر التي تُفحص في أعلى وأسفل كل صفحة
+REPEAT_RATIO = 0.5        # السطر يُعد ترويسة إن ظهر في نصف الصفحات على الأقل
+MIN_PAGES = 3
+
+# فواصل أسطر تحتاج تعديلاً | مسافات أفقية ليست مسافة واحدة عادية
+# (المسافة المفردة والسطر الجديد المجرد لا يطابقان، فلا يُستدعى _ws إلا عند الحاجة)
+_H = r"[ \t\xa0\u200b\u200e\u200f\ufeff]"
+_WS_RE = re.compile(
+    rf"(?P<v>{_H}*\n{_H}*(?:\n{_H}*)+|{_H}+\n{_H}*|\n{_H}+)"
+    rf"|(?P<h>(?: {_H}|[\t\xa0\u200b\u200e\u200f\ufeff]){_H}*)"
+)
+_PAGE_NO_RE = re.compile(
+    r"^(?:(?:page|slide|p\.|صفحة|شريحة)\s*)?[#\d٠-٩]+(?:\s*(?:/|of|من)\s*[#\d٠-٩]+)?$",
+    re.IGNORECASE,
+)
+
+_ARABIC_RE = re.compile(r"[\u0600-\u06FF]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+DETECT_SAMPLE = 6000      # حروف من بداية النص ووسطه ونهايته
+DETECT_AR_SHARE = 0.3     # المحاضرات العربية تحوي مصطلحات إنجليزية كثيرة
+
+# حذف التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة
+_AR_TABLE = str.maketrans({
+    **{chr(c): None for c in range(0x064B, 0x0653)},
+    "\u0640": None,
+    "أ": "ا", "إ": "ا", "آ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+})
+
+
+def _ws(m: "re.Match") -> str:
+    if m.group("h") is not None:
+        return " "
+    return "\n\n" if m.group("v").count("\n") > 1 else "\n"
+
+
+def normalize(text: str, arabic: bool = ARABIC_NORMALIZE) -> str:
+    """توحيد المسافات في تمريرة واحدة؛ السطر الفارغ بين فقرتين يبقى فاصلاً للفقرات"""
+    if arabic:
+        text = text.translate(_AR_TABLE)
+    return _WS_RE.sub(_ws, text.replace("\r\n", "\n")).strip()
+
+
+def _line_key(line: str) -> str:
+    # تطابق حرفي حتى للأسطر ذات الأرقام ("body 3 text" ليس ترويسة)؛ "Page 3 of 20" يلتقطه _PAGE_NO_RE
+    return line.strip().lower()
+
+
+def _edge_indexes(lines: List[str]) -> List[int]:
+    """أطراف الصفحة؛ لا شيء في الصفحة القصيرة (كل أسطرها أطراف، ومنها المحتوى)"""
+    filled = [i for i, ln in enumerate(lines) if ln.strip()]
+    if len(filled) <= 2 * EDGE_LINES:
+        return []
+    edges = filled[:EDGE_LINES] + filled[-EDGE_LINES:]
+    return sorted(set(edges))
+
+
+def strip_repeated(pages: List[str]) -> List[str]:
+    """حذف الأسطر المتكررة في أطراف الصفحات (ترويسات، تذييلات، أرقام صفحات)"""
+    split = [p.split("\n") for p in pages]
+    counts: Counter = Counter()
+    for lines in split:
+        counts.update({_line_key(lines[i]) for i in _edge_indexes(lines)})
+
+    threshold = max(MIN_PAGES, int(len(pages) * REPEAT_RATIO))
+    repeated = {k for k, n in counts.items() if n >= threshold} if len(pages) >= MIN_PAGES else set()
+
+    out = []
+    for lines in split:
+        drop = {i for i in _edge_indexes(lines)
+                if _line_key(lines[i]) in repeated or _PAGE_NO_RE.match(lines[i].strip())}
+        out.append("\n".join(ln for i, ln in enumerate(lines) if i not in drop))
+    return out
+
+
+def clean_text(text: str, arabic: bool = ARABIC_NORMALIZE) -> str:
+    """النص الجاهز للنموذج: بدون ترويسات متكررة، والفقرات مفصولة بسطر فارغ"""
+    if not text:
+        return ""
+    pages = [normalize(p, arabic) for p in text.split("\f")]
+    pages = strip_repeated([p for p in pages if p])
+    # كل صفحة فقرة مستقلة حتى يقسم _split_text على حدودها
+    return normalize("\n\n".join(pages), arabic=False)
+
+
+def detect_lang(text: str) -> Optional[str]:
+    """لغة المحتوى من نسبة الحروف العربية إلى اللاتينية؛ None إن لم تكفِ الحروف"""
+    n = len(text)
+    if n > 3 * DETECT_SAMPLE:
+        mid = n // 2 - DETECT_SAMPLE // 2
+        text = text[:DETECT_SAMPLE] + text[mid:mid + DETECT_SAMPLE] + text[-DETECT_SAMPLE:]
+    ar, la = len(_ARABIC_RE.findall(text)), len(_LATIN_RE.findall(text))
+    if ar + la < 50:
+        return None
+    return "ar" if ar >= DETECT_AR_SHARE * (ar + la) else "en"
@@ -0,0 +1,207 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# ================= التشخيص عند الطلب (/profile) =================
+# لا شيء يعمل عندما يكون المُشخِّص متوقفاً: خيط العيّنات ومراقب الحلقة وغلاف
+# المعالجات وtracemalloc تُنشأ عند البدء وتُزال عند الانتهاء.
+#
+# - عينات CPU: خيط يقرأ مكدس الخيط الرئيسي كل PROFILE_INTERVAL_MS
+# - توقف الحلقة: نبضة من الحلقة كل 20ms؛ إن تأخرت أكثر من PROFILE_STALL_MS
+#   يُسجَّل مكدس الخيط الرئيسي لحظتها (سبب التوقف)
+# - زمن كل معالج، ولقطتا tracemalloc في البداية والنهاية
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 10))
+PROFILE_STALL_MS = float(os.getenv("PROFILE_STALL_MS", 100))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 600))
+HEARTBEAT = 0.02
+IDLE_FRAMES = {"select", "poll", "epoll", "kqueue", "control"}
+TOP = 15
+
+
+def _pct(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def _stack(frame) -> List[str]:
+    out = []
+    while frame is not None:
+        out.append(_frame_key(frame))
+        frame = frame.f_back
+    return out[::-1]
+
+
+class Profiler:
+    def __init__(self):
+        self.active = False
+        self.started = 0.0
+        self._main_ident = None
+        self._thread: Optional[threading.Thread] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._beat = 0.0
+        self._wrapped = []
+        self._snapshot = None
+        self._own_tracing = False
+        self.samples: Counter = Counter()
+        self.idle = 0
+        self.stalls: List = []
+        self.handlers: Dict[str, List[float]] = defaultdict(list)
+
+    # ---------- البدء والإيقاف ----------
+    def start(self, application) -> None:
+        import tracemalloc
+
+        self.active = True
+        self.started = time.monotonic()
+        self.samples, self.stalls, self.handlers = Counter(), [], defaultdict(list)
+        self.idle = 0
+        self._main_ident = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+
+        self._own_tracing = not tracemalloc.is_tracing()
+        if self._own_tracing:
+            tracemalloc.start(10)
+        self._snapshot = tracemalloc.take_snapshot()
+        self._wrap_handlers(application)
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, application) -> str:
+        """إيقاف كل شيء وإرجاع التقرير النصي"""
+        import tracemalloc
+
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        self._unwrap_handlers()
+        # بدون تخصيصات المُشخِّص نفسه
+        own = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+               tracemalloc.Filter(False, threading.__file__)]
+        diff = (tracemalloc.take_snapshot().filter_traces(own)
+                .compare_to(self._snapshot.filter_traces(own), "lineno")) if self._snapshot else []
+        current, peak = tracemalloc.get_traced_memory()
+        if self._own_tracing:
+            tracemalloc.stop()
+        self._snapshot = None
+        self.active = False
+        return self._report(diff, current, peak)
+
+    # ---------- الجمع ----------
+    def _sample(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        stall_s = PROFILE_STALL_MS / 1000
+        in_stall = False
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self._main_ident)
+            if frame is None:
+                continue
+            lag = time.monotonic() - self._beat
+            # الحلقة تنتظر أحداثاً (select): وقت خامل لا يدخل في الإحصاء
+            if frame.f_code.co_name in IDLE_FRAMES and lag <= stall_s:
+                self.idle += 1
+                in_stall = False
+                continue
+            stack = _stack(frame)
+            self.samples[";".join(stack)] += 1
+            if lag > stall_s and not in_stall:
+                # أول عينة داخل التوقف: هذا المكدس هو ما يحجز الحلقة
+                self.stalls.append([datetime.now().strftime("%H:%M:%S"), lag, stack])
+                in_stall = True
+            elif lag > stall_s:
+                self.stalls[-1][1] = lag
+            else:
+                in_stall = False
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(HEARTBEAT)
+
+    def _wrap_handlers(self, application):
+        def timed(name, callback):
+            async def wrapper(update, context):
+                t0 = time.perf_counter()
+                try:
+                    return await callback(update, context)
+                finally:
+                    self.handlers[name].append(time.perf_counter() - t0)
+            return wrapper
+
+        for handlers in application.handlers.values():
+            for h in handlers:
+                self._wrapped.append((h, h.callback))
+                h.callback = timed(getattr(h.callback, "__name__", "handler"), h.callback)
+
+    def _unwrap_handlers(self):
+        for h, callback in self._wrapped:
+            h.callback = callback
+        self._wrapped = []
+
+    # ---------- التقرير ----------
+    def _report(self, mem_diff, mem_current: int, mem_peak: int) -> str:
+        seconds = time.monotonic() - self.started
+        total = sum(self.samples.values()) or 1
+        own, cumulative = Counter(), Counter()
+        for stack, n in self.samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += n
+            for f in set(frames):
+                cumulative[f] += n
+
+        busy = 100 * sum(self.samples.values()) / max(1, sum(self.samples.values()) + self.idle)
+        lines = [f"Profile {datetime.now().isoformat(timespec='seconds')}  window={seconds:.0f}s  "
+                 f"samples={total} every {PROFILE_INTERVAL_MS:.0f}ms  loop busy={busy:.1f}%", ""]
+        lines.append(f"== CPU: self time (top {TOP}) ==")
+        lines += [f"{100 * n / total:6.1f}%  {f}" for f, n in own.most_common(TOP)]
+        lines.append("")
+        lines.append(f"== CPU: cumulative (top {TOP}) ==")
+        lines += [f"{100 * n / total:6.1f}%  {f}" for f, n in cumulative.most_common(TOP)]
+        lines.append("")
+
+        lines.append("== Handlers ==")
+        for name, vals in sorted(self.handlers.items(), key=lambda kv: -sum(kv[1])):
+            lines.append(f"{name:28s} n={len(vals):5d} p50={_pct(vals, .5) * 1e3:8.1f}ms "
+                         f"p95={_pct(vals, .95) * 1e3:8.1f}ms max={max(vals) * 1e3:8.1f}ms")
+        lines.append("")
+
+        lines.append(f"== Event-loop stalls > {PROFILE_STALL_MS:.0f}ms: {len(self.stalls)} ==")
+        for when, lag, stack in sorted(self.stalls, key=lambda s: -s[1])[:5]:
+            lines.append(f"{when}  {lag * 1e3:.0f}ms")
+            lines += [f"    {f}" for f in stack[-8:]]
+        lines.append("")
+
+        lines.append(f"== Memory: current={mem_current / 2 ** 20:.1f}MB peak={mem_peak / 2 ** 20:.1f}MB, "
+                     f"growth by line (top 10) ==")
+        for stat in mem_diff[:10]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:+9.1f}KB  {os.path.basename(frame.filename)}:{frame.lineno}")
+        lines.append("")
+
+        lines.append("== Collapsed stacks (flamegraph.pl) ==")
+        lines += [f"{stack} {n}" for stack, n in self.samples.most_common()]
+        return "\n".join(lines)
+
+    def summary(self, report: str) -> str:
+        """رسالة قصيرة قبل الملف: الرأس، وقت CPU الذاتي، المعالجات، وعدد التوقفات"""
+        sections = report.split("\n\n")
+        stalls = sections[4].splitlines()[0]
+        return "\n\n".join([sections[0], sections[1], sections[3], stalls])[:3500]
+
+
+PROFILER = Profiler()
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Dict, List, Optional
+
+# ================= توجيه طلبات النموذج بين عدة مزوّدين =================
+# كل مزوّد نقطة نهاية متوافقة مع OpenAI (chat/completions). نتتبع زمن الاستجابة
+# والأخطاء لكل مزوّد، ونرسل طلباً احتياطياً (hedge) للمزوّد التالي إذا تجاوز
+# الأول زمن p95 المعتاد له؛ أول رد ناجح يفوز ويُلغى الآخر.
+#
+# LLM_PROVIDERS='[{"name":"groq","url":"https://api.groq.com/openai/v1/chat/completions",
+#                  "model":"openai/gpt-oss-120b","api_key_env":"GROQ_API_KEY"}, ...]'
+
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+HEDGE_MIN = float(os.getenv("LLM_HEDGE_MIN", 2.0))          # ثوانٍ
+HEDGE_MAX = float(os.getenv("LLM_HEDGE_MAX", 60.0))
+HEDGE_DEFAULT = float(os.getenv("LLM_HEDGE_DEFAULT", 20.0))  # قبل توفر عينات كافية
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 300))
+WINDOW = 100
+MIN_SAMPLES = 5
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Provider:
+    def __init__(self, name: str, url: str, model: str, api_key: Optional[str]):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.latencies = deque(maxlen=WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.hedges_won = 0
+
+    def record(self, seconds: Optional[float]):
+        self.requests += 1
+        if seconds is None:
+            self.errors += 1
+            self.consecutive_errors += 1
+        else:
+            self.consecutive_errors = 0
+            self.latencies.append(seconds)
+
+    def p(self, q: float) -> Optional[float]:
+        return _percentile(self.latencies, q) if len(self.latencies) >= MIN_SAMPLES else None
+
+    def hedge_delay(self) -> float:
+        p95 = self.p(0.95)
+        if p95 is None:
+            return HEDGE_DEFAULT
+        return max(HEDGE_MIN, min(HEDGE_MAX, p95))
+
+    def score(self) -> float:
+        # الأسرع أولاً؛ كل خطأ متتالٍ يؤخر المزوّد في الترتيب
+        p50 = self.p(0.5)
+        return (p50 if p50 is not None else HEDGE_DEFAULT / 2) * (1 + 2 * self.consecutive_errors)
+
+    def snapshot(self) -> Dict:
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "errors": self.errors,
+            "p50": self.p(0.5),
+            "p95": self.p(0.95),
+            "hedges_won": self.hedges_won,
+        }
+
+
+def load_providers() -> List[Provider]:
+    raw = os.getenv("LLM_PROVIDERS")
+    if raw:
+        specs = json.loads(raw)
+    else:
+        specs = [{"name": "groq", "url": GROQ_URL,
+                  "model": os.getenv("GROQ_MODEL", "openai/gpt-oss-120b"),
+                  "api_key_env": "GROQ_API_KEY"}]
+    providers = []
+    for spec in specs:
+        key = os.getenv(spec["api_key_env"]) if spec.get("api_key_env") else spec.get("api_key")
+        # مزوّد بدون مفتاح لا يُستخدم (إلا إن صُرّح بأنه لا يحتاج مفتاحاً)
+        if not key and not spec.get("no_auth"):
+            continue
+        providers.append(Provider(spec["name"], spec["url"], spec["model"], key))
+    return providers
+
+
+class ProviderRouter:
+    def __init__(self, providers: Optional[List[Provider]] = None, hedge: bool = True):
+        self.providers = load_providers() if providers is None else providers
+        self.hedge = hedge
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def fingerprint(self) -> str:
+        """النماذج التي قد تجيب أي طلب (أي مزوّد يفوز): مفتاح ما يُحفظ من ردودها"""
+        return "+".join(sorted({p.model for p in self.providers}))
+
+    def ranked(self) -> List[Provider]:
+        return sorted(self.providers, key=lambda p: p.score())
+
+    async def _call(self, prov: Provider, payload: Dict) -> Dict:
+        headers = {"Authorization": f"Bearer {prov.api_key}"} if prov.api_key else {}
+        t0 = time.monotonic()
+        try:
+            r = await self._http().post(prov.url, headers=headers, json={**payload, "model": prov.model})
+            r.raise_for_status()
+            data = r.json()
+        except asyncio.CancelledError:
+            # الطلب الخاسر في السباق: لا يُحسب خطأً
+            raise
+        except Exception:
+            prov.record(None)
+            raise
+        prov.record(time.monotonic() - t0)
+        return data
+
+    async def chat(self, payload: Dict) -> Dict:
+        """يُرجع رد chat/completions من أول مزوّد ينجح"""
+        order = self.ranked()
+        if not order:
+            raise RuntimeError("no LLM provider configured")
+        pending = order[1:]
+        tasks = {asyncio.ensure_future(self._call(order[0], payload)): order[0]}
+        last_exc: Optional[BaseException] = None
+        try:
+            while tasks:
+                # ننتظر حتى p95 الخاص بأبطأ طلب جارٍ قبل إطلاق طلب احتياطي
+                delay = max(p.hedge_delay() for p in tasks.values()) if (self.hedge and pending) else None
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    nxt = pending.pop(0)
+                    tasks[asyncio.ensure_future(self._call(nxt, payload))] = nxt
+                    continue
+                for t in done:
+                    prov = tasks.pop(t)
+                    if t.exception() is None:
+                        if prov is not order[0]:
+                            prov.hedges_won += 1
+                        return t.result()
+                    last_exc = t.exception()
+                # كل الطلبات الجارية فشلت: جرّب المزوّد التالي فوراً
+                if not tasks and pending:
+                    nxt = pending.pop(0)
+                    tasks[asyncio.ensure_future(self._call(nxt, payload))] = nxt
+        finally:
+            for t in tasks:
+                t.cancel()
+        raise last_exc
+
+    def stats(self) -> List[Dict]:
+        return [p.snapshot() for p in self.providers]
+
+
+ROUTER = ProviderRouter()
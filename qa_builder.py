@@ -36,11 +36,11 @@ def _normalize_item(it: Dict, lang: str) -> Dict:
         c = 0
     c = max(0, min(c, len(opts) - 1))
 
-    return {"type": t, "question": q, "options": opts, "correct": c}
+    return {"type": t, "question": q, "options": opts, "correct": c, "chunk": int(it.get("chunk", 0))}
 
 
-async def build_quiz_from_text(text: str, lang: str = "ar") -> List[Dict]:
-    items = await ask_llm_big(text, lang=lang)
+async def build_quiz_from_text(text: str, lang: str = "ar", total: int = None, mcq_ratio: float = 0.7) -> List[Dict]:
+    items = await ask_llm_big(text, lang=lang, target_total=total, mcq_ratio=mcq_ratio)
     cleaned = []
     seen_q = set()
 
@@ -61,4 +61,4 @@ async def build_quiz_from_text(text: str, lang: str = "ar") -> List[Dict]:
 
     random.shuffle(cleaned)
     # خذ العدد المطلوب أو أقل عند الحاجة
-    return cleaned
+    return cleaned[:total] if total else cleaned
@@ -0,0 +1,211 @@
+import os
+import json
+import zlib
+import random
+import sqlite3
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# ================= بنك الأسئلة الدائم =================
+# الأسئلة المولدة تُحفظ مفهرسة بـ (بصمة الملف، لغة الأسئلة، رقم المقطع)
+# لإعادة الاختبار لاحقاً دون أي استدعاء للذكاء الاصطناعي.
+
+BANK_DB = os.getenv("QUESTION_BANK_DB", "question_bank.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    doc_hash TEXT NOT NULL,
+    lang     TEXT NOT NULL,
+    qid      INTEGER NOT NULL,
+    chunk    INTEGER NOT NULL DEFAULT 0,
+    body     BLOB NOT NULL,
+    PRIMARY KEY (doc_hash, lang, qid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS questions_chunk ON questions (doc_hash, lang, chunk);
+
+CREATE TABLE IF NOT EXISTS user_docs (
+    user_id  INTEGER NOT NULL,
+    doc_hash TEXT NOT NULL,
+    lang     TEXT NOT NULL,
+    filename TEXT,
+    updated  TEXT NOT NULL,
+    qids     TEXT,
+    PRIMARY KEY (user_id, doc_hash, lang)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_docs_recent ON user_docs (user_id, updated);
+
+CREATE TABLE IF NOT EXISTS wrong_answers (
+    user_id  INTEGER NOT NULL,
+    doc_hash TEXT NOT NULL,
+    lang     TEXT NOT NULL,
+    qid      INTEGER NOT NULL,
+    PRIMARY KEY (user_id, doc_hash, lang, qid)
+) WITHOUT ROWID;
+"""
+
+_conn: Optional[sqlite3.Connection] = None
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(BANK_DB, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.executescript(_SCHEMA)
+        # قواعد أُنشئت قبل حفظ أسئلة آخر اختبار لكل مستخدم
+        if "qids" not in {r[1] for r in _conn.execute("PRAGMA table_info(user_docs)")}:
+            _conn.execute("ALTER TABLE user_docs ADD COLUMN qids TEXT")
+    return _conn
+
+
+HASH_CHUNK = 1024 * 1024
+
+
+def doc_hasher():
+    """مفتاح الملف (sha256) يُحسب على دفعات: أثناء التحميل (downloads) أو قراءة الملف"""
+    return hashlib.sha256()
+
+
+def doc_hash_file(path: str) -> str:
+    digest = doc_hasher()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pack(q: Dict) -> bytes:
+    # صيغة مضغوطة: [type, question, options, correct]
+    row = [q["type"], q["question"], q["options"], int(q["correct"])]
+    return zlib.compress(json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob: bytes, chunk: int) -> Dict:
+    t, question, options, correct = json.loads(zlib.decompress(blob))
+    return {"type": t, "question": question, "options": options, "correct": correct, "chunk": chunk}
+
+
+def _question_key(question: str) -> str:
+    return " ".join(question.casefold().split())
+
+
+def store(dhash: str, lang: str, questions: List[Dict]) -> List[int]:
+    """يضيف أسئلة الملف بهذه اللغة ويُرجع أرقامها (qid) بنفس الترتيب.
+    الأسئلة الموجودة تحتفظ بأرقامها (أخطاء المستخدمين وآخر اختباراتهم تشير إليها)"""
+    db = _db()
+    with db:
+        db.execute("BEGIN")
+        known = {}
+        for qid, chunk, body in db.execute(
+                "SELECT qid, chunk, body FROM questions WHERE doc_hash = ? AND lang = ?", (dhash, lang)):
+            known[_question_key(_unpack(body, chunk)["question"])] = qid
+        next_qid = max(known.values(), default=-1) + 1
+        qids, rows = [], []
+        for q in questions:
+            key = _question_key(q["question"])
+            if key not in known:
+                known[key] = next_qid
+                rows.append((dhash, lang, next_qid, int(q.get("chunk", 0)), _pack(q)))
+                next_qid += 1
+            qids.append(known[key])
+        db.executemany("INSERT INTO questions (doc_hash, lang, qid, chunk, body) VALUES (?, ?, ?, ?, ?)", rows)
+    return qids
+
+
+def count(dhash: str, lang: str) -> int:
+    return _db().execute(
+        "SELECT COUNT(*) FROM questions WHERE doc_hash = ? AND lang = ?", (dhash, lang)
+    ).fetchone()[0]
+
+
+def load(dhash: str, lang: str, qids: Optional[List[int]] = None) -> Tuple[List[int], List[Dict]]:
+    db = _db()
+    if qids is None:
+        rows = db.execute(
+            "SELECT qid, chunk, body FROM questions WHERE doc_hash = ? AND lang = ? ORDER BY qid",
+            (dhash, lang),
+        ).fetchall()
+    else:
+        marks = ",".join("?" * len(qids))
+        rows = db.execute(
+            f"SELECT qid, chunk, body FROM questions WHERE doc_hash = ? AND lang = ? AND qid IN ({marks}) ORDER BY qid",
+            (dhash, lang, *qids),
+        ).fetchall()
+    return [r[0] for r in rows], [_unpack(r[2], r[1]) for r in rows]
+
+
+# ================= ربط المستخدم بملفاته وأخطائه =================
+def remember_doc(user_id: int, dhash: str, lang: str, filename: str, qids: List[int]) -> None:
+    """qids = أسئلة الاختبار الذي قُدّم للمستخدم بترتيبه (يعيده /retake)"""
+    _db().execute(
+        "INSERT OR REPLACE INTO user_docs (user_id, doc_hash, lang, filename, updated, qids) VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, dhash, lang, filename, datetime.now().isoformat(), json.dumps(qids)),
+    )
+
+
+def last_doc(user_id: int) -> Optional[Tuple[str, str, str, Optional[List[int]]]]:
+    """آخر ملف اختبر فيه المستخدم: (doc_hash, lang, filename, qids)؛ qids = None للسجلات القديمة"""
+    row = _db().execute(
+        "SELECT doc_hash, lang, filename, qids FROM user_docs WHERE user_id = ? ORDER BY updated DESC LIMIT 1",
+        (user_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], row[2], json.loads(row[3]) if row[3] else None
+
+
+def record_answer(user_id: int, dhash: str, lang: str, qid: int, correct: bool) -> None:
+    if correct:
+        _db().execute(
+            "DELETE FROM wrong_answers WHERE user_id = ? AND doc_hash = ? AND lang = ? AND qid = ?",
+            (user_id, dhash, lang, qid),
+        )
+    else:
+        _db().execute(
+            "INSERT OR IGNORE INTO wrong_answers (user_id, doc_hash, lang, qid) VALUES (?, ?, ?, ?)",
+            (user_id, dhash, lang, qid),
+        )
+
+
+def record_answers(answers: List[Tuple[int, str, str, int, bool]]) -> None:
+    """دفعة إجابات (user_id, doc_hash, lang, qid, correct) في معاملة واحدة"""
+    db = _db()
+    with db:
+        db.execute("BEGIN")
+        for user_id, dhash, lang, qid, correct in answers:
+            record_answer(user_id, dhash, lang, qid, correct)
+
+
+def wrong_qids(user_id: int, dhash: str, lang: str) -> List[int]:
+    rows = _db().execute(
+        "SELECT qid FROM wrong_answers WHERE user_id = ? AND doc_hash = ? AND lang = ? ORDER BY qid",
+        (user_id, dhash, lang),
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def quiz_for_user(user_id: int, mode: str) -> Optional[Dict]:
+    """أسئلة إعادة الاختبار: mode = retake | shuffle | wrong"""
+    doc = last_doc(user_id)
+    if not doc:
+        return None
+    dhash, lang, filename, served = doc
+    if mode == "wrong":
+        wanted = wrong_qids(user_id, dhash, lang)
+        if not wanted:
+            return {"doc_hash": dhash, "lang": lang, "filename": filename, "qids": [], "questions": []}
+        qids, questions = load(dhash, lang, wanted)
+    elif served:
+        # نفس الاختبار بنفس الترتيب، لا كل البنك (قد يكون ولّده مستخدم آخر بعدد أكبر)
+        found = dict(zip(*load(dhash, lang, served)))
+        qids = [qid for qid in served if qid in found]
+        questions = [found[qid] for qid in qids]
+    else:
+        qids, questions = load(dhash, lang)
+    if mode == "shuffle":
+        order = list(range(len(qids)))
+        random.shuffle(order)
+        qids = [qids[i] for i in order]
+        questions = [questions[i] for i in order]
+    return {"doc_hash": dhash, "lang": lang, "filename": filename, "qids": qids, "questions": questions}
@@ -0,0 +1,200 @@
+import os
+import time
+import uuid
+import asyncio
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+# ================= دورة حياة الجلسات =================
+# كل جلسة لها مهلة خمول حسب مرحلتها، ومجموع حجم الجلسات في الذاكرة محدود
+# بـ SESSION_MEMORY_MB؛ عند تجاوزه تُطرد الأقدم نشاطاً أولاً (LRU).
+# مع مخزن مشترك (state_store) لا تبقى الجلسات في ذاكرة العملية: كل قراءة وكتابة
+# تمر عبره، والمهلة يطبقها المخزن نفسه ثم يسلّم المنتهية لمهمة التنظيف في عملية واحدة.
+
+SESSION_TTL_PENDING = int(os.getenv("SESSION_TTL_PENDING", 15 * 60))        # انتظار اختيار اللغة
+SESSION_TTL_PROCESSING = int(os.getenv("SESSION_TTL_PROCESSING", 30 * 60))  # استخراج وتوليد
+SESSION_TTL_QUIZ = int(os.getenv("SESSION_TTL_QUIZ", 2 * 60 * 60))          # اختبار جارٍ
+SESSION_MEMORY_MB = float(os.getenv("SESSION_MEMORY_MB", 256))
+SWEEP_SECONDS = int(os.getenv("SESSION_SWEEP_SECONDS", 60))
+# أطول مدة قد تحتاج فيها جلسة حية ملفها المرفوع: await_lang ثم await_question_lang ثم processing،
+# وكل مرحلة تبدأ مهلتها من جديد؛ الملفات الأقدم منها بلا جلسة تُحذف (مع هامش لدورة التنظيف)
+UPLOAD_MAX_AGE = 2 * SESSION_TTL_PENDING + SESSION_TTL_PROCESSING + 5 * 60
+LOCK_POLL_MIN, LOCK_POLL_MAX = 0.005, 0.1  # انتظار قفل محادثة تمسكه عملية أخرى
+
+STAGE_TTLS = {
+    "await_lang": SESSION_TTL_PENDING,
+    "await_question_lang": SESSION_TTL_PENDING,
+    "processing": SESSION_TTL_PROCESSING,
+    "quiz": SESSION_TTL_QUIZ,
+}
+
+
+def estimate_bytes(sess: Dict) -> int:
+    """تقدير تقريبي لحجم الجلسة: الأسئلة + جداول الإجابات (الملف نفسه على القرص)"""
+    n = 512
+    for q in sess.get("questions") or []:
+        n += 200 + 2 * (len(q["question"]) + sum(len(o) for o in q["options"]))
+    n += 150 * (len(sess.get("answers") or {}) + len(sess.get("poll_qids") or {}))
+    n += 100 * len(sess.get("scores") or {})
+    n += 60 * sum(len(v) for v in (sess.get("voters") or {}).values())
+    return n
+
+
+class SessionStore:
+    """الجلسات بترتيب آخر نشاط. الواجهة غير متزامنة: مع المخزن المشترك كل قراءة وكتابة
+    تُنفذ في خيط المخزن (state_store.AsyncState)، وفي الذاكرة تعود فوراً"""
+
+    def __init__(self, memory_mb: float = SESSION_MEMORY_MB, backend=None):
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self.touched: Dict[int, float] = {}
+        self.backend = backend
+        self._mem: "OrderedDict[int, Dict]" = OrderedDict()
+        self._locks = weakref.WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+    async def put(self, chat_id, sess: Dict) -> None:
+        # sid يميز الجلسة عن بديلتها حتى بعد قراءتها من المخزن المشترك (نسخة جديدة في كل get)
+        sess.setdefault("sid", uuid.uuid4().hex)
+        if self.backend is not None:
+            await self.backend.put_session(chat_id, sess)
+            return
+        self._mem[chat_id] = sess
+        self.touch(chat_id)
+
+    async def exists(self, chat_id) -> bool:
+        if self.backend is not None:
+            return await self.backend.get_session(chat_id) is not None
+        return chat_id in self._mem
+
+    async def pop(self, chat_id, default=None):
+        if self.backend is not None:
+            sess = await self.backend.get_session(chat_id)
+            await self.backend.delete_session(chat_id)
+            return default if sess is None else sess
+        self.touched.pop(chat_id, None)
+        return self._mem.pop(chat_id, default)
+
+    async def get(self, chat_id, default=None):
+        if self.backend is not None:
+            sess = await self.backend.get_session(chat_id)
+            return default if sess is None else sess
+        sess = self._mem.get(chat_id, default)
+        if sess is not default:
+            self.touch(chat_id)
+        return sess
+
+    async def save(self, chat_id, sess: Dict) -> None:
+        """بعد تعديل الجلسة في مكانها؛ في الذاكرة لا شيء لحفظه"""
+        if self.backend is not None:
+            await self.backend.put_session(chat_id, sess)
+        else:
+            self.touch(chat_id)
+
+    async def transition(self, chat_id, expected: str, new: str, **fields) -> Optional[Dict]:
+        """نقل الجلسة من مرحلة لأخرى بشكل ذري؛ None إن لم تكن في expected"""
+        if self.backend is not None:
+            return await self.backend.transition(chat_id, expected, new, fields)
+        sess = await self.get(chat_id)
+        if not sess or sess.get("stage") != expected:
+            return None
+        sess.update(fields, stage=new)
+        return sess
+
+    async def is_current(self, chat_id, sess: Dict) -> bool:
+        """هل ما زالت sess هي جلسة المحادثة (لم تُلغَ أو تُستبدل أثناء انتظار)"""
+        cur = await self.get(chat_id)
+        return cur is sess or (cur is not None and cur.get("sid") == sess.get("sid"))
+
+    @asynccontextmanager
+    async def lock(self, chat_id):
+        """قفل المحادثة لتعديل قراءة-ثم-كتابة؛ مع المخزن المشترك يشمل كل العمليات"""
+        local = self._locks.get(chat_id)
+        if local is None:
+            local = asyncio.Lock()
+            self._locks[chat_id] = local
+        async with local:
+            if self.backend is None:
+                yield
+                return
+            name = f"chat:{chat_id}"
+            # قفل عملية ماتت يسقط بانتهاء مهلته فلا انتظار بلا نهاية؛ الانتظار يتضاعف حتى LOCK_POLL_MAX
+            delay = LOCK_POLL_MIN
+            while (token := await self.backend.acquire(name)) is None:
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, LOCK_POLL_MAX)
+            try:
+                yield
+            finally:
+                await self.backend.release(name, token)
+
+    def touch(self, chat_id) -> None:
+        if chat_id in self._mem:
+            self.touched[chat_id] = time.monotonic()
+            self._mem.move_to_end(chat_id)
+
+    async def expired(self, now: Optional[float] = None) -> List[Tuple[int, Dict]]:
+        """الجلسات التي تجاوزت مهلة الخمول الخاصة بمرحلتها، مُزالة من المخزن ومعها محتواها؛
+        مع المخزن المشترك تصل كل جلسة لعملية واحدة فقط"""
+        if self.backend is not None:
+            return await self.backend.claim_expired()
+        now = time.monotonic() if now is None else now
+        out = []
+        for chat_id, sess in self._mem.items():
+            ttl = STAGE_TTLS.get(sess.get("stage"), SESSION_TTL_PENDING)
+            if now - self.touched.get(chat_id, now) > ttl:
+                out.append((chat_id, sess))
+        for chat_id, _ in out:
+            self._mem.pop(chat_id, None)
+            self.touched.pop(chat_id, None)
+        return out
+
+    def local(self) -> List[Dict]:
+        """جلسات ذاكرة هذه العملية (فارغة مع المخزن المشترك)"""
+        return list(self._mem.values())
+
+    def memory_bytes(self) -> int:
+        return sum(estimate_bytes(s) for s in self._mem.values())
+
+    def over_budget(self, keep: Optional[int] = None) -> List[int]:
+        """الأقدم نشاطاً أولاً حتى يعود المجموع تحت الميزانية (keep لا تُطرد).
+        مع المخزن المشترك لا جلسات في ذاكرة العملية فالقائمة فارغة دائماً"""
+        total = self.memory_bytes()
+        out = []
+        for chat_id, sess in self._mem.items():
+            if total <= self.memory_budget:
+                break
+            if chat_id == keep:
+                continue
+            total -= estimate_bytes(sess)
+            out.append(chat_id)
+        return out
+
+
+class PollRoutes:
+    """poll_id -> chat_id؛ مع المخزن المشترك تصل إجابة الاستطلاع لأي عملية"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._mem: Dict[str, int] = {}
+
+    async def set(self, poll_id, chat_id) -> None:
+        if self.backend is not None:
+            await self.backend.set_route(poll_id, chat_id)
+        else:
+            self._mem[poll_id] = chat_id
+
+    async def get(self, poll_id, default=None):
+        if self.backend is not None:
+            chat_id = await self.backend.get_route(poll_id)
+            return default if chat_id is None else chat_id
+        return self._mem.get(poll_id, default)
+
+    async def pop(self, poll_id, default=None):
+        if self.backend is not None:
+            await self.backend.delete_route(poll_id)
+            return default
+        return self._mem.pop(poll_id, default)
@@ -0,0 +1,116 @@
+import os
+import re
+import time
+import asyncio
+from typing import Dict, Optional
+
+import llm
+import question_bank
+from ingest import extract_text_detail
+from preprocess import clean_text, detect_lang
+
+# ================= معالجة مسبقة أثناء أزرار اللغة =================
+# بمجرد وصول الملف يبدأ الاستخراج (وOCR) بلغة مُخمّنة، ثم تُكتشف لغة المحتوى من
+# نسبة الحروف العربية/اللاتينية، ثم يُطلب المقطع الأول من النموذج بلغة الأسئلة
+# المتوقعة (= لغة المحتوى). عند اختيار المستخدم:
+#   - النص يُستخدم إلا إذا مر عبر OCR بلغة غير التي اختارها
+#   - المقطع الأول يُستخدم إن طابق طلبه (llm._PREFETCH)، وإلا يُلغى
+# التخمين محلي لكل عملية: مع مخزن مشترك قد يصل الاختيار لعملية أخرى فتعالج كالمعتاد.
+
+SPECULATE = os.getenv("SPECULATE", "1") == "1"
+SPECULATE_LLM = os.getenv("SPECULATE_LLM", "1") == "1"
+MIN_TEXT = 400
+_ARABIC = re.compile(r"[\u0600-\u06FF]")
+
+
+def guess_lang(filename: str, language_code: Optional[str], default: str = "ar") -> str:
+    """لغة OCR قبل وجود أي نص: اسم الملف ثم لغة تيليجرام للمستخدم"""
+    if _ARABIC.search(filename or ""):
+        return "ar"
+    if language_code:
+        return "ar" if language_code.startswith("ar") else "en"
+    return default
+
+
+class Speculation:
+    def __init__(self, path: str, suffix: str, guess: str, doc_hash: str, quiz_size: int, mcq_ratio: float):
+        self.path, self.suffix, self.guess = path, suffix, guess
+        self.doc_hash, self.quiz_size, self.mcq_ratio = doc_hash, quiz_size, mcq_ratio
+        self.created = time.monotonic()
+        self.text: Optional[str] = None
+        self.ocr_lang: Optional[str] = None  # لغة OCR إن مر النص عبره
+        self.detected: Optional[str] = None
+        self.qlang: Optional[str] = None  # لغة الأسئلة التي طُلب بها المقطع الأول
+        self.llm_key = None
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> Optional[str]:
+        raw, used_ocr = await extract_text_detail(self.path, self.suffix, self.guess)
+        text = clean_text(raw)
+        detected = detect_lang(text)
+        ocr_lang = self.guess if used_ocr else None
+        if used_ocr and detected and detected != self.guess:
+            # التخمين خاطئ: OCR مرة ثانية باللغة المكتشفة (التي سيجدها المستخدم محددة)
+            raw, _ = await extract_text_detail(self.path, self.suffix, detected)
+            text, ocr_lang = clean_text(raw), detected
+        self.text, self.ocr_lang, self.detected = text, ocr_lang, detected
+
+        qlang = self.qlang = detected or self.guess
+        # بنك الأسئلة يكفي لهذا الملف بهذه اللغة: لا حاجة للنموذج
+        if SPECULATE_LLM and len(text) >= MIN_TEXT and question_bank.count(self.doc_hash, qlang) < self.quiz_size:
+            self.llm_key = llm.prefetch_first_chunk(text, qlang, self.quiz_size, self.mcq_ratio)
+        return detected
+
+    async def detection(self) -> Optional[str]:
+        try:
+            return await asyncio.shield(self.task)
+        except Exception:
+            return None
+
+    async def text_for(self, content_lang: str) -> Optional[str]:
+        """النص المستخرج مسبقاً إن صلح للغة المختارة؛ None = يُستخرج من جديد"""
+        try:
+            await asyncio.shield(self.task)
+        except Exception:
+            return None
+        if self.ocr_lang is not None and self.ocr_lang != content_lang:
+            return None
+        return self.text
+
+    def settle(self, text: str, question_lang: str) -> None:
+        """إلغاء الطلب المسبق فوراً إن لم يطابق ما سيُرسل فعلاً (نص آخر أو لغة أسئلة أخرى)"""
+        if text is not self.text or question_lang != self.qlang:
+            llm.cancel_prefetch(self.llm_key)
+
+    def cancel(self) -> None:
+        self.task.cancel()
+        llm.cancel_prefetch(self.llm_key)
+
+
+SPECULATIONS: Dict[str, Speculation] = {}  # sid الجلسة -> التخمين
+
+
+def start(sid: str, *args) -> Optional[Speculation]:
+    if not SPECULATE:
+        return None
+    discard(sid)
+    spec = SPECULATIONS[sid] = Speculation(*args)
+    return spec
+
+
+def take(sid: str) -> Optional[Speculation]:
+    return SPECULATIONS.pop(sid, None)
+
+
+def discard(sid: Optional[str]) -> None:
+    spec = SPECULATIONS.pop(sid, None)
+    if spec is not None:
+        spec.cancel()
+
+
+def sweep(max_age: float, keep=()) -> None:
+    """تخمينات لجلسات انتهت في عملية أخرى (مخزن مشترك)؛ keep = sid جلسات حية"""
+    now = time.monotonic()
+    keep = set(keep)
+    for sid in [s for s, spec in SPECULATIONS.items() if now - spec.created > max_age and s not in keep]:
+        discard(sid)
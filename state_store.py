@@ -0,0 +1,590 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from sessions import STAGE_TTLS, SESSION_TTL_PENDING, SESSION_TTL_QUIZ
+
+# ================= مخزن الحالة المشترك بين عدة عمليات =================
+# STATE_BACKEND:
+#   memory  (افتراضي) كل شيء في ذاكرة العملية كما كان؛ عملية واحدة فقط
+#   sqlite  ملف STATE_DB (WAL) لعدة عمليات على نفس الجهاز
+#   redis   REDIS_URL (أي خادم يتكلم بروتوكول Redis) لعدة أجهزة
+#
+# يحفظ الجلسات (مع مهلة حسب المرحلة) ومسارات الاستطلاعات وحالة المستخدمين.
+# انتقال المرحلة ذري (compare-and-set) وأقفال المحادثات مشتركة بين العمليات
+# حتى لا تضيع نقاط مجموعة تصلها إجابات على عمليتين في نفس اللحظة.
+# الجلسة المنتهية لا تختفي بصمت: claim_expired يسلّمها لعملية واحدة فقط
+# لتنهيها (إلغاء المعالجة، مؤقت السؤال التالي، إشعار المستخدم).
+# حدود مشتركة: كل عملية تسجل نبضها (heartbeat) وتأخذ GLOBAL_RATE / عدد العمليات الحية،
+# وensure_shared_dir يرفض التشغيل إن لم ترَ كل العمليات نفس مجلد الملفات المحلية
+# (bot_users.json والملفات المرفوعة). حد كل محادثة يبقى لكل عملية (RetryAfter يغطي الباقي).
+# البوت يستخدم المخزن عبر AsyncState: طلبات sqlite/redis المتزامنة في خيط خاص لا في حلقة الأحداث.
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+STATE_LOCK_TTL_MS = int(os.getenv("STATE_LOCK_TTL_MS", 10000))  # قفل عملية ماتت يسقط بعدها
+# Redis يبقي الجلسة بعد موعدها هذه المدة حتى تأخذها مهمة التنظيف (وإن توقفت كل العمليات قليلاً)
+STATE_EXPIRY_GRACE = int(os.getenv("STATE_EXPIRY_GRACE", 60 * 60))
+HEARTBEAT_SECONDS = int(os.getenv("STATE_HEARTBEAT_SECONDS", 10))  # عملية بلا نبض 3 مرات تُعد متوقفة
+SHARED_MARKER = ".quizbot-shared"
+
+
+def _ttl(sess: Dict) -> int:
+    return STAGE_TTLS.get(sess.get("stage"), SESSION_TTL_PENDING)
+
+
+def _encode(obj):
+    # JSON لا pickle: من يكتب في المخزن (Redis على الشبكة) لا ينفذ شيئاً في البوت.
+    # الجلسة فيها مجموعات (voters) ومفاتيح أرقام (scores/names) تُحفظ بوسم يعيدها كما كانت
+    if isinstance(obj, dict):
+        if all(isinstance(k, str) for k in obj):
+            return {k: _encode(v) for k, v in obj.items()}
+        return {"__items__": [[_encode(k), _encode(v)] for k, v in obj.items()]}
+    if isinstance(obj, (set, frozenset)):
+        return {"__set__": [_encode(v) for v in obj]}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(v) for v in obj]
+    return obj
+
+
+def _decode_hook(d: Dict):
+    if len(d) == 1 and "__set__" in d:
+        return set(d["__set__"])
+    if len(d) == 1 and "__items__" in d:
+        return {k: v for k, v in d["__items__"]}
+    return d
+
+
+def _dump(obj) -> bytes:
+    return json.dumps(_encode(obj), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _load(body: bytes):
+    """None لقيمة لا تُقرأ (جلسة محفوظة بصيغة قديمة قبل التحديث)"""
+    try:
+        return json.loads(body, object_hook=_decode_hook)
+    except ValueError:
+        return None
+
+
+class SQLiteBackend:
+    """ملف واحد لعدة عمليات على نفس الجهاز؛ الانتقالات داخل BEGIN IMMEDIATE"""
+
+    def __init__(self, path: str = STATE_DB):
+        self.path = path
+        self._conn = None
+        self._mu = threading.RLock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, body BLOB, expires REAL);
+                CREATE TABLE IF NOT EXISTS poll_routes (poll_id TEXT PRIMARY KEY, chat_id INTEGER, expires REAL);
+                CREATE TABLE IF NOT EXISTS user_status (user_id INTEGER PRIMARY KEY, status TEXT);
+                CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, token TEXT, expires REAL);
+                CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, expires REAL);
+                CREATE TABLE IF NOT EXISTS kv (name TEXT PRIMARY KEY, value TEXT);
+            """)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _tx(self):
+        """BEGIN IMMEDIATE ... COMMIT؛ عند أي خطأ ROLLBACK حتى لا يبقى الاتصال الوحيد
+        داخل معاملة فتفشل كل الاستدعاءات بعدها"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+
+    # ---------- الجلسات ----------
+    def get_session(self, chat_id: int) -> Optional[Dict]:
+        with self._mu:
+            row = self._db().execute("SELECT body FROM sessions WHERE chat_id=? AND expires>?",
+                                     (chat_id, time.time())).fetchone()
+        return _load(row[0]) if row else None
+
+    def put_session(self, chat_id: int, sess: Dict) -> None:
+        with self._mu:
+            self._db().execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                               (chat_id, _dump(sess), time.time() + _ttl(sess)))
+
+    def delete_session(self, chat_id: int) -> None:
+        with self._mu:
+            self._db().execute("DELETE FROM sessions WHERE chat_id=?", (chat_id,))
+
+    def transition(self, chat_id: int, expected: str, new: str, fields: Dict) -> Optional[Dict]:
+        with self._mu, self._tx() as db:
+            row = db.execute("SELECT body FROM sessions WHERE chat_id=? AND expires>?",
+                             (chat_id, time.time())).fetchone()
+            sess = _load(row[0]) if row else None
+            if not sess or sess.get("stage") != expected:
+                return None
+            sess.update(fields, stage=new)
+            db.execute("UPDATE sessions SET body=?, expires=? WHERE chat_id=?",
+                       (_dump(sess), time.time() + _ttl(sess), chat_id))
+            return sess
+
+    def claim_expired(self, limit: int = 500) -> List[Tuple[int, Dict]]:
+        """حذف الجلسات المنتهية وإعادتها؛ كل جلسة تصل لعملية واحدة فقط"""
+        with self._mu, self._tx() as db:
+            rows = db.execute("SELECT chat_id, body FROM sessions WHERE expires<=? LIMIT ?",
+                              (time.time(), limit)).fetchall()
+            db.executemany("DELETE FROM sessions WHERE chat_id=?", [(r[0],) for r in rows])
+        claimed = [(chat_id, _load(body)) for chat_id, body in rows]
+        return [(chat_id, sess) for chat_id, sess in claimed if sess is not None]
+
+    # ---------- مسارات الاستطلاعات ----------
+    def set_route(self, poll_id: str, chat_id: int) -> None:
+        with self._mu:
+            self._db().execute("INSERT OR REPLACE INTO poll_routes VALUES (?, ?, ?)",
+                               (poll_id, chat_id, time.time() + SESSION_TTL_QUIZ))
+
+    def get_route(self, poll_id: str) -> Optional[int]:
+        with self._mu:
+            row = self._db().execute("SELECT chat_id FROM poll_routes WHERE poll_id=? AND expires>?",
+                                     (poll_id, time.time())).fetchone()
+        return row[0] if row else None
+
+    def delete_route(self, poll_id: str) -> None:
+        with self._mu:
+            self._db().execute("DELETE FROM poll_routes WHERE poll_id=?", (poll_id,))
+
+    # ---------- حالة المستخدمين ----------
+    def set_user_status(self, user_id: int, status: str) -> None:
+        with self._mu:
+            self._db().execute("INSERT OR REPLACE INTO user_status VALUES (?, ?)", (user_id, status))
+
+    def user_status(self, user_id: int, default: Optional[str] = None) -> Optional[str]:
+        """default يُحفظ إن لم تكن للمستخدم حالة بعد (ترحيل من bot_users.json)"""
+        with self._mu:
+            db = self._db()
+            if default is not None:
+                db.execute("INSERT OR IGNORE INTO user_status VALUES (?, ?)", (user_id, default))
+            row = db.execute("SELECT status FROM user_status WHERE user_id=?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def seed_user_statuses(self, statuses: Dict[int, str]) -> None:
+        with self._mu, self._tx() as db:
+            db.executemany("INSERT OR IGNORE INTO user_status VALUES (?, ?)", statuses.items())
+
+    # ---------- الأقفال ----------
+    def acquire(self, name: str, ttl_ms: int = STATE_LOCK_TTL_MS) -> Optional[str]:
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._mu, self._tx() as db:
+            db.execute("DELETE FROM locks WHERE name=? AND expires<?", (name, now))
+            cur = db.execute("INSERT OR IGNORE INTO locks VALUES (?, ?, ?)", (name, token, now + ttl_ms / 1000))
+        return token if cur.rowcount == 1 else None
+
+    def release(self, name: str, token: str) -> None:
+        with self._mu:
+            self._db().execute("DELETE FROM locks WHERE name=? AND token=?", (name, token))
+
+    def renew(self, name: str, token: str, ttl_ms: int = STATE_LOCK_TTL_MS) -> bool:
+        """تمديد قفل ما زال لصاحب token (عقد طويل مثل البث)؛ False إن انتهى وأخذه غيره"""
+        with self._mu:
+            cur = self._db().execute("UPDATE locks SET expires=? WHERE name=? AND token=? AND expires>=?",
+                                     (time.time() + ttl_ms / 1000, name, token, time.time()))
+        return cur.rowcount == 1
+
+    # ---------- العمليات الحية ----------
+    def heartbeat(self, worker_id: str, ttl: float = 3 * HEARTBEAT_SECONDS) -> int:
+        """تسجيل نبض العملية؛ تُرجع عدد العمليات الحية (هي منها)"""
+        now = time.time()
+        with self._mu:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO workers VALUES (?, ?)", (worker_id, now + ttl))
+            db.execute("DELETE FROM workers WHERE expires<?", (now,))
+            return db.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+
+    def leave(self, worker_id: str) -> None:
+        with self._mu:
+            self._db().execute("DELETE FROM workers WHERE id=?", (worker_id,))
+
+    def setdefault(self, name: str, value: str) -> str:
+        """مثل dict.setdefault: أول قيمة تُحفظ وتُرجع لكل من يأتي بعدها"""
+        with self._mu:
+            db = self._db()
+            db.execute("INSERT OR IGNORE INTO kv VALUES (?, ?)", (name, value))
+            return db.execute("SELECT value FROM kv WHERE name=?", (name,)).fetchone()[0]
+
+    def set_value(self, name: str, value: str) -> None:
+        with self._mu:
+            self._db().execute("INSERT OR REPLACE INTO kv VALUES (?, ?)", (name, value))
+
+    def take_value(self, name: str) -> Optional[str]:
+        """قراءة القيمة وحذفها معاً (رسالة لمرة واحدة بين العمليات)"""
+        with self._mu, self._tx() as db:
+            row = db.execute("SELECT value FROM kv WHERE name=?", (name,)).fetchone()
+            db.execute("DELETE FROM kv WHERE name=?", (name,))
+        return row[0] if row else None
+
+    def purge(self) -> None:
+        """حذف الصفوف المنتهية (Redis يحذفها بنفسه)؛ الجلسات يأخذها claim_expired"""
+        now = time.time()
+        with self._mu:
+            db = self._db()
+            for table in ("poll_routes", "locks"):
+                db.execute(f"DELETE FROM {table} WHERE expires<?", (now,))
+
+
+class RespError(Exception):
+    pass
+
+
+class RespClient:
+    """عميل متزامن صغير لبروتوكول Redis (RESP2): اتصال واحد، بلا مكتبات إضافية"""
+
+    def __init__(self, url: str = REDIS_URL, timeout: float = 5.0):
+        u = urlparse(url)
+        self.host, self.port = u.hostname or "127.0.0.1", u.port or 6379
+        self.password = u.password
+        self.db = int(u.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._rfile = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+        self._sock = self._rfile = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            if not isinstance(a, (bytes, bytearray)):
+                a = str(a).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        return b"".join(out)
+
+    def _read(self):
+        line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._rfile.read(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise RespError(f"bad reply: {line!r}")
+
+    def _call(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._read()
+
+    def execute(self, *args, retry: bool = True):
+        """أمر واحد؛ انقطاع الاتصال يُعاد مرة واحدة باتصال جديد"""
+        try:
+            if self._sock is None:
+                self._connect()
+            return self._call(*args)
+        except (OSError, ConnectionError):
+            self.close()
+            if not retry:
+                raise
+            return self.execute(*args, retry=False)
+
+    def pipeline(self, *commands, retry: bool = True) -> list:
+        """عدة أوامر في رحلة واحدة؛ الردود بنفس الترتيب"""
+        try:
+            if self._sock is None:
+                self._connect()
+            self._sock.sendall(b"".join(self._encode(c) for c in commands))
+            return [self._read() for _ in commands]
+        except (OSError, ConnectionError):
+            self.close()
+            if not retry:
+                raise
+            return self.pipeline(*commands, retry=False)
+        except RespError:
+            self.close()  # بقية الردود ما زالت في الاتصال
+            raise
+
+
+class RedisBackend:
+    """أي خادم بروتوكول Redis؛ الانتقالات بـ WATCH/MULTI/EXEC والأقفال بـ SET NX PX.
+    القيمة (موعد الانتهاء، الجلسة) والمفتاح يبقى بعد الموعد STATE_EXPIRY_GRACE؛
+    المواعيد في مجموعة مرتبة expiry ليجدها claim_expired"""
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "quizbot:"):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self._mu = threading.RLock()
+
+    def _k(self, *parts) -> str:
+        return self.prefix + ":".join(str(p) for p in parts)
+
+    # ---------- الجلسات ----------
+    def _write(self, chat_id: int, sess: Dict) -> list:
+        """أوامر حفظ الجلسة وموعدها (تُنفذ داخل MULTI)"""
+        ttl = _ttl(sess)
+        deadline = time.time() + ttl
+        return [("SET", self._k("sess", chat_id), _dump((deadline, sess)), "EX", ttl + STATE_EXPIRY_GRACE),
+                ("ZADD", self._k("expiry"), deadline, chat_id)]
+
+    def get_session(self, chat_id: int) -> Optional[Dict]:
+        with self._mu:
+            body = self.client.execute("GET", self._k("sess", chat_id))
+        deadline, sess = (body and _load(body)) or (0, None)
+        return sess if deadline > time.time() else None
+
+    def put_session(self, chat_id: int, sess: Dict) -> None:
+        with self._mu:
+            self.client.pipeline(("MULTI",), *self._write(chat_id, sess), ("EXEC",))
+
+    def delete_session(self, chat_id: int) -> None:
+        with self._mu:
+            self.client.pipeline(("MULTI",), ("DEL", self._k("sess", chat_id)),
+                                 ("ZREM", self._k("expiry"), chat_id), ("EXEC",))
+
+    def transition(self, chat_id: int, expected: str, new: str, fields: Dict) -> Optional[Dict]:
+        with self._mu:
+            try:
+                return self._transition(chat_id, expected, new, fields)
+            except Exception:
+                self.client.close()  # اتصال توقف في منتصف MULTI لا يُعاد استخدامه
+                raise
+
+    def _transition(self, chat_id: int, expected: str, new: str, fields: Dict) -> Optional[Dict]:
+        c = self.client
+        key = self._k("sess", chat_id)
+        for _ in range(20):
+            # WATCH حتى EXEC على نفس الاتصال؛ لا إعادة اتصال تلقائية وسط المعاملة
+            c.execute("WATCH", key)
+            body = c.execute("GET", key, retry=False)
+            deadline, sess = (body and _load(body)) or (0, None)
+            if not sess or deadline <= time.time() or sess.get("stage") != expected:
+                c.execute("UNWATCH", retry=False)
+                return None
+            sess.update(fields, stage=new)
+            if c.pipeline(("MULTI",), *self._write(chat_id, sess), ("EXEC",), retry=False)[-1] is not None:
+                return sess
+            # عملية أخرى غيّرت الجلسة بين WATCH وEXEC: نعيد القراءة
+        return None
+
+    def claim_expired(self, limit: int = 500) -> List[Tuple[int, Dict]]:
+        """حذف الجلسات المنتهية وإعادتها؛ WATCH يضمن أن كل جلسة تصل لعملية واحدة فقط"""
+        out = []
+        with self._mu:
+            c = self.client
+            now = time.time()
+            try:
+                for raw in c.execute("ZRANGEBYSCORE", self._k("expiry"), "-inf", now, "LIMIT", 0, limit):
+                    chat_id = int(raw)
+                    key = self._k("sess", chat_id)
+                    c.execute("WATCH", key)
+                    body = c.execute("GET", key, retry=False)
+                    deadline, sess = (body and _load(body)) or (0, None)
+                    if deadline > now:
+                        # تجددت بعد قراءة المجموعة؛ موعدها الجديد فيها أصلاً
+                        c.execute("UNWATCH", retry=False)
+                        continue
+                    replies = c.pipeline(("MULTI",), ("DEL", key), ("ZREM", self._k("expiry"), chat_id),
+                                         ("EXEC",), retry=False)
+                    if replies[-1] is not None and sess is not None:
+                        out.append((chat_id, sess))
+            except Exception:
+                c.close()
+                raise
+        return out
+
+    # ---------- مسارات الاستطلاعات ----------
+    def set_route(self, poll_id: str, chat_id: int) -> None:
+        with self._mu:
+            self.client.execute("SET", self._k("poll", poll_id), chat_id, "EX", SESSION_TTL_QUIZ)
+
+    def get_route(self, poll_id: str) -> Optional[int]:
+        with self._mu:
+            v = self.client.execute("GET", self._k("poll", poll_id))
+        return int(v) if v is not None else None
+
+    def delete_route(self, poll_id: str) -> None:
+        with self._mu:
+            self.client.execute("DEL", self._k("poll", poll_id))
+
+    # ---------- حالة المستخدمين ----------
+    def set_user_status(self, user_id: int, status: str) -> None:
+        with self._mu:
+            self.client.execute("HSET", self._k("users"), user_id, status)
+
+    def user_status(self, user_id: int, default: Optional[str] = None) -> Optional[str]:
+        with self._mu:
+            if default is not None:
+                self.client.execute("HSETNX", self._k("users"), user_id, default)
+            v = self.client.execute("HGET", self._k("users"), user_id)
+        return v.decode() if v is not None else None
+
+    def seed_user_statuses(self, statuses: Dict[int, str]) -> None:
+        with self._mu:
+            for user_id, status in statuses.items():
+                self.client.execute("HSETNX", self._k("users"), user_id, status)
+
+    # ---------- الأقفال ----------
+    def acquire(self, name: str, ttl_ms: int = STATE_LOCK_TTL_MS) -> Optional[str]:
+        token = uuid.uuid4().hex
+        with self._mu:
+            ok = self.client.execute("SET", self._k("lock", name), token, "NX", "PX", ttl_ms)
+        return token if ok == "OK" else None
+
+    def release(self, name: str, token: str) -> None:
+        key = self._k("lock", name)
+        c = self.client
+        with self._mu:
+            try:
+                c.execute("WATCH", key)
+                if c.execute("GET", key, retry=False) == token.encode():
+                    c.execute("MULTI", retry=False)
+                    c.execute("DEL", key, retry=False)
+                    c.execute("EXEC", retry=False)
+                else:
+                    c.execute("UNWATCH", retry=False)
+            except Exception:
+                c.close()
+                raise
+
+    def renew(self, name: str, token: str, ttl_ms: int = STATE_LOCK_TTL_MS) -> bool:
+        key = self._k("lock", name)
+        c = self.client
+        with self._mu:
+            try:
+                c.execute("WATCH", key)
+                if c.execute("GET", key, retry=False) != token.encode():
+                    c.execute("UNWATCH", retry=False)
+                    return False
+                return c.pipeline(("MULTI",), ("SET", key, token, "PX", ttl_ms), ("EXEC",), retry=False)[-1] is not None
+            except Exception:
+                c.close()
+                raise
+
+    # ---------- العمليات الحية ----------
+    def heartbeat(self, worker_id: str, ttl: float = 3 * HEARTBEAT_SECONDS) -> int:
+        now = time.time()
+        key = self._k("workers")
+        with self._mu:
+            replies = self.client.pipeline(("ZADD", key, now + ttl, worker_id),
+                                           ("ZREMRANGEBYSCORE", key, "-inf", now), ("ZCARD", key))
+        return replies[-1]
+
+    def leave(self, worker_id: str) -> None:
+        with self._mu:
+            self.client.execute("ZREM", self._k("workers"), worker_id)
+
+    def setdefault(self, name: str, value: str) -> str:
+        key = self._k("kv", name)
+        with self._mu:
+            replies = self.client.pipeline(("SET", key, value, "NX"), ("GET", key))
+        return replies[-1].decode()
+
+    def set_value(self, name: str, value: str) -> None:
+        with self._mu:
+            self.client.execute("SET", self._k("kv", name), value)
+
+    def take_value(self, name: str) -> Optional[str]:
+        key = self._k("kv", name)
+        with self._mu:
+            value, _ = self.client.pipeline(("MULTI",), ("GET", key), ("DEL", key), ("EXEC",))[-1]
+        return value.decode() if value is not None else None
+
+    def purge(self) -> None:
+        pass
+
+
+class AsyncState:
+    """نفس دوال المخزن لكن awaitable: كل استدعاء يُنفذ في خيط واحد خاص بالمخزن
+    (الاتصال واحد على أي حال)، فانتظار القرص أو الشبكة لا يوقف حلقة الأحداث"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+
+    def __getattr__(self, name):
+        func = getattr(self.backend, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+async def ensure_shared_dir(state: AsyncState, name: str, directory: str) -> None:
+    """كل العمليات على نفس المخزن يجب أن ترى نفس المجلد: أول عملية تكتب فيه علامة
+    عشوائية وتحفظها في المخزن، ومن يجد في مجلده علامة أخرى (جهاز آخر بمجلد محلي) يتوقف"""
+    directory = directory or "."
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, SHARED_MARKER)
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(uuid.uuid4().hex)
+    try:
+        os.link(tmp, path)  # ذري: ينجح لعملية واحدة فقط إن بدأت عدة عمليات معاً
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(path) as f:
+        token = f.read().strip()
+    if await state.setdefault(f"dir:{name}", token) != token:
+        raise SystemExit(
+            f"❌ {os.path.abspath(directory)} ({name}) ليس نفس المجلد الذي تراه العمليات الأخرى على STATE_BACKEND. "
+            f"اجعله مجلداً مشتركاً بينها، أو احذف المفتاح dir:{name} من المخزن إن نُقل المجلد عمداً.")
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "redis": RedisBackend}
+
+
+def open_backend(name: str = STATE_BACKEND) -> Optional[AsyncState]:
+    """None مع memory (السلوك السابق)، وإلا المخزن المشترك المطلوب"""
+    if name in ("", "memory"):
+        return None
+    if name not in BACKENDS:
+        raise SystemExit(f"❌ STATE_BACKEND غير معروف: {name} (memory|sqlite|redis)")
+    return AsyncState(BACKENDS[name]())
@@ -0,0 +1,102 @@
+import os
+import sys
+import asyncio
+import itertools
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# الوحدات تقرأ مساراتها عند الاستيراد، وbot_users.json نسبي: كل شيء في مجلد مؤقت
+WORKDIR = tempfile.mkdtemp(prefix="quizbot_tests_")
+os.environ["QUESTION_BANK_DB"] = os.path.join(WORKDIR, "bank.db")
+os.environ["EVENTS_DIR"] = os.path.join(WORKDIR, "events")
+os.environ["UPLOAD_SPOOL_DIR"] = os.path.join(WORKDIR, "spool")
+os.environ["CHUNK_CACHE_DB"] = os.path.join(WORKDIR, "chunk_cache.db")
+os.environ["STATE_BACKEND"] = "memory"
+os.chdir(WORKDIR)
+
+
+class FakeBot:
+    """بديل telegram.Bot: كل استدعاء يُسجل ويُرجع رسالة (مع poll لـ send_poll)"""
+
+    def __init__(self):
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    def __getattr__(self, method):
+        async def call(**kwargs):
+            self.calls.append((method, kwargs))
+            n = next(self._ids)
+            return SimpleNamespace(message_id=n, chat_id=kwargs.get("chat_id"), text=kwargs.get("text"),
+                                   poll=SimpleNamespace(id=f"poll{n}"))
+        return call
+
+    def sent(self, method, chat_id=None):
+        return [kw for m, kw in self.calls if m == method and (chat_id is None or kw.get("chat_id") == chat_id)]
+
+
+class FakeJob:
+    def __init__(self, callback, name, chat_id=None):
+        self.callback = callback
+        self.name = name
+        self.chat_id = chat_id
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, chat_id=None, name=None, **kwargs):
+        self.jobs.append(FakeJob(callback, name, chat_id))
+        return self.jobs[-1]
+
+    def run_repeating(self, callback, interval, first=None, name=None, **kwargs):
+        return self.run_once(callback, first, name=name)
+
+    def get_jobs_by_name(self, name):
+        return [j for j in self.jobs if j.name == name and not j.removed]
+
+
+def make_context():
+    return SimpleNamespace(bot=FakeBot(), job_queue=FakeJobQueue(), args=[],
+                           application=SimpleNamespace(handlers={},
+                                                       create_task=lambda coro: asyncio.get_running_loop().create_task(coro)))
+
+
+def make_update(user_id, chat_id=None, text=""):
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+        return SimpleNamespace(message_id=len(replies), chat_id=chat_id or user_id, text=text)
+
+    user = SimpleNamespace(id=user_id, full_name=f"User{user_id}", username=f"u{user_id}")
+    return SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=chat_id or user_id),
+                           message=SimpleNamespace(text=text, reply_text=reply_text, reply_to_message=None),
+                           replies=replies)
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    """bot بحالة جديدة لكل اختبار: جلسات ومسارات وموزع رسائل بلا انتظار بين الرسائل"""
+    import bot as bot_module
+    from admission import Admission
+    from outbound import OutboundDispatcher
+    from sessions import SessionStore, PollRoutes
+    from write_behind import WriteBehind
+
+    monkeypatch.setattr(bot_module, "STATE", None)
+    monkeypatch.setattr(bot_module, "SESSIONS", SessionStore())
+    monkeypatch.setattr(bot_module, "POLL_ROUTES", PollRoutes())
+    monkeypatch.setattr(bot_module, "WRITE_BEHIND", WriteBehind())
+    monkeypatch.setattr(bot_module, "ADMISSION", Admission())
+    monkeypatch.setattr(bot_module, "OUTBOUND", OutboundDispatcher(global_rate=1000, private_interval=0, group_interval=0))
+    monkeypatch.setattr(bot_module, "allowed_users", set())
+    return bot_module
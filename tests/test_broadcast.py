@@ -0,0 +1,94 @@
+import time
+import asyncio
+
+from telegram.error import Forbidden
+
+from broadcast import Broadcast
+from state_store import AsyncState, SQLiteBackend
+
+USERS = {**{str(uid): {"status": "allowed"} for uid in range(1, 11)},
+         "11": {"status": "pending"}, "12": {"status": "allowed", "blocked": "2026-01-01"}}
+
+
+def test_resume_from_cursor_retries_in_flight_items(tmp_path):
+    path = str(tmp_path / "broadcast.json")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        futures = {}
+
+        def submit(uid):
+            futures[uid] = loop.create_future()
+            return futures[uid]
+
+        b = Broadcast(path, window=3)
+        b.start(USERS, "allowed", text="hello")
+        assert b.refill(submit) == 3
+        futures[1].set_result(None)
+        futures[2].set_result(None)
+        await asyncio.sleep(0)
+        assert b.refill(submit) == 2  # 3 ما زالت معلقة، ثم 4 و5
+        futures[4].set_exception(Forbidden("Forbidden: bot was blocked by the user"))
+        await asyncio.sleep(0)
+        b.save()
+        assert (b.state["cursor"], b.state["inflight"]) == (5, [3, 5])
+
+        # توقف مفاجئ: 3 و5 لا نعرف إن وصلتا فتُعادان أولاً، ثم ما بعد المؤشر
+        resumed = Broadcast(path, window=3)
+        assert resumed.load(USERS)
+        assert list(resumed._queue) == [3, 5, 6, 7, 8, 9, 10]
+        assert (resumed.state["sent"], resumed.state["blocked"]) == (2, 1)
+        assert resumed.take_blocked() == [] and b.take_blocked() == [4]
+
+        sent = []
+        while resumed._queue or resumed._inflight:
+            def deliver(uid):
+                sent.append(uid)
+                fut = loop.create_future()
+                fut.set_result(None)
+                return fut
+            resumed.refill(deliver)
+            await asyncio.sleep(0)
+        assert sent == [3, 5, 6, 7, 8, 9, 10]
+        assert resumed.state["sent"] == 9
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_lease_moves_to_another_worker(bot, monkeypatch, tmp_path):
+    db = str(tmp_path / "state.db")
+    path = str(tmp_path / "broadcast.json")
+    monkeypatch.setattr(bot, "STATE", AsyncState(SQLiteBackend(db)))
+    monkeypatch.setattr(bot, "BROADCAST", Broadcast(path))
+    monkeypatch.setattr(bot, "BROADCAST_LEASE_MS", 100)
+    monkeypatch.setattr(bot, "_broadcast_lease", None)
+    other = SQLiteBackend(db)
+
+    async def scenario():
+        assert await bot.claim_broadcast()
+        bot.BROADCAST.start(USERS, "allowed", text="hello")
+        assert await bot.claim_broadcast()  # تجديد
+        assert other.acquire("broadcast", 100) is None
+
+        # العملية توقفت عن التجديد أطول من المهلة: أخرى تأخذ العقد وتكمل من الملف
+        time.sleep(0.15)
+        token = other.acquire("broadcast", 1000)
+        assert token
+        progress = Broadcast(path)
+        assert progress.load(USERS)
+        progress.state["sent"] = 4
+        progress.save()
+
+        assert not await bot.claim_broadcast()
+        assert bot._broadcast_lease is None
+        assert bot.BROADCAST.state["sent"] == 4  # قرأت تقدم العملية المرسلة ولم تكتب فوقه
+
+        other.release("broadcast", token)
+        assert await bot.claim_broadcast()
+        await bot.release_broadcast()
+        assert other.acquire("broadcast", 100)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        bot.STATE.close()
@@ -0,0 +1,14 @@
+import random
+
+from distractors import DistractorIndex, script
+
+
+def test_distractors_match_script_and_skip_the_answer():
+    phrases = ["a packet filtering firewall", "a stateful firewall appliance", "the routing table entry",
+               "an encrypted tunnel", "جدار حماية للشبكة", "مفتاح تشفير عام", "packet filtering"]
+    index = DistractorIndex(phrases, random.Random(0))
+    picked = index.pick("a packet filtering firewall", 3)
+    assert len(picked) == 3 and "a packet filtering firewall" not in picked
+    assert "packet filtering" not in picked  # محتواة في الإجابة
+    assert all(script(p) == "latin" for p in picked)
+    assert all(script(p) == "ar" for p in index.pick("جدار حماية للشبكة", 1))
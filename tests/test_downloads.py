@@ -0,0 +1,21 @@
+import os
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import question_bank
+from downloads import Downloader, discard
+
+
+def test_download_and_batch_share_the_document_key(tmp_path):
+    src = tmp_path / "lecture.pdf"
+    body = os.urandom(3 * question_bank.HASH_CHUNK + 123)
+    src.write_bytes(body)
+
+    download = asyncio.run(Downloader().fetch(SimpleNamespace(file_size=len(body), file_path=str(src)),
+                                              ".pdf", 10 * len(body)))
+    try:
+        assert download.sha256 == question_bank.doc_hash_file(str(src)) == hashlib.sha256(body).hexdigest()
+        assert download.size == len(body)
+    finally:
+        discard(download.path)
@@ -0,0 +1,34 @@
+import os
+from datetime import datetime
+
+import event_store
+
+
+def _use_dir(monkeypatch, path):
+    monkeypatch.setattr(event_store, "EVENTS_DIR", str(path))
+    monkeypatch.setattr(event_store, "RAW_DIR", str(path / "raw"))
+    monkeypatch.setattr(event_store, "ROLLUPS_FILE", str(path / "rollups.json"))
+
+
+def _legacy():
+    return [{"timestamp": f"2026-01-0{d}T10:00:00.00000{i}", "user_id": 7, "type": "quiz_completed",
+             "details": {"score": i}} for d in (1, 2) for i in range(3)]
+
+
+def test_legacy_import_is_idempotent(monkeypatch, tmp_path):
+    _use_dir(monkeypatch, tmp_path)
+    assert event_store.import_legacy(_legacy()) == 6
+    # توقف قبل حفظ bot_users.json: نفس الأحداث تُنقل مرة أخرى عند التشغيل
+    assert event_store.import_legacy(_legacy()) == 0
+    assert event_store.user_totals(7)["quiz_completed"] == 6
+
+    event_store.compact(datetime(2026, 3, 1))
+    assert event_store.import_legacy(_legacy()) == 0
+    assert event_store.user_totals(7)["quiz_completed"] == 6
+
+
+def test_atomic_write_leaves_no_temp_files(monkeypatch, tmp_path):
+    _use_dir(monkeypatch, tmp_path)
+    event_store.import_legacy(_legacy())
+    event_store.compact(datetime(2026, 3, 1))
+    assert sorted(os.listdir(tmp_path)) == ["raw", "rollups.json"]
@@ -0,0 +1,52 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import question_bank
+from conftest import make_context, make_update
+
+ADMIN = 801
+GROUP = -100801
+
+
+def _vote(poll_id, user_id, option):
+    return SimpleNamespace(poll_answer=SimpleNamespace(
+        poll_id=poll_id, option_ids=[option], user=SimpleNamespace(id=user_id, full_name=f"Voter{user_id}")))
+
+
+def test_votes_do_not_wait_for_the_leaderboard_send(bot):
+    bot.allowed_users.add(ADMIN)
+    questions = [{"type": "mcq", "question": f"Group Q{i}?", "options": ["a", "b", "c", "d"], "correct": 1}
+                 for i in range(2)]
+    qids = question_bank.store("doc-group", "en", questions)
+    question_bank.remember_doc(ADMIN, "doc-group", "en", "lecture.txt", qids)
+    ctx = make_context()
+    sent = ctx.bot.send_message
+
+    async def slow_send(**kwargs):
+        await asyncio.sleep(0.3)  # مهلة المجموعة في OUTBOUND
+        return await sent(**kwargs)
+
+    async def scenario():
+        await bot.cmd_retake(make_update(ADMIN, GROUP), ctx)
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+        poll_id = (await bot.SESSIONS.get(GROUP))["current_poll"]
+        ctx.bot.send_message = slow_send
+
+        t0 = time.perf_counter()
+        for voter in range(10):
+            await bot.receive_poll_answer(_vote(poll_id, 9000 + voter, voter % 2), ctx)
+        assert time.perf_counter() - t0 < 0.2
+
+        await asyncio.sleep(0.6)
+        sess = await bot.SESSIONS.get(GROUP)
+        assert len(sess["scores"]) == 10 and sum(sess["scores"].values()) == 5
+        boards = [kw for kw in ctx.bot.sent("send_message", GROUP) if "🏆" in kw["text"]]
+        assert len(boards) == 1  # رسالة واحدة للوحة، والأصوات بعدها تعديلات عليها
+        assert sess["board_msg"]
+        edits = ctx.bot.sent("edit_message_text", GROUP)
+        assert edits and edits[-1]["message_id"] == sess["board_msg"]
+        assert "10" in edits[-1]["text"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+import json
+import random
+import asyncio
+
+import llm
+import providers
+from chunk_cache import ChunkCache, chunk_hash
+
+
+class StubClient:
+    """بديل httpx داخل ROUTER: يسجل النموذج المرسل ويُرجع أسئلة بعدد max_tokens"""
+
+    def __init__(self):
+        self.models = []
+
+    async def post(self, url, headers=None, json=None):
+        self.models.append(json["model"])
+        n = max(1, (json["max_tokens"] - llm.REASONING_TOKENS) // llm.TOKENS_PER_QUESTION)
+        items = [{"type": "mcq", "question": f"{json['model']} q{len(self.models)}-{i}",
+                  "options": ["a", "b", "c", "d"], "correct": 0} for i in range(n)]
+        return Response({"choices": [{"message": {"content": _dumps(items)}, "finish_reason": "stop"}]})
+
+
+_dumps = json.dumps
+
+
+class Response:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+def _lines(seed, n):
+    rnd = random.Random(seed)
+    words = "network packet routing cipher key firewall subnet handshake latency window".split()
+    return [" ".join(rnd.choice(words) for _ in range(rnd.randint(6, 14))) + "." for _ in range(n)]
+
+
+def test_content_chunks_survive_inserted_text():
+    body = _lines(1, 400)
+    before = {chunk_hash(c) for c in llm._split_text("\n".join(body), llm.CHUNK_CHARS)}
+    edited = body[:200] + _lines(2, 15) + body[200:]
+    after = llm._split_text("\n".join(edited), llm.CHUNK_CHARS)
+    assert all(len(c) <= llm.CHUNK_MAX_SHARE * llm.CHUNK_CHARS + 200 for c in after)
+    # فقط المقطع الذي أُضيف فيه النص (وربما جاره) يتغير
+    assert len([c for c in after if chunk_hash(c) not in before]) <= 2
+    assert len(after) <= len(before) + 1
+
+
+def test_chunk_cache_is_keyed_by_the_provider_models(monkeypatch, tmp_path):
+    cache = ChunkCache(str(tmp_path / "cache.db"), 8)
+    client = StubClient()
+    monkeypatch.setattr(llm, "CHUNK_CACHE", cache)
+    monkeypatch.setattr(providers.ROUTER, "_client", client)
+    monkeypatch.setattr(providers.ROUTER, "providers", [providers.Provider("b", "stub://b", "model-b", None),
+                                                        providers.Provider("a", "stub://a", "model-a", None)])
+    text = "\n".join(_lines(3, 30))
+
+    async def scenario():
+        await llm.ask_llm_big(text, "en", target_total=5, mcq_ratio=1.0)
+        calls = len(client.models)
+        assert calls and set(client.models) <= {"model-a", "model-b"}
+        assert cache.get(text, "en", "model-a+model-b")
+        assert cache.get(text, "en", llm.MODEL) is None
+
+        # نفس مجموعة المزوّدين: من الذاكرة بلا طلب
+        await llm.ask_llm_big(text, "en", target_total=5, mcq_ratio=1.0)
+        assert len(client.models) == calls
+
+        # مزوّد آخر لم يولّد هذه الأسئلة: يُطلب من جديد
+        monkeypatch.setattr(providers.ROUTER, "providers", [providers.Provider("c", "stub://c", "model-c", None)])
+        await llm.ask_llm_big(text, "en", target_total=5, mcq_ratio=1.0)
+        assert client.models[-1] == "model-c"
+
+    asyncio.run(scenario())
+    cache.close()
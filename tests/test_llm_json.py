@@ -0,0 +1,34 @@
+import json
+
+from llm_json import parse_questions
+
+ITEMS = [{"type": "mcq", "question": f"ما وظيفة الطبقة {i} في \"OSI\"؟ {{x}}", "options": ["a", "b", "c", "d"],
+          "correct": i % 4} for i in range(3)]
+BODY = json.dumps(ITEMS, ensure_ascii=False, indent=2)
+
+
+def test_clean_fenced_prose_and_wrapped_replies():
+    for content in (BODY, f"```json\n{BODY}\n```", f"<think>plan [</think>Here you go:\n{BODY}\nGood luck!",
+                    json.dumps({"questions": ITEMS}, ensure_ascii=False)):
+        assert parse_questions(content) == (ITEMS, False)
+
+
+def test_trailing_comma_and_python_literals():
+    assert parse_questions(BODY[:BODY.rindex("}") + 1] + ",\n]") == (ITEMS, False)
+    py = "[{'type': 'tf', 'question': 'TCP is reliable.', 'options': ['True', 'False'], 'correct': 0, 'hint': None}]"
+    assert parse_questions(py)[0][0]["hint"] is None
+    assert parse_questions('[{"question": "Q?", "correct": 1, "multi": False,}]')[0] == [
+        {"question": "Q?", "correct": 1, "multi": False}]
+
+
+def test_truncated_reply_keeps_every_complete_question():
+    cut = BODY.index("الطبقة 2")  # داخل السؤال الثالث
+    assert parse_questions(BODY[:cut]) == (ITEMS[:2], True)
+    assert parse_questions(f"```json\n{BODY[:cut]}") == (ITEMS[:2], True)
+    # انقطاع داخل نص يحوي أقواساً: لا يُحسب كائن نصف مكتمل
+    assert parse_questions(BODY[:BODY.index("{x}") + 2]) == ([], True)
+
+
+def test_garbage_yields_nothing():
+    assert parse_questions("Sorry, I can't help with that.") == ([], False)
+    assert parse_questions("") == ([], False)
@@ -0,0 +1,17 @@
+import sys
+
+import ocr
+
+
+def test_tesseract_probe_does_not_import_the_packages():
+    ocr.TesseractBackend().available()
+    assert "pytesseract" not in sys.modules and "PIL.Image" not in sys.modules
+
+
+def test_ocr_workers_are_spawned():
+    try:
+        pool = ocr._process_pool()
+        assert pool._mp_context.get_start_method() == "spawn"
+        assert pool.submit(ocr._tess_lang, "ar").result(30) == "ara+eng"
+    finally:
+        ocr.shutdown()
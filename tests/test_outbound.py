@@ -0,0 +1,53 @@
+import asyncio
+
+from outbound import OutboundDispatcher, PRIORITY_POLL, PRIORITY_BULK
+
+
+class RetryAfter(Exception):
+    def __init__(self, seconds):
+        super().__init__(f"retry after {seconds}")
+        self.retry_after = seconds
+
+
+def test_coalesced_edits_send_only_the_latest_text():
+    out = OutboundDispatcher(global_rate=1000, private_interval=0.2, group_interval=0.2)
+    sent = []
+
+    async def edit(text):
+        sent.append(text)
+
+    async def scenario():
+        first = out.submit(-1, PRIORITY_POLL, edit, "board 0")
+        await asyncio.sleep(0.01)  # أُرسلت؛ التالية تنتظر مهلة المجموعة
+        futures = [out.submit(-1, PRIORITY_POLL, edit, f"board {i}", coalesce_key="board") for i in range(1, 6)]
+        await asyncio.gather(first, *futures)
+        await out.aclose()
+
+    asyncio.run(scenario())
+    assert sent == ["board 0", "board 5"]
+    assert out.stats["coalesced"] == 4
+
+
+def test_priority_cancellation_and_retry_after():
+    out = OutboundDispatcher(global_rate=50, private_interval=0, group_interval=0)
+    sent = []
+    limited = {"tries": 0}
+
+    async def send(label):
+        if label == "limited" and not limited["tries"]:
+            limited["tries"] += 1
+            raise RetryAfter(0.05)
+        sent.append(label)
+
+    async def scenario():
+        bulk = [out.submit(100 + i, PRIORITY_BULK, send, f"bulk{i}") for i in range(3)]
+        dropped = out.submit(200, PRIORITY_BULK, send, "dropped")
+        poll = out.submit(300, PRIORITY_POLL, send, "poll")
+        retried = out.submit(400, PRIORITY_POLL, send, "limited")
+        dropped.cancel()
+        await asyncio.gather(poll, retried, *bulk)
+        await out.aclose()
+
+    asyncio.run(scenario())
+    assert sent[0] == "poll" and set(sent) == {"poll", "limited", "bulk0", "bulk1", "bulk2"}
+    assert out.stats["dropped"] == 1 and out.stats["retry_after"] == 1
@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+from conftest import make_context, make_update
+
+
+def test_profile_stop_when_idle_and_from_the_panel(bot):
+    ctx = make_context()
+
+    async def scenario():
+        update = make_update(bot.ADMIN_ID)
+        ctx.args = ["stop"]
+        await bot.cmd_profile(update, ctx)
+        assert update.replies == [bot._ui("لا يوجد تشخيص قيد التشغيل.", "No profiler is running.")]
+
+        replies = []
+        query = SimpleNamespace(data="profile_60", from_user=SimpleNamespace(id=bot.ADMIN_ID),
+                                answer=_noop, message=SimpleNamespace(reply_text=_record(replies)))
+        await bot.handle_control_buttons(SimpleNamespace(callback_query=query), ctx)
+        assert bot.PROFILER.active and ctx.job_queue.get_jobs_by_name("profile")
+
+        await bot.cmd_profile(make_update(bot.ADMIN_ID), ctx)
+        assert not bot.PROFILER.active and not ctx.job_queue.get_jobs_by_name("profile")
+        assert ctx.bot.sent("send_document", bot.ADMIN_ID)
+
+    asyncio.run(scenario())
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+def _record(out):
+    async def reply_text(text, **kwargs):
+        out.append(text)
+    return reply_text
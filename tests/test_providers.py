@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import providers
+from providers import Provider, ProviderRouter
+
+
+class Response:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class ScriptedClient:
+    """كل نموذج: (زمن الرد، خطأ أو None)؛ يسجل الطلبات التي أُلغيت قبل أن تكتمل"""
+
+    def __init__(self, script):
+        self.script = script
+        self.cancelled = []
+
+    async def post(self, url, headers=None, json=None):
+        delay, error = self.script[json["model"]]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(json["model"])
+            raise
+        if error:
+            raise error
+        return Response({"model": json["model"]})
+
+
+def _router(monkeypatch, script):
+    monkeypatch.setattr(providers, "HEDGE_DEFAULT", 0.05)
+    router = ProviderRouter([Provider("slow", "stub://slow", "slow", None),
+                             Provider("fast", "stub://fast", "fast", None)])
+    router._client = ScriptedClient(script)
+    return router
+
+
+def test_hedge_wins_and_the_slow_request_is_cancelled(monkeypatch):
+    router = _router(monkeypatch, {"slow": (1.0, None), "fast": (0.01, None)})
+
+    async def scenario():
+        assert (await router.chat({}))["model"] == "fast"
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    slow, fast = router.providers
+    assert router._client.cancelled == ["slow"]
+    assert slow.errors == 0 and slow.requests == 0  # الخاسر في السباق ليس خطأً
+    assert fast.hedges_won == 1 and fast.requests == 1
+
+
+def test_failure_falls_through_to_the_next_provider(monkeypatch):
+    router = _router(monkeypatch, {"slow": (0.0, RuntimeError("502")), "fast": (0.01, None)})
+    assert asyncio.run(router.chat({}))["model"] == "fast"
+    slow, fast = router.providers
+    assert slow.errors == 1 and slow.consecutive_errors == 1
+    assert router.ranked()[0] is fast
+
+
+def test_every_provider_failing_raises_the_last_error(monkeypatch):
+    router = _router(monkeypatch, {"slow": (0.0, RuntimeError("502")), "fast": (0.0, RuntimeError("429"))})
+    with pytest.raises(RuntimeError, match="429"):
+        asyncio.run(router.chat({}))
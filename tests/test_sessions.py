@@ -0,0 +1,122 @@
+import os
+import asyncio
+
+import question_bank
+from conftest import make_context, make_update
+
+USER = 501
+GROUP = -100501
+
+
+def _bank(user_id, n=3):
+    questions = [{"type": "mcq", "question": f"Q{i} for {user_id}?", "options": ["a", "b", "c", "d"], "correct": i % 4}
+                 for i in range(n)]
+    dhash = f"doc-{user_id}"
+    qids = question_bank.store(dhash, "en", questions)
+    question_bank.remember_doc(user_id, dhash, "en", "lecture.txt", qids)
+
+
+async def _settle():
+    # OUTBOUND يرسل في مهمته و_poll_sent يسجل المسار بعده
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+def test_retake_while_group_quiz_running_replaces_session(bot):
+    bot.allowed_users.add(USER)
+    _bank(USER)
+    ctx = make_context()
+
+    async def scenario():
+        await bot.cmd_retake(make_update(USER, GROUP), ctx)
+        await _settle()
+        first = await bot.SESSIONS.get(GROUP)
+        old_polls = list(first["answers"])
+        assert len(old_polls) == 1 and len(ctx.job_queue.get_jobs_by_name(f"advance_{GROUP}")) == 1
+
+        await bot.cmd_retake(make_update(USER, GROUP), ctx)
+        await _settle()
+        second = await bot.SESSIONS.get(GROUP)
+        assert second["sid"] != first["sid"]
+        # سلسلة تقدم واحدة ومسارات الاستطلاع القديم أُزيلت
+        assert len(ctx.job_queue.get_jobs_by_name(f"advance_{GROUP}")) == 1
+        assert [await bot.POLL_ROUTES.get(p) for p in old_polls] == [None]
+        assert list(second["answers"]) != old_polls and second["index"] == 1
+        assert len(ctx.bot.sent("send_poll", GROUP)) == 2
+
+    asyncio.run(scenario())
+
+
+def test_retake_cancels_processing_and_removes_upload(bot):
+    bot.allowed_users.add(USER + 1)
+    _bank(USER + 1)
+    ctx = make_context()
+    path = os.path.join(os.environ["UPLOAD_SPOOL_DIR"], "processing-upload.pdf")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+    async def scenario():
+        chat_id = USER + 1
+        await bot.SESSIONS.put(chat_id, {"stage": "processing", "user_id": chat_id, "file_path": path})
+        upload = dict(await bot.SESSIONS.get(chat_id))
+        task = bot.ADMISSION.track(chat_id, asyncio.get_running_loop().create_task(asyncio.sleep(30)),
+                                   lambda: bot.release_upload(upload))
+        await asyncio.sleep(0)
+
+        await bot.cmd_retake(make_update(chat_id), ctx)
+        await _settle()
+        assert task.cancelled()
+        assert not os.path.exists(path)
+        sess = await bot.SESSIONS.get(chat_id)
+        assert sess["stage"] == "quiz" and "file_path" not in sess
+
+    asyncio.run(scenario())
+
+
+def test_expired_session_releases_upload(bot):
+    ctx = make_context()
+    path = os.path.join(os.environ["UPLOAD_SPOOL_DIR"], "waiting-upload.pdf")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+    async def scenario():
+        await bot.SESSIONS.put(USER + 2, {"stage": "await_lang", "user_id": USER + 2, "file_path": path})
+        await bot.expire_session(USER + 2, ctx)
+        await _settle()
+        assert not await bot.SESSIONS.exists(USER + 2)
+        assert not os.path.exists(path)
+        assert ctx.bot.sent("send_message", USER + 2)
+
+    asyncio.run(scenario())
+
+
+def test_cancel_stops_processing_before_replying(bot):
+    ctx = make_context()
+    chat_id = USER + 3
+    path = os.path.join(os.environ["UPLOAD_SPOOL_DIR"], "cancelled-upload.pdf")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    stopped = []
+
+    async def processing():
+        try:
+            await asyncio.sleep(30)
+        finally:
+            stopped.append(os.path.exists(path))
+
+    async def scenario():
+        await bot.SESSIONS.put(chat_id, {"stage": "processing", "user_id": chat_id, "file_path": path})
+        upload = dict(await bot.SESSIONS.get(chat_id))
+        task = bot.ADMISSION.track(chat_id, asyncio.get_running_loop().create_task(processing()),
+                                   lambda: bot.release_upload(upload))
+        await asyncio.sleep(0)
+
+        update = make_update(chat_id)
+        await bot.cmd_cancel(update, ctx)
+        # المهمة انتهت وحُرر الملف قبل رسالة التأكيد
+        assert task.done() and stopped == [True]
+        assert not os.path.exists(path)
+        assert not await bot.SESSIONS.exists(chat_id)
+        assert update.replies == [bot._ui("تم إلغاء الاختبار الحالي ✅", "Current quiz canceled ✅")]
+
+    asyncio.run(scenario())
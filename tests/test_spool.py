@@ -0,0 +1,52 @@
+import os
+import time
+import asyncio
+
+import speculative
+from downloads import SPOOL_PREFIX, UPLOAD_SPOOL_DIR
+from sessions import UPLOAD_MAX_AGE, SESSION_TTL_PENDING, SESSION_TTL_PROCESSING
+from conftest import make_context
+
+
+def _spool_file(name, age):
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_SPOOL_DIR, SPOOL_PREFIX + name)
+    open(path, "wb").close()
+    old = time.time() - age
+    os.utime(path, (old, old))
+    return path
+
+
+def test_upload_max_age_covers_every_stage_of_a_live_session():
+    assert UPLOAD_MAX_AGE > 2 * SESSION_TTL_PENDING + SESSION_TTL_PROCESSING
+
+
+def test_sweep_keeps_files_of_live_sessions(bot):
+    live = _spool_file("live.pdf", UPLOAD_MAX_AGE + 3600)
+    processing = _spool_file("processing.pdf", 50 * 60)  # أقدم من مرحلتين، أحدث من الثلاث
+    orphan = _spool_file("orphan.pdf", UPLOAD_MAX_AGE + 60)
+
+    async def scenario():
+        await bot.SESSIONS.put(1, {"stage": "await_question_lang", "user_id": 1, "file_path": live})
+        await bot.sweep_sessions_job(make_context())
+
+    asyncio.run(scenario())
+    assert os.path.exists(live)
+    assert os.path.exists(processing)
+    assert not os.path.exists(orphan)
+
+
+def test_speculation_sweep_skips_live_sessions():
+    class Spec:
+        created = time.monotonic() - UPLOAD_MAX_AGE - 1
+        cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    live, dead = Spec(), Spec()
+    speculative.SPECULATIONS.update({"live-sid": live, "dead-sid": dead})
+    speculative.sweep(UPLOAD_MAX_AGE, keep=["live-sid"])
+    assert "live-sid" in speculative.SPECULATIONS and not live.cancelled
+    assert "dead-sid" not in speculative.SPECULATIONS and dead.cancelled
+    speculative.SPECULATIONS.clear()
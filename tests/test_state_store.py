@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import socket
+import subprocess
+import multiprocessing
+
+import pytest
+
+import state_store
+from state_store import SQLiteBackend, RedisBackend
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+
+def _group_session():
+    return {"stage": "quiz", "sid": "s1", "user_id": 5, "questions": [{"question": "Q?", "options": ["a", "b"]}],
+            "scores": {101: 2, 102: 0}, "names": {101: "أحمد"}, "voters": {"poll1": {101, 102}},
+            "board_msg": None, "index": 1}
+
+
+def test_sqlite_session_is_json_and_round_trips(tmp_path):
+    db = SQLiteBackend(str(tmp_path / "state.db"))
+    db.put_session(1, _group_session())
+    assert db.get_session(1) == _group_session()
+    body = db._db().execute("SELECT body FROM sessions WHERE chat_id=1").fetchone()[0]
+    assert body.startswith(b"{")
+
+    # صف قديم بصيغة pickle لا يُنفَّذ ولا يُقرأ
+    db._db().execute("UPDATE sessions SET body=? WHERE chat_id=1", (b"\x80\x05cos\nsystem\n.",))
+    assert db.get_session(1) is None
+
+
+def test_sqlite_transition_happens_once(tmp_path):
+    db = SQLiteBackend(str(tmp_path / "state.db"))
+    db.put_session(1, {"stage": "await_question_lang", "user_id": 5})
+    assert db.transition(1, "await_question_lang", "processing", {"lang": "en"})["lang"] == "en"
+    assert db.transition(1, "await_question_lang", "processing", {"lang": "ar"}) is None
+    assert db.get_session(1)["stage"] == "processing"
+    assert db.transition(2, "await_question_lang", "processing", {}) is None
+    assert not db._db().in_transaction
+
+
+def test_sqlite_failed_transition_rolls_back(tmp_path, monkeypatch):
+    db = SQLiteBackend(str(tmp_path / "state.db"))
+    db.put_session(1, {"stage": "await_question_lang", "user_id": 5})
+
+    def broken(obj):
+        raise RuntimeError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(state_store, "_dump", broken)
+        with pytest.raises(RuntimeError):
+            db.transition(1, "await_question_lang", "processing", {})
+
+    assert not db._db().in_transaction
+    assert db.get_session(1)["stage"] == "await_question_lang"
+    assert db.acquire("after-failure", 1000)
+    assert db.transition(1, "await_question_lang", "processing", {})
+
+
+def test_sqlite_lock_acquire_release_renew(tmp_path):
+    db = SQLiteBackend(str(tmp_path / "state.db"))
+    token = db.acquire("broadcast", 200)
+    assert token and db.acquire("broadcast", 200) is None
+    assert db.renew("broadcast", token, 200)
+    assert not db.renew("broadcast", "someone-else", 200)
+    db.release("broadcast", "someone-else")
+    assert db.acquire("broadcast", 200) is None
+    db.release("broadcast", token)
+    second = db.acquire("broadcast", 100)
+    assert second and second != token
+
+    time.sleep(0.15)  # انتهت المهلة: يأخذه غيره ولا يجدده صاحبه القديم
+    third = db.acquire("broadcast", 1000)
+    assert third and not db.renew("broadcast", second, 1000)
+
+
+def _count(path, rounds):
+    db = SQLiteBackend(path)
+    for _ in range(rounds):
+        while (token := db.acquire("counter", 5000)) is None:
+            time.sleep(0.001)
+        n = int(db.take_value("n") or 0)
+        db.set_value("n", str(n + 1))
+        db.release("counter", token)
+
+
+def test_sqlite_lock_is_exclusive_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteBackend(path).set_value("n", "0")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_count, args=(path, 40)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    assert [p.exitcode for p in procs] == [0, 0, 0]
+    assert SQLiteBackend(path).take_value("n") == "120"
+
+
+@pytest.fixture
+def resp_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, "resp_standin.py"), "--port", str(port)],
+                            stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield f"redis://127.0.0.1:{port}/0"
+    proc.terminate()
+    proc.wait(5)
+
+
+def test_redis_session_is_json_and_round_trips(resp_url):
+    db = RedisBackend(resp_url, prefix="test:")
+    db.put_session(1, _group_session())
+    assert db.get_session(1) == _group_session()
+    assert db.client.execute("GET", db._k("sess", 1)).startswith(b"[")
+
+    db.client.execute("SET", db._k("sess", 1), b"\x80\x05cos\nsystem\n.")
+    assert db.get_session(1) is None
+    assert db.transition(1, "quiz", "done", {}) is None
@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+import question_bank
+from conftest import make_context, make_update
+
+USER = 701
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+async def _answer(bot, poll_id, option):
+    update = SimpleNamespace(poll_answer=SimpleNamespace(
+        poll_id=poll_id, option_ids=[option], user=SimpleNamespace(id=USER, full_name="Student")))
+    await bot.receive_poll_answer(update, make_context())
+
+
+def test_mistakes_sees_answers_still_in_write_behind(bot):
+    bot.allowed_users.add(USER)
+    questions = [{"type": "mcq", "question": f"Mistake Q{i}?", "options": ["a", "b", "c", "d"], "correct": 0}
+                 for i in range(3)]
+    qids = question_bank.store("doc-mistakes", "en", questions)
+    question_bank.remember_doc(USER, "doc-mistakes", "en", "lecture.txt", qids)
+    ctx = make_context()
+
+    async def scenario():
+        await bot.cmd_retake(make_update(USER), ctx)
+        await _settle()
+        sess = await bot.SESSIONS.get(USER)
+        await _answer(bot, sess["current_poll"], 2)  # خطأ؛ يبقى في ذاكرة write-behind
+        await _settle()
+        assert bot.WRITE_BEHIND.pending
+
+        await bot.cmd_mistakes(make_update(USER), ctx)
+        await _settle()
+        sess = await bot.SESSIONS.get(USER)
+        assert [q["question"] for q in sess["questions"]] == ["Mistake Q0?"]
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_the_batch_for_the_next_one(monkeypatch):
+    import copy
+    import event_store
+    from write_behind import WriteBehind
+
+    wb = WriteBehind()
+    data = {"users": {"5": {"quizzes_taken": 0, "total_score": 0, "last_activity": None}}, "statistics": {}}
+    saved = []
+    load = lambda: copy.deepcopy(data)  # مثل load_data: نسخة جديدة من الملف في كل مرة
+    wb.record_answer(5, True, "2026-01-01T10:00:00")
+    wb.record_event({"timestamp": "2026-01-01T10:00:00", "user_id": 5, "type": "quiz_completed"}, "quizzes_taken")
+
+    def broken_save(d):
+        raise OSError("disk full")
+
+    try:
+        wb.flush(load, broken_save)
+    except OSError:
+        pass
+    assert wb.pending == 2
+
+    # إجابة وصلت بعد الفشل تُدمج مع الدفعة المعادة
+    wb.record_answer(5, False, "2026-01-01T10:01:00")
+    written = []
+    monkeypatch.setattr(event_store, "append_events", written.extend)
+    assert wb.flush(load, saved.append) == 3
+    user = saved[-1]["users"]["5"]
+    assert (user["quizzes_taken"], user["total_score"], user["last_activity"]) == (2, 1, "2026-01-01T10:01:00")
+    assert saved[-1]["statistics"]["quizzes_taken"] == 1
+    assert len(written) == 1 and wb.pending == 0
@@ -0,0 +1,94 @@
+import os
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+import event_store
+import question_bank
+
+# ================= تخزين مؤجل (write-behind) لتحديثات كل إجابة =================
+# الإجابات والأحداث تُجمع في الذاكرة وتُكتب دفعة واحدة كل FLUSH_SECONDS ثانية
+# أو عند تجاوز FLUSH_MAX عنصراً، وعند الإيقاف. أقصى فقد عند التوقف المفاجئ: دفعة واحدة.
+
+FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_SECONDS", 5))
+FLUSH_MAX = int(os.getenv("WRITE_BEHIND_MAX", 500))
+
+
+class WriteBehind:
+    def __init__(self, max_pending: int = FLUSH_MAX):
+        self.max_pending = max_pending
+        self._users: Dict[str, Dict] = {}
+        self._stats: Counter = Counter()
+        self._events: List[Dict] = []
+        self._bank_answers: List[Tuple] = []
+        self.pending = 0
+
+    def record_answer(self, user_id: int, correct: bool, timestamp: str) -> None:
+        """زيادة quizzes_taken و total_score وتحديث last_activity للمستخدم"""
+        u = self._users.setdefault(str(user_id), {"quizzes_taken": 0, "total_score": 0, "last_activity": None})
+        u["quizzes_taken"] += 1
+        u["total_score"] += int(correct)
+        u["last_activity"] = timestamp
+        self.pending += 1
+
+    def record_event(self, event: Dict, stat_key: str = None) -> None:
+        self._events.append(event)
+        if stat_key:
+            self._stats[stat_key] += 1
+        self.pending += 1
+
+    def record_bank_answer(self, user_id: int, dhash: str, lang: str, qid: int, correct: bool) -> None:
+        self._bank_answers.append((user_id, dhash, lang, qid, correct))
+        self.pending += 1
+
+    def full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def flush(self, load_data: Callable[[], Dict], save_data: Callable[[Dict], None]) -> int:
+        """تطبيق كل ما في الذاكرة على التخزين؛ تُرجع عدد العناصر المكتوبة"""
+        if not self.pending:
+            return 0
+        users, stats, events, bank = self._users, self._stats, self._events, self._bank_answers
+        flushed = self.pending
+        self._users, self._stats, self._events, self._bank_answers = {}, Counter(), [], []
+        self.pending = 0
+
+        try:
+            if users or stats:
+                data = load_data()
+                for uid, delta in users.items():
+                    if uid not in data["users"]:
+                        continue
+                    user_data = data["users"][uid]
+                    user_data["quizzes_taken"] += delta["quizzes_taken"]
+                    user_data["total_score"] += delta["total_score"]
+                    user_data["last_activity"] = max(user_data.get("last_activity") or "", delta["last_activity"])
+                for key, n in stats.items():
+                    data["statistics"][key] = data["statistics"].get(key, 0) + n
+                save_data(data)
+                users, stats = {}, Counter()
+            if events:
+                event_store.append_events(events)
+                events = []
+            if bank:
+                question_bank.record_answers(bank)
+                bank = []
+        except Exception:
+            # ما لم يُكتب يعود للذاكرة (مدموجاً مع ما وصل أثناء الكتابة) ويُعاد في الدفعة التالية
+            self._restore(users, stats, events, bank)
+            raise
+        return flushed
+
+    def _restore(self, users: Dict[str, Dict], stats: Counter, events: List[Dict], bank: List[Tuple]) -> None:
+        for uid, delta in users.items():
+            u = self._users.get(uid)
+            if u is None:
+                self._users[uid] = delta
+            else:
+                u["quizzes_taken"] += delta["quizzes_taken"]
+                u["total_score"] += delta["total_score"]
+                u["last_activity"] = max(u["last_activity"] or "", delta["last_activity"])
+            self.pending += delta["quizzes_taken"]
+        self._stats.update(stats)
+        self._events = events + self._events
+        self._bank_answers = bank + self._bank_answers
+        self.pending += len(events) + len(bank)